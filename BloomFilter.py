@@ -1,9 +1,38 @@
-from BitVector import BitVector
-from BitHash import BitHash
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from filterStats import FilterStats
+import filterPlanner
+import bloomCodec
+import bloomHashing
+import numpy as np
+import itertools
+import pytest
+import os
+import struct
 import math 
+import mmap
+import time
+
+# how the bits of a Bloom Filter are laid out. 
+# FLAT lets every probe of a key land anywhere in the N bits. 
+# BLOCKED keeps all the probes of a key inside one block of BLOCK_BITS 
+# bits (the first probe picks the block), so that a find on a filter too
+# big for the cpu cache touches one cache line instead of numHashes of them.
+# the index of a layout in LAYOUTS is what gets saved in the file header
+FLAT = "flat"
+BLOCKED = "blocked"
+LAYOUTS = (FLAT, BLOCKED)
+BLOCK_BITS = 512
 
 # a bloomfilter is an array of bits
 class BloomFilter(object):
+    # a saved Bloom Filter file is a 64 byte header followed by the raw 
+    # packed bits. the header holds: magic, N, numHashes, numInserted, 
+    # bitCount, maxFalsePositive, the index of the hashing strategy 
+    # in bloomHashing.STRATEGIES, and the index of the layout in LAYOUTS
+    # (the rest is padding, for future use)
+    __MAGIC = b"BLOOMF01"
+    __HEADER = struct.Struct("<8sQQQQdBB14x")
+    
     # Return the estimated number of bits needed in a Bloom Filter that 
     # will store numKeys keys, using numHashes hash functions, and that 
     # will have a false positive rate of maxFalsePositive.
@@ -11,8 +40,12 @@ class BloomFilter(object):
     # You use equation B to get the desired phi from P and d
     # You then use equation D to get the needed N from d, phi, and n
     # N is the value to return from bitsNeeded
+    # (a BLOCKED filter doesn't follow those equations, see __blockedBitsNeeded)
     
-    def __bitsNeeded(self, numKeys, numHashes, maxFalsePositive):
+    def __bitsNeeded(self, numKeys, numHashes, maxFalsePositive, layout = FLAT):
+        if layout == BLOCKED:
+            return self.__blockedBitsNeeded(numKeys, numHashes, maxFalsePositive)
+        
         #eq P phi = (1-P**(1/d))
         phi = (1-maxFalsePositive**(1/numHashes))
         
@@ -25,23 +58,111 @@ class BloomFilter(object):
     
         return math.ceil(N)
     
+    # Returns the false positive rate of a BLOCKED filter of numBlocks blocks
+    # after numKeys keys were inserted. The number of keys that end up in 
+    # any one block is Poisson with mean lambda = numKeys/numBlocks, and a 
+    # block that got k keys is like a tiny flat filter of BLOCK_BITS bits 
+    # holding k keys, so: P = sum over k of Poisson(k) * (1-(1-1/B)**(d*k))**d
+    @staticmethod
+    def __blockedFalsePositive(numKeys, numHashes, numBlocks):
+        lam = numKeys / numBlocks
+        if lam == 0: return 0.0
+        
+        # the Poisson terms are negligible more than ~10 std devs above the mean
+        P = 0.0
+        for k in range(int(lam + 10 * math.sqrt(lam) + 10)):
+            poisson = math.exp(k * math.log(lam) - lam - math.lgamma(k + 1))
+            P += poisson * (1 - (1 - 1/BLOCK_BITS)**(numHashes * k))**numHashes
+        return P
+    
+    # Return the number of bits a BLOCKED filter needs to store numKeys keys
+    # with numHashes hashes and a false positive rate of maxFalsePositive.
+    # Unevenly loaded blocks cost some accuracy, so a blocked filter needs
+    # a bit more room than the flat N. Starting from the flat N, keep 
+    # doubling the number of blocks until the rate is low enough, then 
+    # binary search back down to the fewest blocks that still make it.
+    def __blockedBitsNeeded(self, numKeys, numHashes, maxFalsePositive):
+        lo = 0
+        hi = max(1, math.ceil(self.__bitsNeeded(numKeys, numHashes, maxFalsePositive) / BLOCK_BITS))
+        while self.__blockedFalsePositive(numKeys, numHashes, hi) > maxFalsePositive:
+            lo = hi
+            hi *= 2
+            
+        # invariant: lo blocks are too few, hi blocks are enough
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.__blockedFalsePositive(numKeys, numHashes, mid) > maxFalsePositive:
+                lo = mid
+            else: 
+                hi = mid
+        
+        return hi * BLOCK_BITS
+    
+    # picks numHashes for a filter of numKeys keys with a false positive 
+    # rate of maxFalsePositive: the one that needs the least memory, or 
+    # with max_bytes the fewest hashes that fit in max_bytes, never more 
+    # than max_probes. With calibrate the hashing is timed on this machine 
+    # first, and max_ns limits the estimated ns to hash a key (see 
+    # filterPlanner.py). Returns a dict, and the filter is
+    #     BloomFilter(numKeys, p["numHashes"], p["maxFalsePositive"], hashing, layout)
+    # if max_bytes is too small for maxFalsePositive, p["meetsTarget"] is
+    # False and p["maxFalsePositive"] is the lowest rate that does fit.
+    # A max_bytes too small for even that (less than a block, or a rate
+    # of 1) raises ValueError.
+    @classmethod
+    def plan(cls, numKeys, maxFalsePositive, max_bytes = None, max_probes = None, max_ns = None,
+             hashing = bloomHashing.CHAINED, layout = FLAT, calibrate = False):
+        bloomHashing.checkHashing(hashing)
+        sizer = cls.__new__(cls)
+        block = BLOCK_BITS if layout == BLOCKED else 0
+        
+        def bytesNeeded(d, P):
+            return (sizer.__bitsNeeded(numKeys, d, P, layout) + 7) // 8
+        
+        def falsePositiveAt(d, numBytes):
+            if block:
+                return cls.__blockedFalsePositive(numKeys, d, numBytes * 8 // block)
+            # equations C and A, which only hold with more bits than hashes
+            if d >= numBytes * 8: return 1.0
+            return (1 - (1 - d / (numBytes * 8))**numKeys)**d
+        
+        return filterPlanner.plan(numKeys, maxFalsePositive, bytesNeeded, falsePositiveAt, max_bytes, 
+                                  max_probes, max_ns, hashing, block, calibrate, max(1, block // 8))
+    
     # Create a Bloom Filter that will store numKeys keys, using 
     # numHashes hash functions, and that will have a false positive 
     # rate of maxFalsePositive.
+    # hashing picks how the numHashes positions of a key are computed,
+    # see bloomHashing.py. "chained" is the original way, "double" and 
+    # "single" only hash each key once or twice whatever numHashes is.
+    # layout is FLAT or BLOCKED (see the top of this file).
+    # cacheSize is how many keys to remember the positions of (see setCacheSize).
     # All attributes must be private.
-    def __init__(self, numKeys, numHashes, maxFalsePositive):
+    def __init__(self, numKeys, numHashes, maxFalsePositive, hashing = bloomHashing.CHAINED, 
+                 layout = FLAT, cacheSize = 0):
+        if layout not in LAYOUTS:
+            raise ValueError("unknown layout " + repr(layout) + ", expected one of " + ", ".join(LAYOUTS))
+        
         # will need to use __bitsNeeded to figure out how big
         # of a BitVector will be needed
            
         # size of the bitvector
-        self.__N = self.__bitsNeeded(numKeys, numHashes, maxFalsePositive)
+        self.__N = self.__bitsNeeded(numKeys, numHashes, maxFalsePositive, layout)
         
-        # creating the bitvector array 
-        self.__BV = BitVector(size = self.__N)
+        # how many bits each key's probes are kept inside of, 0 when FLAT
+        self.__block = BLOCK_BITS if layout == BLOCKED else 0
+        
+        # creating the bit array, packed 8 bits to a byte (bit i lives in
+        # byte i >> 3 under the mask 1 << (i & 7)) so that the batch methods 
+        # can look at the very same buffer as a numpy array
+        self.__BV = bytearray((self.__N + 7) // 8)
         
         # numhashes
         self.__numHashes = numHashes
         
+        # how the positions of each key are computed
+        self.__hashing = bloomHashing.checkHashing(hashing)
+        
         # false positive rate
         self.__falsePositive = maxFalsePositive
         
@@ -50,51 +171,271 @@ class BloomFilter(object):
         
         # num of bits set
         self.__bitCount = 0
+        
+        # the mmap that __BV lives in when the filter came from open(), 
+        # None when it is an ordinary in memory filter
+        self.__mmap = None
+        
+        # recently used keys and their positions, None when turned off
+        self.__cache = None
+        self.setCacheSize(cacheSize)
+        
+        # counters and latencies, None unless enableStats is called
+        self.__stats = None
            
     
     # insert the specified key into the Bloom Filter.
     # Doesn't return anything, since an insert into 
     # a Bloom Filter always succeeds!
     def insert(self, key):
+        self.__checkWritable()
+        if self.__stats is not None: 
+            return self.__insertWithStats(key)
         
         # increment the number of inserted keys
         self.__numInserted+=1
-        # by default it will be zero 
-        hashval = 0
-        
-        # for each i we do a bithash of the key for the hashval which will be the prev hash val
         
-        ## for counting bloom filter, no loop
-        
-        for i in range(self.__numHashes): #loop d times
-            # the point is that you keep updating it for the different values 
-            # rehash the prev hashval
-            hashval = BitHash(key, hashval)
+        # get the d positions of the key (for the chained strategy, each one 
+        # is a bithash of the key seeded with the prev hashval) already 
+        # modded by the size of the BV
+        for moddedHashval in self.__positions(key):
             
             # use the moddedhashval as the "check mark" for your bloom filter 
-            moddedHashval = hashval % self.__N   
+            byte = moddedHashval >> 3
+            mask = 1 << (moddedHashval & 7)
        
             ## for CBF, increment the count by 1 (and set the hashval positon to whatever number the count is at )
             # only increment bitCount if this position has not yet been accounted for
-            if self.__BV[moddedHashval] == 0: self.__bitCount+=1            
-            
-            self.__BV[moddedHashval] = 1  # set hashval position mod size of BV bit to 1
+            if not self.__BV[byte] & mask: 
+                self.__bitCount+=1            
+                self.__BV[byte] |= mask  # set hashval position mod size of BV bit to 1
          
          # you dont need to return anything because it always succeeds    
       
     # Returns True if key MAY have been inserted into the Bloom filter. 
     # Returns False if key definitely hasn't been inserted into the BF.   
     def find(self, key):
-        hashval = 0
-        for i in range(self.__numHashes):
-            # get the hash value and then reduce the number 
-            hashval = BitHash(key, hashval)
-            moddedHashval = hashval % self.__N               
-            if self.__BV[moddedHashval] == 0: return False
+        if self.__stats is not None: 
+            return self.__findWithStats(key)
+        
+        for moddedHashval in self.__positions(key):
+            if not self.__BV[moddedHashval >> 3] & (1 << (moddedHashval & 7)): return False
             
         # after you fall out of the loop, all locations of hashes forsure have the key there
         return True
+    
+    # returns the positions of key, from the cache if it is turned on.
+    # without the cache they are computed lazily, so a find can stop early
+    def __positions(self, key):
+        if self.__cache is None:
+            return bloomHashing.positions(key, self.__numHashes, self.__N, self.__hashing, self.__block)
+        return self.__cache.get(key, lambda: bloomHashing.positions(
+            key, self.__numHashes, self.__N, self.__hashing, self.__block))
+    
+    # start keeping stats (see filterStats.py) of this filter's inserts and
+    # finds, and return them. The counters are "hashRounds" (BitHash digests
+    # computed), "probes" (bits looked at by finds), "finds", "findMisses"
+    # (finds that returned False, most of them before their last probe), 
+    # "inserts" and "bitsSet" (bits an insert turned on), and fillRatio is 
+    # numBitsSet()/N. If stats are already on, the same object is returned.
+    def enableStats(self):
+        if self.__stats is None:
+            self.__stats = FilterStats(lambda: self.__bitCount / self.__N)
+        return self.__stats
+    
+    # stop keeping stats, which makes every call as fast as before
+    def disableStats(self):
+        self.__stats = None
+    
+    # returns the FilterStats of this filter, or None if they are off
+    def stats(self):
+        return self.__stats
+    
+    # returns the positions of key, and whether their hash rounds still need
+    # counting: cache misses count all of theirs as they are computed, and a
+    # lazy generator only costs the rounds for the positions actually taken
+    def __statsPositions(self, key):
+        if self.__cache is None:
+            return self.__positions(key), True
+        
+        def compute():
+            self.__stats.add("hashRounds", bloomHashing.hashRounds(
+                self.__hashing, self.__numHashes, self.__numHashes))
+            return bloomHashing.positions(key, self.__numHashes, self.__N, self.__hashing, self.__block)
+        return self.__cache.get(key, compute), False
+    
+    # insert, counting and timing it into the stats
+    def __insertWithStats(self, key):
+        stats = self.__stats
+        start = time.perf_counter()
+        positions, lazy = self.__statsPositions(key)
+        
+        self.__numInserted += 1
+        newBits = 0
+        for moddedHashval in positions:
+            byte = moddedHashval >> 3
+            mask = 1 << (moddedHashval & 7)
+            if not self.__BV[byte] & mask:
+                newBits += 1
+                self.__BV[byte] |= mask
+        self.__bitCount += newBits
+        
+        stats.add("inserts")
+        stats.add("bitsSet", newBits)
+        if lazy:
+            stats.add("hashRounds", bloomHashing.hashRounds(self.__hashing, self.__numHashes, self.__numHashes))
+        stats.time("insert", time.perf_counter() - start)
+    
+    # find, counting its probes and timing it into the stats
+    def __findWithStats(self, key):
+        stats = self.__stats
+        start = time.perf_counter()
+        positions, lazy = self.__statsPositions(key)
+        
+        probes = 0
+        found = True
+        for moddedHashval in positions:
+            probes += 1
+            if not self.__BV[moddedHashval >> 3] & (1 << (moddedHashval & 7)):
+                found = False
+                break
+        
+        stats.add("finds")
+        stats.add("probes", probes)
+        if not found: 
+            stats.add("findMisses")
+        if lazy:
+            stats.add("hashRounds", bloomHashing.hashRounds(self.__hashing, self.__numHashes, probes))
+        stats.time("find", time.perf_counter() - start)
+        return found
+    
+    # keep the positions of the cacheSize most recently used keys, so that 
+    # inserting or finding a hot key again skips the hashing. 0 turns the
+    # cache off (and empties it), which is the default
+    def setCacheSize(self, cacheSize):
+        self.__cache = bloomHashing.PositionCache(cacheSize) if cacheSize > 0 else None
+    
+    # returns the size, maxSize, hits and misses of the cache, or None if it is off
+    def cacheStats(self):
+        return None if self.__cache is None else self.__cache.stats()
+    
+    # returns a numpy array with one row per key, holding the numHashes
+    # positions that insert and find would probe for that key
+    def __positionsMany(self, keys):
+        return bloomHashing.positionsMany(keys, self.__numHashes, self.__N, self.__hashing, self.__block)
+    
+    # splits any iterable of keys into lists of at most __BATCH keys, so that 
+    # huge inputs (or generators) never have to be held in memory all at once
+    __BATCH = 1 << 16
+    def __batches(self, keys):
+        keys = iter(keys)
+        while True:
+            batch = list(itertools.islice(keys, self.__BATCH))
+            if not batch: return
+            yield batch
+    
+    # insert every key of the iterable into the Bloom Filter. 
+    # Same result as calling insert on each key, but the positions of 
+    # each batch of keys are hashed together and set with a single 
+    # numpy pass over the packed bit array.
+    def insert_many(self, keys):
+        self.__checkWritable()
+        stats = self.__stats
+        if stats is not None:
+            start = time.perf_counter()
+            bitsBefore = self.__bitCount
+        bits = np.frombuffer(self.__BV, dtype=np.uint8)
+        
+        for batch in self.__batches(keys):
+            self.__numInserted += len(batch)
+            if stats is not None:
+                stats.add("inserts", len(batch))
+                stats.add("hashRounds", len(batch) * bloomHashing.hashRounds(
+                    self.__hashing, self.__numHashes, self.__numHashes))
+            
+            # several keys (or several hashes of one key) can land on the same 
+            # bit, so only count each position once to keep bitCount exact
+            positions = np.unique(self.__positionsMany(batch))
+            byteIdx = positions >> 3
+            masks = (1 << (positions & 7)).astype(np.uint8)
+            
+            self.__bitCount += int(np.count_nonzero((bits[byteIdx] & masks) == 0))
+            
+            # bitwise_or.at because different positions can share the same byte
+            np.bitwise_or.at(bits, byteIdx, masks)
+        
+        if stats is not None:
+            stats.add("bitsSet", self.__bitCount - bitsBefore)
+            stats.time("insert_many", time.perf_counter() - start)
+    
+    # returns a list with one bool per key of the iterable, the same 
+    # answers that find would give for each key, but tested a batch at a time
+    def find_many(self, keys):
+        stats = self.__stats
+        if stats is not None:
+            start = time.perf_counter()
+        bits = np.frombuffer(self.__BV, dtype=np.uint8)
+        ans = []
+        
+        for batch in self.__batches(keys):
+            positions = self.__positionsMany(batch)
+            
+            # a key may be there only if every one of its numHashes bits is set
+            isSet = (bits[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1
+            found = isSet.all(axis = 1)
+            ans.extend(found.tolist())
+            
+            # the batch probes every bit of every key, there is no stopping early
+            if stats is not None:
+                stats.add("finds", len(batch))
+                stats.add("probes", positions.size)
+                stats.add("findMisses", len(batch) - int(np.count_nonzero(found)))
+                stats.add("hashRounds", len(batch) * bloomHashing.hashRounds(
+                    self.__hashing, self.__numHashes, self.__numHashes))
+        
+        if stats is not None:
+            stats.time("find_many", time.perf_counter() - start)
+        return ans
        
+    # returns (numHashes, N, hashing, block): with these, 
+    #     bloomHashing.positionsMany(keys, *bf.positionArgs())
+    # computes the positions of keys for this filter anywhere, e.g. in 
+    # another process, for insert_positions to use
+    def positionArgs(self):
+        return (self.__numHashes, self.__N, self.__hashing, self.__block)
+    
+    # test-and-set for a whole batch: positions has one row of numHashes 
+    # positions per key (from positionsMany), and the keys are inserted in
+    # order. Returns a numpy array of one bool per key, True if the key 
+    # was NOT already there, i.e. if a find just before its own insert 
+    # would have said False (keys earlier in the same batch count too).
+    def insert_positions(self, positions):
+        self.__checkWritable()
+        if len(positions) == 0:
+            return np.zeros(0, dtype=bool)
+        bits = np.frombuffer(self.__BV, dtype=np.uint8)
+        
+        # a position of key j was set before key j's insert if it was set 
+        # already, or if some key before j in the batch has it too
+        flat = positions.ravel()
+        rows = np.repeat(np.arange(len(positions)), positions.shape[1])
+        unique, which = np.unique(flat, return_inverse = True)
+        firstRow = np.full(len(unique), len(positions))
+        np.minimum.at(firstRow, which, rows)
+        
+        byteIdx = unique >> 3
+        masks = (1 << (unique & 7)).astype(np.uint8)
+        wasSet = (bits[byteIdx] & masks) != 0
+        setBefore = (wasSet[which] | (firstRow[which] < rows)).reshape(positions.shape)
+        
+        self.__numInserted += len(positions)
+        self.__bitCount += int(np.count_nonzero(~wasSet))
+        np.bitwise_or.at(bits, byteIdx, masks)
+        if self.__stats is not None:
+            self.__stats.add("inserts", len(positions))
+            self.__stats.add("bitsSet", int(np.count_nonzero(~wasSet)))
+        return ~setBefore.all(axis = 1)
+    
     # Returns the PROJECTED current false positive rate based on the
     # ACTUAL current number of bits actually set in this Bloom Filter. 
     # This is NOT the same thing as trying to use the Bloom Filter and
@@ -103,14 +444,24 @@ class BloomFilter(object):
     # What is phi in this case? it is the ACTUAL measured current proportion 
     # of bits in the bit vector that are still zero. 
     def falsePositiveRate(self):
+        return self.__projectedFalsePositive(self.__numInserted, self.__numHashes, self.__N, self.__block)
+        #return 0.0   # replace this line with your code
+    
+    # the projected false positive rate of a filter of N bits (in blocks 
+    # of block bits, or flat for 0) with numHashes hashes and numInserted keys
+    @staticmethod
+    def __projectedFalsePositive(numInserted, numHashes, N, block):
+        # the probes of a BLOCKED filter aren't spread over all N bits
+        if block:
+            return BloomFilter.__blockedFalsePositive(numInserted, numHashes, N // block)
+        
         # phi = (1 - (d/ N)) **n
         # P = (1-phi)**d
         # equation c
-        phi = (1- (self.__numHashes/self.__N))**self.__numInserted
+        phi = (1- (numHashes/N))**numInserted
        # equation a
-        P = (1-phi)**self.__numHashes
+        P = (1-phi)**numHashes
         return P
-        #return 0.0   # replace this line with your code
        
     # Returns the current number of bits ACTUALLY set in this Bloom Filter
     # WHEN TESTING, MAKE SURE THAT YOUR IMPLEMENTATION DOES NOT CAUSE
@@ -118,6 +469,285 @@ class BloomFilter(object):
     def numBitsSet(self):
         # that will tell us how many bits are set.
         return self.__bitCount
+    
+    # returns how many bytes the bits take up
+    def numBytes(self):
+        return len(self.__BV)
+    
+    # counts the set bits of a packed buffer, a few MB at a time so that 
+    # even a multi-GB filter never needs a second copy of itself in memory
+    __POPCOUNT_CHUNK = 1 << 22
+    @classmethod
+    def __popcount(cls, buf):
+        buf = memoryview(buf)
+        count = 0
+        for i in range(0, len(buf), cls.__POPCOUNT_CHUNK):
+            count += int.from_bytes(buf[i:i + cls.__POPCOUNT_CHUNK], "little").bit_count()
+        return count
+    
+    # returns a new, empty, in memory filter with the same parameters as this one
+    def __emptyCopy(self):
+        bf = BloomFilter.__new__(BloomFilter)
+        bf.__N = self.__N
+        bf.__block = self.__block
+        bf.__BV = bytearray(len(self.__BV))
+        bf.__numHashes = self.__numHashes
+        bf.__hashing = self.__hashing
+        bf.__falsePositive = self.__falsePositive
+        bf.__numInserted = 0
+        bf.__bitCount = 0
+        bf.__mmap = None
+        bf.__cache = None
+        bf.__stats = None
+        return bf
+    
+    # two filters can only be merged if every key sets the same bits in both
+    def __checkCompatible(self, other):
+        if (self.__N, self.__numHashes, self.__hashing, self.__block) != \
+           (other.__N, other.__numHashes, other.__hashing, other.__block):
+            raise ValueError("can only merge Bloom Filters with the same size, "
+                             "numHashes, hashing and layout")
+    
+    # combine the bits of other into the bits of into, bit by bit with 
+    # bitwiseOp, and recount them
+    def __combine(self, other, bitwiseOp, into):
+        self.__checkCompatible(other)
+        a = np.frombuffer(self.__BV, dtype=np.uint8)
+        b = np.frombuffer(other.__BV, dtype=np.uint8)
+        bitwiseOp(a, b, out = np.frombuffer(into.__BV, dtype=np.uint8))
+        into.__bitCount = self.__popcount(into.__BV)
+    
+    # Returns a new Bloom Filter that holds every key inserted into 
+    # either this filter or other (a find on it is True whenever a find on 
+    # either of them is). Both must have been created with the same arguments.
+    def union(self, other):
+        bf = self.__emptyCopy()
+        self.__combine(other, np.bitwise_or, bf)
+        
+        # keys inserted into both filters only count once, so estimate how 
+        # many there are from the bits that are set (see __estimateInserted).
+        # it is at least as many as either filter had, and at most both
+        bf.__numInserted = min(max(bf.__estimateInserted(), self.__numInserted, other.__numInserted),
+                               self.__numInserted + other.__numInserted)
+        return bf
+    
+    # Returns a new Bloom Filter whose bits are set only where they are set 
+    # in both this filter and other. Every key in both filters is found in it, 
+    # but its false positive rate is a bit higher than a filter that only 
+    # had the common keys inserted would have.
+    def intersection(self, other):
+        bf = self.__emptyCopy()
+        self.__combine(other, np.bitwise_and, bf)
+        
+        # nobody knows how many keys the two filters have in common, so estimate it 
+        # from the bits that are left (it can't be more than either filter had inserted)
+        bf.__numInserted = min(bf.__estimateInserted(), self.__numInserted, other.__numInserted)
+        return bf
+    
+    # returns an estimate of how many distinct keys were inserted, from the
+    # bits that are set: n = -(N/d) * ln(1 - bitsSet/N), or a huge number
+    # once every bit is set
+    def __estimateInserted(self):
+        if self.__bitCount >= self.__N:
+            return 2**63
+        return round(-(self.__N / self.__numHashes) * math.log(1 - self.__bitCount / self.__N))
+    
+    # Build a Bloom Filter from a list of keys on several cores at once. 
+    # The keys are split into one shard per worker process, each worker 
+    # builds its own filter (with the same arguments) from its shard, and 
+    # the filters are OR'ed together as they come back.
+    # the result is the same filter that inserting every key would give.
+    @classmethod
+    def build(cls, keys, numKeys, numHashes, maxFalsePositive, hashing = bloomHashing.CHAINED,
+              layout = FLAT, workers = None):
+        keys = list(keys)
+        args = (numKeys, numHashes, maxFalsePositive, hashing, layout)
+        workers = max(1, min(workers or os.cpu_count() or 1, len(keys) // cls.__BATCH))
+        
+        # not worth starting any processes for
+        if workers == 1:
+            return _buildShard(keys, args)
+        
+        shardSize = math.ceil(len(keys) / workers)
+        merged = None
+        with ProcessPoolExecutor(workers) as pool:
+            shards = [pool.submit(_buildShard, keys[i:i + shardSize], args) 
+                      for i in range(0, len(keys), shardSize)]
+            
+            for shard in as_completed(shards):
+                bf = shard.result()
+                if merged is None: 
+                    merged = bf
+                    continue
+                
+                # OR straight into merged instead of making a new filter each time
+                a = np.frombuffer(merged.__BV, dtype=np.uint8)
+                np.bitwise_or(a, np.frombuffer(bf.__BV, dtype=np.uint8), out = a)
+                merged.__numInserted += bf.__numInserted
+        
+        merged.__bitCount = cls.__popcount(merged.__BV)
+        return merged
+    
+    # a filter opened with mode "r" can only be searched
+    def __checkWritable(self):
+        if isinstance(self.__BV, memoryview) and self.__BV.readonly:
+            raise ValueError("can't insert into a Bloom Filter opened read-only")
+    
+    # write the header values to the front of buf
+    def __packHeader(self, buf):
+        self.__HEADER.pack_into(buf, 0, self.__MAGIC, self.__N, self.__numHashes, 
+                                self.__numInserted, self.__bitCount, self.__falsePositive,
+                                bloomHashing.STRATEGIES.index(self.__hashing),
+                                LAYOUTS.index(FLAT if not self.__block else BLOCKED))
+    
+    # write this Bloom Filter to the file at path, so that it can later 
+    # be opened (and shared between processes) without rebuilding it
+    def save(self, path):
+        header = bytearray(self.__HEADER.size)
+        self.__packHeader(header)
+        
+        with open(path, "wb") as file:
+            file.write(header)
+            file.write(self.__BV)
+    
+    # returns this Bloom Filter as bytes: the same header as save, followed
+    # by the bits in the encoding of bloomCodec.py that makes them smallest
+    # (gap coded while the filter is sparse, raw once it is too full for that)
+    def to_compressed(self):
+        header = bytearray(self.__HEADER.size)
+        self.__packHeader(header)
+        return bytes(header) + bloomCodec.encode(self.__BV, self.__N)
+    
+    # returns the hashing strategy and the block size (0 for FLAT) that a
+    # header saved as the indexes hashing and layout, raising ValueError
+    # when either isn't one this version knows
+    @staticmethod
+    def __headerLayout(hashing, layout):
+        if hashing >= len(bloomHashing.STRATEGIES):
+            raise ValueError("unknown hashing index " + repr(hashing) + " in the header")
+        if layout >= len(LAYOUTS):
+            raise ValueError("unknown layout index " + repr(layout) + " in the header")
+        return bloomHashing.STRATEGIES[hashing], BLOCK_BITS if LAYOUTS[layout] == BLOCKED else 0
+    
+    # returns the header values of compressed data from to_compressed, and the rest of it
+    @classmethod
+    def __unpackCompressed(cls, data):
+        data = memoryview(data)
+        if len(data) < cls.__HEADER.size or bytes(data[:len(cls.__MAGIC)]) != cls.__MAGIC:
+            raise ValueError("not a compressed Bloom Filter")
+        return cls.__HEADER.unpack_from(data, 0), data[cls.__HEADER.size:]
+    
+    # returns a new, in memory Bloom Filter from the bytes of to_compressed
+    @classmethod
+    def from_compressed(cls, data):
+        header, encoded = cls.__unpackCompressed(data)
+        magic, N, numHashes, numInserted, bitCount, maxFalsePositive, hashing, layout = header
+        hashing, block = cls.__headerLayout(hashing, layout)
+        
+        bf = cls.__new__(cls)
+        bf.__N = N
+        bf.__numHashes = numHashes
+        bf.__hashing = hashing
+        bf.__block = block
+        bf.__falsePositive = maxFalsePositive
+        bf.__numInserted = numInserted
+        bf.__bitCount = bitCount
+        bf.__mmap = None
+        bf.__cache = None
+        bf.__stats = None
+        bf.__BV = bloomCodec.decode(encoded, N)
+        return bf
+    
+    # returns a read-only CompressedBloomFilter (see bloomCodec.py) that 
+    # answers find and find_many straight from the bytes of to_compressed,
+    # without unpacking the bits of a sparse filter
+    @classmethod
+    def read_compressed(cls, data):
+        header, encoded = cls.__unpackCompressed(data)
+        magic, N, numHashes, numInserted, bitCount, maxFalsePositive, hashing, layout = header
+        
+        hashing, block = cls.__headerLayout(hashing, layout)
+        return bloomCodec.CompressedBloomFilter(
+            encoded, (numHashes, N, hashing, block), 
+            numInserted, cls.__projectedFalsePositive(numInserted, numHashes, N, block))
+    
+    # open a Bloom Filter file written by save. The file is memory mapped 
+    # rather than read in, so opening is instant whatever the size, find only
+    # touches the pages it needs, and every process that opens the same file
+    # read-only shares one copy of it through the page cache.
+    # mode "r" is read-only, mode "r+" allows inserts, which go straight 
+    # to the file (the header is brought up to date by flush or close).
+    @classmethod
+    def open(cls, path, mode = "r"):
+        if mode not in ("r", "r+"):
+            raise ValueError("mode must be 'r' or 'r+', not " + repr(mode))
+        
+        # the mmap keeps its own handle on the file, so the file can be closed right away
+        with open(path, "rb" if mode == "r" else "r+b") as file:
+            access = mmap.ACCESS_READ if mode == "r" else mmap.ACCESS_WRITE
+            mm = mmap.mmap(file.fileno(), 0, access = access)
+        
+        if len(mm) < cls.__HEADER.size or mm[:len(cls.__MAGIC)] != cls.__MAGIC:
+            mm.close()
+            raise ValueError(repr(path) + " is not a saved Bloom Filter")
+        
+        magic, N, numHashes, numInserted, bitCount, maxFalsePositive, hashing, layout = \
+            cls.__HEADER.unpack_from(mm, 0)
+        
+        numBytes = (N + 7) // 8
+        if len(mm) != cls.__HEADER.size + numBytes:
+            mm.close()
+            raise ValueError(repr(path) + " is truncated or has trailing data")
+        try:
+            hashing, block = cls.__headerLayout(hashing, layout)
+        except ValueError as e:
+            mm.close()
+            raise ValueError(repr(path) + ": " + str(e)) from None
+        
+        # build the object around the mapped bits instead of calling __init__, 
+        # which would allocate a new empty bit array
+        bf = cls.__new__(cls)
+        bf.__N = N
+        bf.__numHashes = numHashes
+        bf.__hashing = hashing
+        bf.__block = block
+        bf.__falsePositive = maxFalsePositive
+        bf.__numInserted = numInserted
+        bf.__bitCount = bitCount
+        bf.__mmap = mm
+        bf.__cache = None
+        bf.__stats = None
+        bf.__BV = memoryview(mm)[cls.__HEADER.size:]
+        return bf
+    
+    # write numInserted and bitCount back into the header of a filter 
+    # opened with mode "r+" and push the changed pages out to the file
+    def flush(self):
+        if self.__mmap is not None and not self.__BV.readonly:
+            self.__packHeader(self.__mmap)
+            self.__mmap.flush()
+    
+    # flush and unmap a filter that came from open. 
+    # The filter can't be used after it is closed.
+    def close(self):
+        if self.__mmap is not None:
+            self.flush()
+            self.__BV.release()
+            self.__mmap.close()
+            self.__mmap = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+# builds one shard's filter for BloomFilter.build. It has to live at the top 
+# of the module so that the worker processes can find it.
+def _buildShard(keys, args):
+    bf = BloomFilter(*args)
+    bf.insert_many(keys)
+    return bf
         
 def __main():
     
@@ -174,5 +804,221 @@ def __main():
     # proportion of the num of falsely found keys divided by the total number of keys  
     print("percentage of false positives:",str((found / numKeys) * 100))
        
+# implement pytests to check the methods work accurately
+
+# keys for the tests that don't need real words
+def makeKeys(num, prefix = "key"):
+    return [prefix + str(i) for i in range(num)]
+
+# test that insert_many and find_many give the same filter, and the same
+# answers, as insert and find one key at a time, for every hashing
+# strategy and both layouts, with duplicate keys and with no keys at all
+def test_batchMatchesSingle():
+    keys = makeKeys(2000) + makeKeys(300)      # the last 300 are repeats
+    others = makeKeys(2000, "other")
+    for hashing in bloomHashing.STRATEGIES:
+        for layout in LAYOUTS:
+            single = BloomFilter(2000, 4, .01, hashing, layout)
+            batch = BloomFilter(2000, 4, .01, hashing, layout)
+            for key in keys: single.insert(key)
+            batch.insert_many(iter(keys))
+            
+            assert batch.to_compressed() == single.to_compressed()
+            assert batch.numBitsSet() == single.numBitsSet()
+            assert batch.find_many(keys + others) == [single.find(k) for k in keys + others]
+            assert all(batch.find_many(keys))
+            
+            # nothing in, nothing out, and nothing changed
+            batch.insert_many([])
+            assert batch.find_many([]) == []
+            assert batch.to_compressed() == single.to_compressed()
+
+# test that the positions a find computes lazily (and stops taking at the
+# first bit that is clear) are the same as the batch ones, and as the
+# cached ones
+def test_lazyPositions():
+    for hashing in bloomHashing.STRATEGIES:
+        for layout in LAYOUTS:
+            bf = BloomFilter(1000, 5, .01, hashing, layout)
+            numHashes, N, hashing, block = bf.positionArgs()
+            keys = makeKeys(50)
+            rows = bloomHashing.positionsMany(keys, numHashes, N, hashing, block)
+            for key, row in zip(keys, rows.tolist()):
+                lazy = bloomHashing.positions(key, numHashes, N, hashing, block)
+                assert next(lazy) == row[0]
+                assert [row[0]] + list(lazy) == row
+            
+            # a find on an empty filter stops at its first probe
+            stats = bf.enableStats()
+            assert not bf.find("nothing")
+            assert stats.get("probes") == 1
+            bf.disableStats()
+            
+            # and the cache gives the same answers as no cache
+            bf.insert_many(keys[:25])
+            cached = [bf.find(k) for k in keys]
+            bf.setCacheSize(10)
+            assert [bf.find(k) for k in keys] == cached == [True] * 25 + bf.find_many(keys[25:])
+
+# test that a saved filter opens with the same bits and answers, read-only
+# with "r", and that inserts through "r+" are in the file after close
+def test_saveOpen(tmp_path):
+    path = str(tmp_path / "bf.bloom")
+    bf = BloomFilter(1000, 4, .01, bloomHashing.DOUBLE, BLOCKED)
+    bf.insert_many(makeKeys(500))
+    bf.save(path)
+    keys = makeKeys(1000)
+    
+    with BloomFilter.open(path) as ro:
+        assert ro.find_many(keys) == bf.find_many(keys)
+        assert (ro.numBitsSet(), ro.falsePositiveRate()) == (bf.numBitsSet(), bf.falsePositiveRate())
+        with pytest.raises(ValueError):
+            ro.insert("new")
+        with pytest.raises(ValueError):
+            ro.insert_many(["new"])
+    
+    rw = BloomFilter.open(path, "r+")
+    rw.insert("new")
+    rw.insert_many(makeKeys(500, "more"))
+    rw.close()
+    
+    bf.insert("new")
+    bf.insert_many(makeKeys(500, "more"))
+    with BloomFilter.open(path) as ro:
+        assert ro.find("new") and all(ro.find_many(makeKeys(500, "more")))
+        assert ro.to_compressed() == bf.to_compressed()
+
+# test that files that aren't whole saved filters are rejected
+def test_openBadFiles(tmp_path):
+    path = str(tmp_path / "bf.bloom")
+    BloomFilter(1000, 4, .01).save(path)
+    with open(path, "rb") as f:
+        good = f.read()
+    
+    for bad in (b"", good[:40], b"NOTBLOOM" + good[8:], good[:-1], good + b"x"):
+        with open(path, "wb") as f:
+            f.write(bad)
+        with pytest.raises(ValueError):
+            BloomFilter.open(path)
+    
+    # a hashing or layout index past the ones there are, in a file and in compressed bytes
+    hashingAt = 8 + 4 * 8 + 8
+    for at in (hashingAt, hashingAt + 1):
+        bad = bytearray(good)
+        bad[at] = 7
+        with open(path, "wb") as f:
+            f.write(bad)
+        with pytest.raises(ValueError, match = "index 7"):
+            BloomFilter.open(path)
+        
+        compressed = bytearray(BloomFilter(1000, 4, .01).to_compressed())
+        compressed[at] = 7
+        for read in (BloomFilter.from_compressed, BloomFilter.read_compressed):
+            with pytest.raises(ValueError, match = "index 7"):
+                read(bytes(compressed))
+    
+    with pytest.raises(ValueError):
+        BloomFilter.open(path, "w")
+
+# test that a full BLOCKED filter is sized for its rate, and that the rate
+# measured on keys that were never inserted is close to that projection.
+# The projection treats the probes inside a block as independent. That
+# holds for chained hashing, so it gets 15%. Double hashing inside one
+# 512 bit block makes two keys' probes collide more often (measured up to
+# .0132 against .0100 with 7 hashes), so double and single get 50% above.
+def test_blockedFalsePositive():
+    n = 20000
+    keys = makeKeys(n)
+    others = makeKeys(100000, "other")
+    for hashing, tolerance in ((bloomHashing.CHAINED, .15), (bloomHashing.DOUBLE, .5), (bloomHashing.SINGLE, .5)):
+        for numHashes in (3, 7):
+            bf = BloomFilter(n, numHashes, .01, hashing, BLOCKED)
+            flat = BloomFilter(n, numHashes, .01, hashing)
+            assert bf.numBytes() >= flat.numBytes() and bf.numBytes() % (BLOCK_BITS // 8) == 0
+            
+            bf.insert_many(keys)
+            projected = bf.falsePositiveRate()
+            assert projected <= .01
+            
+            found = bf.find_many(others)
+            measured = sum(found) / len(others)
+            assert projected * (1 - tolerance) <= measured <= projected * (1 + tolerance)
+            
+            # a blocked find_many answers just like the blocked find
+            assert found[:5000] == [bf.find(k) for k in others[:5000]]
+
+# test that the union of two filters with mostly the same keys has the
+# bits of one filter with all of them, and projects about the same rate,
+# rather than the rate of a filter that got the common keys twice
+def test_union():
+    a = BloomFilter(20000, 5, .01, bloomHashing.DOUBLE)
+    b = BloomFilter(20000, 5, .01, bloomHashing.DOUBLE)
+    both = BloomFilter(20000, 5, .01, bloomHashing.DOUBLE)
+    a.insert_many(makeKeys(15000))
+    b.insert_many(makeKeys(20000)[5000:])
+    both.insert_many(makeKeys(20000))
+    
+    u = a.union(b)
+    assert all(u.find_many(makeKeys(20000)))
+    assert u.numBitsSet() == both.numBitsSet()
+    assert u.falsePositiveRate() == pytest.approx(both.falsePositiveRate(), rel = .1)
+    
+    # with no keys in common it is about both counts added up
+    c = BloomFilter(20000, 5, .01, bloomHashing.DOUBLE)
+    c.insert_many(makeKeys(5000, "other"))
+    assert a.union(c).falsePositiveRate() == pytest.approx(both.falsePositiveRate(), rel = .1)
+
+# test that the intersection finds every key of both filters
+def test_intersection():
+    a = BloomFilter(20000, 5, .01, bloomHashing.DOUBLE)
+    b = BloomFilter(20000, 5, .01, bloomHashing.DOUBLE)
+    a.insert_many(makeKeys(15000))
+    b.insert_many(makeKeys(20000)[5000:])
+    i = a.intersection(b)
+    assert all(i.find_many(makeKeys(15000)[5000:]))
+    assert i.numBitsSet() <= min(a.numBitsSet(), b.numBitsSet())
+    assert i.falsePositiveRate() <= a.falsePositiveRate()
+
+# test that filters that don't set the same bits for a key can't be merged
+def test_mergeMismatched():
+    bf = BloomFilter(1000, 4, .01)
+    for other in (BloomFilter(2000, 4, .01), BloomFilter(1000, 5, .01), 
+                  BloomFilter(1000, 4, .01, bloomHashing.DOUBLE), BloomFilter(1000, 4, .01, layout = BLOCKED)):
+        with pytest.raises(ValueError):
+            bf.union(other)
+        with pytest.raises(ValueError):
+            bf.intersection(other)
+
+# test that building on several cores gives exactly the filter a serial
+# build gives: every shard was big enough to get its own process
+def test_build():
+    keys = makeKeys(3 * (1 << 16) + 5)
+    serial = BloomFilter(len(keys), 4, .01, bloomHashing.DOUBLE)
+    serial.insert_many(keys)
+    built = BloomFilter.build(keys, len(keys), 4, .01, bloomHashing.DOUBLE, workers = 3)
+    assert built.to_compressed() == serial.to_compressed()
+    
+    # and with too few keys for more than one process
+    small = BloomFilter.build(keys[:100], len(keys), 4, .01, bloomHashing.DOUBLE, workers = 3)
+    assert small.find_many(keys[:100]) == [True] * 100
+
+# test that a tight budget gives up on the rate, and that a budget too
+# small for any useful filter is rejected instead of crashing
+def test_planBudget():
+    tight = BloomFilter.plan(10000, .01, max_bytes = 6000)
+    assert tight["meetsTarget"] == False and .01 < tight["maxFalsePositive"] < 1
+    assert tight["numBytes"] <= 6000
+    
+    # less than a block, or so few bits that every lookup is a false positive
+    for maxBytes in (0, 1, 10):
+        with pytest.raises(ValueError):
+            BloomFilter.plan(10000, .01, max_bytes = maxBytes)
+    for maxBytes in (0, 10, BLOCK_BITS // 8 - 1):
+        with pytest.raises(ValueError):
+            BloomFilter.plan(10000, .01, max_bytes = maxBytes, layout = BLOCKED)
+    
+    p = BloomFilter.plan(10000, .01, max_bytes = 6000, layout = BLOCKED)
+    assert p["meetsTarget"] == False and p["numBytes"] <= 6000
+
 if __name__ == '__main__':
     __main()       
\ No newline at end of file
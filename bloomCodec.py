@@ -0,0 +1,323 @@
+import bloomHashing
+import numpy as np
+import pytest
+import struct
+import math
+
+# a compact encoding of the packed bits of a Bloom Filter, for sending a
+# filter that is mostly zeros (e.g. one made big to leave room to grow)
+# over the network or to disk. BloomFilter.to_compressed and
+# from_compressed use it; CompressedBloomFilter answers finds straight from
+# it, for read-only replicas.
+#
+# RAW is the bits as they are. RICE is Golomb-Rice coding of the gaps
+# between set bits: a gap g is written as q = g >> k in unary (q ones and
+# a zero) and the low k bits r in binary. The unary parts of all the gaps
+# come first and then all the remainders, k bits each, so both halves can
+# be decoded with numpy a chunk at a time instead of gap by gap. The best k
+# depends on the fill ratio (about log2 of the average gap), and a gap
+# costs about k + 2 bits, so the lower the fill the more RICE saves. 
+# Whichever of the two comes out smaller is used, which for the random 
+# looking bits of a Bloom Filter means RICE up to a fill of about 40%.
+#
+# the bits are encoded and decoded CHUNK_BYTES at a time, carrying the last
+# set position over from one chunk to the next, so that (like
+# BloomFilter's popcount) neither ever needs more than a chunk's worth of
+# unpacked bits or positions in memory, however big the filter is.
+RAW = 0
+RICE = 1
+ENCODINGS = (RAW, RICE)
+
+# bytes of packed bits (of the filter, or of the unary parts) per chunk
+CHUNK_BYTES = 1 << 16
+
+# after the filter's own header: magic, encoding, k, the number of set
+# bits, and the number of bytes of unary parts
+__HEADER = struct.Struct("<8sBB6xQQ")
+__MAGIC = b"BLOOMZ01"
+HEADER_SIZE = __HEADER.size
+
+# yields the sorted positions of the set bits of packed bits, one numpy
+# array per chunk of the bits
+def setPositions(bits):
+    bits = np.frombuffer(bits, dtype=np.uint8)
+    for first in range(0, len(bits), CHUNK_BYTES):
+        chunk = np.unpackbits(bits[first:first + CHUNK_BYTES], bitorder = "little")
+        yield np.flatnonzero(chunk) + 8 * first
+
+# yields the gaps between set positions (the first one counts from
+# position 0), which are the numbers RICE codes, one array per chunk
+def __gaps(bits):
+    last = -1
+    for positions in setPositions(bits):
+        if len(positions) == 0: continue
+        yield np.diff(positions, prepend = last) - 1
+        last = positions[-1]
+
+# returns the number of set bits of packed bits
+def __popcount(bits):
+    bits = memoryview(bits)
+    return sum(int.from_bytes(bits[i:i + CHUNK_BYTES], "little").bit_count()
+               for i in range(0, len(bits), CHUNK_BYTES))
+
+# returns the distinct bytes that the sorted bit positions are in, and for
+# each of those the mask of its bits that are in positions
+def __byteMasks(positions):
+    byte = positions >> 3
+    first = np.flatnonzero(np.diff(byte, prepend = -1))
+    masks = np.left_shift(1, positions & 7).astype(np.uint8)
+    return byte[first], np.bitwise_or.reduceat(masks, first)
+
+# returns the k for numSet gaps with the fewest bits, looking around
+# log2 of the average gap, and the total of the unary parts for that k
+def __bestK(bits, numSet, numBits):
+    if numSet == 0: return 0, 0
+    guess = max(0, int(math.log2(max(1.0, numBits / numSet))))
+    ks = range(max(0, guess - 2), guess + 3)
+
+    sums = [0] * len(ks)
+    for gaps in __gaps(bits):
+        for i, k in enumerate(ks):
+            sums[i] += int(np.sum(gaps >> k))
+
+    # a gap costs its unary part, the zero after it, and k bits of remainder
+    i = min(range(len(ks)), key = lambda i: sums[i] + numSet * (1 + ks[i]))
+    return ks[i], sums[i]
+
+# returns the encoded form of the packed bits of a filter of numBits bits,
+# as the encoding header followed by the payload
+def encode(bits, numBits):
+    numSet = __popcount(bits)
+    k, sumQ = __bestK(bits, numSet, numBits)
+
+    # the unary parts and the remainders are each padded to a byte
+    unaryBits = sumQ + numSet
+    unaryBytes = (unaryBits + 7) // 8
+    remainderBytes = (numSet * k + 7) // 8
+    if unaryBytes + remainderBytes >= len(bits):
+        return __HEADER.pack(__MAGIC, RAW, 0, numSet, 0) + bytes(bits)
+
+    data = bytearray(__HEADER.size + unaryBytes + remainderBytes)
+    __HEADER.pack_into(data, 0, __MAGIC, RICE, k, numSet, unaryBytes)
+    unary = np.frombuffer(data, dtype=np.uint8, count = unaryBytes, offset = __HEADER.size)
+    remainders = np.frombuffer(data, dtype=np.uint8, offset = __HEADER.size + unaryBytes)
+
+    # unary parts: q ones and then a zero, for each gap. start from all
+    # ones and clear the zero that ends each gap, and the padding
+    unary[:] = 0xFF
+    end = -1
+    index = 0
+    for gaps in __gaps(bits):
+        ends = end + np.cumsum((gaps >> k) + 1)
+        byte, masks = __byteMasks(ends)
+        unary[byte] &= ~masks
+        end = ends[-1]
+
+        # the low k bits of gap i are bits i*k up to (i+1)*k of the
+        # remainders, lowest bit first. set them one bit of k at a time
+        which = np.arange(index, index + len(gaps)) * k
+        for j in range(k):
+            ones = np.flatnonzero((gaps >> j) & 1)
+            if len(ones) == 0: continue
+            byte, masks = __byteMasks(which[ones] + j)
+            remainders[byte] |= masks
+        index += len(gaps)
+
+    if unaryBits & 7:
+        unary[-1] &= (1 << (unaryBits & 7)) - 1
+    return bytes(data)
+
+# returns (encoding, what decodes it) for the encoded data of a filter of
+# numBits bits: for RAW that is the packed bits, and for RICE a generator
+# of the sorted set positions, one numpy array per chunk of the unary parts.
+# a corrupt header is caught here, and corrupt gaps as the generator runs.
+def decodePositions(data, numBits):
+    data = memoryview(data)
+    if len(data) < __HEADER.size or bytes(data[:len(__MAGIC)]) != __MAGIC:
+        raise ValueError("not a compressed Bloom Filter")
+    magic, encoding, k, numSet, unaryBytes = __HEADER.unpack_from(data, 0)
+    payload = data[__HEADER.size:]
+
+    if encoding == RAW:
+        if len(payload) != (numBits + 7) // 8:
+            raise ValueError("compressed Bloom Filter is truncated or has trailing data")
+        return RAW, payload
+    if encoding != RICE:
+        raise ValueError("unknown encoding " + repr(encoding))
+    if len(payload) < unaryBytes + (numSet * k + 7) // 8:
+        raise ValueError("compressed Bloom Filter is truncated")
+
+    return RICE, __riceDecode(payload, numBits, k, numSet, unaryBytes)
+
+# yields the set positions of RICE coded payload, a chunk of the unary parts at a time
+def __riceDecode(payload, numBits, k, numSet, unaryBytes):
+    unary = np.frombuffer(payload[:unaryBytes], dtype=np.uint8)
+    remainders = np.frombuffer(payload[unaryBytes:], dtype=np.uint8)
+
+    # the last zero of the unary parts, the last position, and the number of gaps, so far
+    end = -1
+    position = -1
+    index = 0
+    for first in range(0, unaryBytes, CHUNK_BYTES):
+        if index == numSet: break
+
+        # the zeros of the unary parts end the gaps: q is the ones before each
+        chunk = np.unpackbits(unary[first:first + CHUNK_BYTES], bitorder = "little")
+        ends = np.flatnonzero(chunk == 0)[:numSet - index] + 8 * first
+        if len(ends) == 0: continue
+        q = np.diff(ends, prepend = end) - 1
+        end = ends[-1]
+
+        # gather the low k bits of each gap, one bit of k at a time
+        which = np.arange(index, index + len(q)) * k
+        r = np.zeros(len(q), dtype=np.int64)
+        for j in range(k):
+            at = which + j
+            r |= ((remainders[at >> 3] >> (at & 7).astype(np.uint8)) & 1).astype(np.int64) << j
+
+        positions = position + np.cumsum((q << k) + r + 1)
+        position = positions[-1]
+        if position >= numBits:
+            raise ValueError("compressed Bloom Filter has bits past its end")
+        index += len(q)
+        yield positions
+
+    if index != numSet:
+        raise ValueError("compressed Bloom Filter is truncated")
+
+# returns the packed bits (as a new bytearray) of the encoded data of a filter of numBits bits
+def decode(data, numBits):
+    encoding, decoded = decodePositions(data, numBits)
+    if encoding == RAW:
+        return bytearray(decoded)
+
+    bits = bytearray((numBits + 7) // 8)
+    view = np.frombuffer(bits, dtype=np.uint8)
+    for positions in decoded:
+        byte, masks = __byteMasks(positions)
+        view[byte] |= masks
+    return bits
+
+# a read-only Bloom Filter that answers finds from the compressed form,
+# never unpacking the bits. Made by BloomFilter.read_compressed.
+# for RICE, the set positions are kept as their low 16 bits, in order,
+# with the index of the first one in each 65536 bit segment, so a find
+# is a binary search in one segment, and that takes 16 bits per set bit
+# (plus 32 per segment) instead of one bit per bit of the filter.
+class CompressedBloomFilter(object):
+
+    __SEGMENT = 16
+
+    # positionArgs are (numHashes, N, hashing, block) of the filter
+    def __init__(self, data, positionArgs, numInserted, falsePositiveRate):
+        self.__positionArgs = positionArgs
+        self.__numInserted = numInserted
+        self.__falsePositiveRate = falsePositiveRate
+        self.__numBytes = len(data)
+
+        N = positionArgs[1]
+        encoding, decoded = decodePositions(data, N)
+        self.__bits = None
+        if encoding == RAW:
+            self.__bits = np.frombuffer(decoded, dtype=np.uint8)
+            return
+
+        # the lows of each chunk of positions, and how many fall in each segment
+        lows = []
+        counts = np.zeros((N >> self.__SEGMENT) + 1, dtype=np.int64)
+        for positions in decoded:
+            lows.append((positions & 0xFFFF).astype(np.uint16))
+            segments = positions >> self.__SEGMENT
+            counts[segments[0]:segments[-1] + 1] += np.bincount(segments - segments[0])
+
+        self.__lows = np.concatenate(lows) if lows else np.zeros(0, dtype=np.uint16)
+        self.__starts = np.concatenate(([0], np.cumsum(counts))).astype(np.uint32)
+
+    # returns one bool per position: whether that bit is set
+    def __test(self, positions):
+        if self.__bits is not None:
+            return ((self.__bits[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1).astype(bool)
+
+        segment = positions >> self.__SEGMENT
+        low = (positions & 0xFFFF).astype(np.uint16)
+        lo = self.__starts[segment].astype(np.int64)
+        end = self.__starts[segment + 1].astype(np.int64)
+        if len(self.__lows) == 0:
+            return np.zeros(len(positions), dtype=bool)
+
+        # binary search every segment at once, for the first low >= the one
+        # wanted. a segment has at most 65536 set bits, so 17 halvings do it
+        count = end - lo
+        while count.any():
+            half = count >> 1
+            mid = lo + half
+            right = (count > 0) & (self.__lows[np.minimum(mid, len(self.__lows) - 1)] < low)
+            lo = np.where(right, mid + 1, lo)
+            count = np.where(right, count - half - 1, half)
+
+        found = lo < end
+        found[found] = self.__lows[lo[found]] == low[found]
+        return found
+
+    # Returns True if key MAY have been inserted into the filter, False if it definitely wasn't
+    def find(self, key):
+        positions = np.fromiter(bloomHashing.positions(key, *self.__positionArgs), dtype=np.int64)
+        return bool(self.__test(positions).all())
+
+    # returns a list with one bool per key, the answers find would give
+    def find_many(self, keys):
+        positions = bloomHashing.positionsMany(list(keys), *self.__positionArgs)
+        if positions.size == 0:
+            return [True] * len(positions)
+        return self.__test(positions.ravel()).reshape(positions.shape).all(axis = 1).tolist()
+
+    # the projected false positive rate of the filter this came from
+    def falsePositiveRate(self):
+        return self.__falsePositiveRate
+
+    # returns how many bytes the compressed form was
+    def numBytes(self):
+        return self.__numBytes
+
+# implement pytests to check the encoding round trips
+
+# test that bits of every fill ratio come back exactly, and that sparse
+# bits get smaller and dense ones stay raw
+def test_roundTrip():
+    rnd = np.random.default_rng(0)
+    numBits = 100003
+    for fill in (0, .0001, .01, .1, .3, .9):
+        bits = np.packbits(rnd.random(numBits) < fill, bitorder = "little").tobytes()
+        data = encode(bits, numBits)
+        assert decode(data, numBits) == bits
+
+        encoding, decoded = decodePositions(data, numBits)
+        assert len(data) <= len(bits) + HEADER_SIZE
+        if fill <= .1:
+            assert encoding == RICE and len(data) < len(bits)
+            assert sum((p.tolist() for p in decoded), []) == sum((p.tolist() for p in setPositions(bits)), [])
+        if fill == .9:
+            assert encoding == RAW
+
+# test that chunks of only a few bytes, with gaps that run over several
+# of them, give the same encoding and the same bits as the whole filter at once
+def test_chunks(monkeypatch):
+    rnd = np.random.default_rng(1)
+    numBits = 5003
+    for fill in (.001, .01, .1, .3, .9):
+        bits = np.packbits(rnd.random(numBits) < fill, bitorder = "little").tobytes()
+        data = encode(bits, numBits)
+        for chunkBytes in (1, 3, 7):
+            monkeypatch.setitem(globals(), "CHUNK_BYTES", chunkBytes)
+            assert encode(bits, numBits) == data
+            assert decode(data, numBits) == bits
+            monkeypatch.undo()
+
+# test that a corrupt encoding is caught rather than decoded into nonsense
+def test_corrupt():
+    bits = bytes([1, 0, 0, 128])
+    data = encode(bits, 32)
+    with pytest.raises(ValueError):
+        decode(b"BLOOMF01" + data[8:], 32)
+    with pytest.raises(ValueError):
+        decode(data[:-1], 32)
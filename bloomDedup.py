@@ -0,0 +1,173 @@
+from concurrent.futures import ProcessPoolExecutor
+from BloomFilter import BloomFilter
+import bloomHashing
+import collections
+import pytest
+import io
+import argparse
+import time
+import sys
+import os
+
+# print only the lines of the input that haven't been seen before, e.g.
+#     python bloomDedup.py big.log other.log > unique.log
+#     cat big.log | python bloomDedup.py --filter seen.bloom > new.log
+# "seen before" is decided by a BloomFilter, so a line that is new can
+# (with probability about --fpr) be mistaken for a seen one and dropped,
+# but a repeated line is never printed twice.
+#
+# the input is read in big binary chunks cut at line ends. Worker processes
+# split each chunk into lines and hash them all in one batch, and the main
+# process takes the chunks back in order and test-and-sets the whole batch
+# of positions with insert_positions, writing out the lines that were new.
+# With --filter, the filter is kept in that file between runs.
+
+# the arguments bloomHashing.positionsMany needs, set in each worker
+_positionArgs = None
+
+def _initWorker(positionArgs):
+    global _positionArgs
+    _positionArgs = positionArgs
+
+# the lines of a chunk (which ends at a line end, unless it is the very
+# end of the input), without their line ends
+def splitLines(chunk):
+    lines = chunk.split(b"\n")
+    if lines[-1] == b"": lines.pop()
+    return lines
+
+# returns the positions of every line of chunk (hashed as latin-1, which
+# turns any bytes into a str one char per byte)
+def _chunkPositions(chunk):
+    keys = [line.decode("latin-1") for line in splitLines(chunk)]
+    return bloomHashing.positionsMany(keys, *_positionArgs)
+
+# yields the input in chunks of about chunkBytes that end at a line end.
+# a file's last line is a line of its own even with no line end, and gets
+# one unless it is the very end of the input
+def readChunks(files, chunkBytes):
+    files = list(files)
+    for k, f in enumerate(files):
+        rest = b""
+        while True:
+            data = f.read(chunkBytes)
+            if not data: break
+
+            data = rest + data
+            end = data.rfind(b"\n") + 1
+            if end == 0:
+                rest = data
+                continue
+            rest = data[end:]
+            yield data[:end]
+
+        if rest: yield rest if k == len(files) - 1 else rest + b"\n"
+
+# yields (chunk, positions) for every chunk, in order, hashing up to
+# 2*workers chunks ahead in the worker processes (or here, with no workers)
+def hashedChunks(chunks, positionArgs, workers):
+    if workers == 0:
+        _initWorker(positionArgs)
+        for chunk in chunks:
+            yield chunk, _chunkPositions(chunk)
+        return
+
+    with ProcessPoolExecutor(workers, initializer = _initWorker, initargs = (positionArgs,)) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(_chunkPositions, chunk)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+# write the lines of the input that bf hasn't seen to out (a binary file),
+# and put them in bf. Returns the number of lines read and written.
+def dedup(bf, files, out, workers = 0, chunkBytes = 1 << 23):
+    linesIn = linesOut = 0
+    for chunk, positions in hashedChunks(readChunks(files, chunkBytes), bf.positionArgs(), workers):
+        lines = splitLines(chunk)
+        isNew = bf.insert_positions(positions).tolist()
+
+        newLines = [line for line, new in zip(lines, isNew) if new]
+        if newLines:
+            out.write(b"\n".join(newLines))
+            # every line keeps its line end, except a last one that had none
+            if chunk.endswith(b"\n") or not isNew[-1]:
+                out.write(b"\n")
+
+        linesIn += len(lines)
+        linesOut += len(newLines)
+    return linesIn, linesOut
+
+def __main():
+    parser = argparse.ArgumentParser(description = "print the lines of the input not seen before")
+    parser.add_argument("files", nargs = "*", help = "files to read (default stdin)")
+    parser.add_argument("--filter", help = "keep the filter in this file between runs")
+    parser.add_argument("--expected", type = float, default = 1e7,
+                        help = "how many distinct lines to size a new filter for")
+    parser.add_argument("--fpr", type = float, default = .001,
+                        help = "false positive rate of a new filter (new lines wrongly dropped)")
+    parser.add_argument("--workers", type = int, default = os.cpu_count(),
+                        help = "processes that hash the lines (0 hashes in this one)")
+    parser.add_argument("--chunk-bytes", type = int, default = 1 << 23)
+    parser.add_argument("-v", "--verbose", action = "store_true", help = "print the counts and speed at the end")
+    args = parser.parse_args()
+
+    if args.filter and os.path.exists(args.filter):
+        bf = BloomFilter.open(args.filter, "r+")
+    else:
+        p = BloomFilter.plan(int(args.expected), args.fpr, hashing = bloomHashing.DOUBLE)
+        bf = BloomFilter(int(args.expected), p["numHashes"], args.fpr, bloomHashing.DOUBLE)
+
+    files = [open(name, "rb") for name in args.files] or [sys.stdin.buffer]
+    start = time.perf_counter()
+    try:
+        linesIn, linesOut = dedup(bf, files, sys.stdout.buffer, args.workers, args.chunk_bytes)
+        sys.stdout.flush()
+    finally:
+        for f in files:
+            if f is not sys.stdin.buffer: f.close()
+
+    # a filter that was opened is written back in place, a new one is saved
+    if args.filter:
+        if os.path.exists(args.filter):
+            bf.flush()
+        else:
+            bf.save(args.filter)
+    bf.close()
+
+    if args.verbose:
+        elapsed = time.perf_counter() - start
+        print("%d lines in, %d out, %.1f s" % (linesIn, linesOut, elapsed), file = sys.stderr)
+
+# implement pytests to check the lines come out right
+
+# test that repeats are dropped, within a chunk and across chunks, and that
+# line ends are kept (the last line had none)
+def test_dedup():
+    data = b"b\na\nb\n\nc\na\n\nc\nd"
+    for chunkBytes in (1, 4, 100):
+        bf = BloomFilter(100, 4, .0001, bloomHashing.DOUBLE)
+        out = io.BytesIO()
+        assert dedup(bf, [io.BytesIO(data)], out, chunkBytes = chunkBytes) == (9, 5)
+        assert out.getvalue() == b"b\na\n\nc\nd"
+
+    # the filter remembers what it saw
+    out = io.BytesIO()
+    dedup(bf, [io.BytesIO(b"a\ne\n")], out)
+    assert out.getvalue() == b"e\n"
+
+    # a file's last line doesn't run into the next file's first line
+    files = [b"x\ny", b"z\nx", b"", b"y\nw"]
+    for chunkBytes in (1, 3, 100):
+        bf = BloomFilter(100, 4, .0001, bloomHashing.DOUBLE)
+        out = io.BytesIO()
+        assert dedup(bf, [io.BytesIO(f) for f in files], out, chunkBytes = chunkBytes) == (6, 4)
+        assert out.getvalue() == b"x\ny\nz\nw"
+
+if __name__ == '__main__':
+    __main()
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from BitHash import BitHash
+import numpy as np
+import threading
+
+# the different ways a filter can turn a key into its numHashes positions.
+#
+# CHAINED is the original way: hashval = BitHash(key, hashval), numHashes times.
+# every round needs the one before it, so the cost grows with numHashes.
+#
+# DOUBLE and SINGLE use double hashing instead: g_i = h1 + i*h2 (mod size).
+# DOUBLE takes h1 and h2 from two BitHash digests (which happen to be the
+# first two chained rounds), SINGLE takes both halves from one digest.
+# either way the cost of hashing stays the same no matter what numHashes is.
+CHAINED = "chained"
+DOUBLE = "double"
+SINGLE = "single"
+# the index of a strategy in STRATEGIES is what gets written into saved
+# filter files, so new strategies must only ever be appended
+STRATEGIES = (CHAINED, DOUBLE, SINGLE)
+
+# make sure the client asked for a hashing strategy we know about
+def checkHashing(hashing):
+    if hashing not in STRATEGIES:
+        raise ValueError("unknown hashing strategy " + repr(hashing) +
+                         ", expected one of " + ", ".join(STRATEGIES))
+    return hashing
+
+# returns the two digests that double hashing is built from
+def __digests(key, numHashes, hashing):
+    h1 = BitHash(key)
+    if numHashes == 1:
+        # the step is never used, so don't pay for a second digest
+        h2 = 0
+    elif hashing == DOUBLE:
+        h2 = BitHash(key, h1)
+    else:
+        # SINGLE: reuse the top half of the one digest as the step
+        h2 = h1 >> 32
+    return h1, h2
+
+# yields the numHashes positions of key, ignoring any blocking
+def __flatPositions(key, numHashes, size, hashing, block):
+    if hashing == CHAINED:
+        hashval = 0
+        for i in range(numHashes):
+            hashval = BitHash(key, hashval)
+            yield hashval % size
+        return
+
+    h1, h2 = __digests(key, numHashes, hashing)
+    start = h1 % size
+
+    # a step of zero would put every probe on the same position.
+    # inside a block only step % block matters, and an even one there 
+    # would make the probes repeat before all numHashes are used
+    step = h2 % size or 1
+    if block: step |= 1
+    for i in range(numHashes):
+        yield (start + i*step) % size
+
+# yields the positions of a blocked filter: the first position picks the 
+# block it falls in, and every other position is moved into that block. 
+# size is a multiple of block, so p % block is just the hash % block
+def __blockedPositions(flat, block):
+    first = next(flat)
+    yield first
+
+    base = first - first % block
+    for p in flat:
+        yield base + p % block
+
+# yields the numHashes positions (each in range(size)) for key one at a 
+# time, so a find that stops at the first unset position never pays for 
+# the chained BitHash rounds it didn't need.
+# when block is not 0, all of the positions fall in the same block of 
+# that many bits (size must then be a multiple of block)
+def positions(key, numHashes, size, hashing = CHAINED, block = 0):
+    flat = __flatPositions(key, numHashes, size, hashing, block)
+    if not block or numHashes == 0:
+        return flat
+    return __blockedPositions(flat, block)
+
+# returns how many BitHash digests positions() computes to yield its first
+# probes positions (so for a find that stops early, the rounds it paid for)
+def hashRounds(hashing, numHashes, probes):
+    if hashing == CHAINED or probes == 0:
+        return probes
+    return 2 if hashing == DOUBLE and numHashes > 1 else 1
+
+# returns a numpy array with one row of numHashes positions per key,
+# the same positions that positions() returns for each key one at a time
+def positionsMany(keys, numHashes, size, hashing = CHAINED, block = 0):
+    if hashing == CHAINED:
+        hashvals = []
+        for key in keys:
+            hashval = 0
+            for i in range(numHashes):
+                hashval = BitHash(key, hashval)
+                hashvals.append(hashval)
+
+        # the % size is done once for the whole batch
+        ans = np.array(hashvals, dtype=np.uint64) % np.uint64(size)
+        ans = ans.astype(np.int64).reshape(-1, numHashes)
+
+    else:
+        h1s = []
+        h2s = []
+        for key in keys:
+            h1, h2 = __digests(key, numHashes, hashing)
+            h1s.append(h1)
+            h2s.append(h2)
+
+        start = (np.array(h1s, dtype=np.uint64) % np.uint64(size)).astype(np.int64)
+        step = (np.array(h2s, dtype=np.uint64) % np.uint64(size)).astype(np.int64)
+        step[step == 0] = 1
+        if block: step |= 1
+
+        # every g_i of every key in one pass
+        ans = start[:, None] + np.arange(numHashes, dtype=np.int64)[None, :] * step[:, None]
+        ans %= size
+
+    if block and numHashes > 1:
+        # move every position after the first into the first one's block
+        ans[:, 1:] = (ans[:, :1] - ans[:, :1] % block) + ans[:, 1:] % block
+    return ans
+
+# a bounded least-recently-used cache from keys to their tuple of positions,
+# for filters whose traffic keeps coming back to the same hot keys.
+# each filter has its own cache (the positions depend on its size and
+# numHashes), and a lock makes it safe to share the filter between threads.
+class PositionCache(object):
+
+    def __init__(self, maxSize):
+        self.__maxSize = maxSize
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+    # returns the positions of key, calling compute() to get them only if
+    # they aren't cached already
+    def get(self, key, compute):
+        with self.__lock:
+            ans = self.__entries.get(key)
+            if ans is not None:
+                self.__entries.move_to_end(key)
+                self.__hits += 1
+                return ans
+            self.__misses += 1
+
+        # hash without holding the lock, so other callers don't wait on it
+        ans = tuple(compute())
+        with self.__lock:
+            self.__entries[key] = ans
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__maxSize:
+                self.__entries.popitem(last = False)
+        return ans
+
+    # returns a dict with the size, maxSize, hits and misses of the cache
+    def stats(self):
+        with self.__lock:
+            return {"size": len(self.__entries), "maxSize": self.__maxSize,
+                    "hits": self.__hits, "misses": self.__misses}
+
+    # a lock can't be pickled, so a pickled cache comes back empty
+    def __getstate__(self):
+        return {"maxSize": self.__maxSize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxSize"])
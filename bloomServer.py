@@ -0,0 +1,432 @@
+from countingBloomFilter import CountingBloomFilter
+from BloomFilter import BloomFilter
+import argparse
+import asyncio
+import struct
+import json
+import pytest
+import sys
+
+# a small asyncio server that lets many processes share named filters over
+# a local TCP or unix socket, instead of each one keeping its own copy.
+#
+# the protocol: every message, both ways, is a 4 byte big endian length
+# followed by that many bytes of JSON. A request looks like
+#     {"id": 7, "op": "find", "filter": "words", "keys": ["a", "b"], "n": 1}
+# where op is "find", "insert" or "delete", keys is a batch of keys, and n
+# (only for find on a counting filter) is the count to check for. The reply
+#     {"id": 7, "result": [true, false]}
+# has one result per key for a find (null for insert and delete), or an
+# "error" instead of a "result". A client can send as many requests as it
+# likes without waiting (pipelining), and matches replies up by id, since
+# they can come back in any order.
+#
+# requests for the same filter and op that arrive together, from any number
+# of connections, are answered with a single batched pass over the filter,
+# and the requests for a filter always run in the order they arrived.
+
+# largest message either side will accept
+MAX_FRAME = 64 << 20
+
+__LENGTH = struct.Struct(">I")
+
+# read one message from the stream, or return None at end of stream
+async def readFrame(reader):
+    try:
+        header = await reader.readexactly(__LENGTH.size)
+    except asyncio.IncompleteReadError:
+        return None
+
+    length, = __LENGTH.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError("message of %d bytes is too big" % length)
+    return json.loads(await reader.readexactly(length))
+
+# write one message to the stream (it still needs a drain)
+def writeFrame(writer, message):
+    body = json.dumps(message, separators = (",", ":")).encode()
+    writer.write(__LENGTH.pack(len(body)) + body)
+
+class BloomServer(object):
+
+    # Create a server for the filters in the dict, by name.
+    # All attributes must be private.
+    def __init__(self, filters):
+        self.__filters = dict(filters)
+
+        # requests waiting for the next batched pass, for each filter: a
+        # queue of batches [op, n, list of (keys, future)] in the order they
+        # came in. A request joins the last batch when it has the same op
+        # and n, and starts a new one otherwise, so nothing ever runs ahead
+        # of an op sent before it. The queue runs on the next turn of the
+        # event loop, so everything that comes in before then joins it
+        self.__pending = {}
+        self.__server = None
+
+    # start listening on host:port, or on the unix socket at path.
+    # returns the address actually bound (port 0 picks a free port)
+    async def start(self, host = "127.0.0.1", port = 0, path = None):
+        if path is not None:
+            self.__server = await asyncio.start_unix_server(self.__serve, path)
+        else:
+            self.__server = await asyncio.start_server(self.__serve, host, port)
+        return self.__server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self.__server.serve_forever()
+
+    async def close(self):
+        self.__server.close()
+        await self.__server.wait_closed()
+
+    # handle one connection: answer its requests as they are read,
+    # without waiting for the earlier ones to finish
+    async def __serve(self, reader, writer):
+        replies = set()
+        try:
+            while True:
+                request = await readFrame(reader)
+                if request is None: break
+
+                reply = asyncio.ensure_future(self.__answer(request, writer))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            if replies:
+                await asyncio.gather(*replies, return_exceptions = True)
+            writer.close()
+
+    # answer one request once its batch has been run
+    async def __answer(self, request, writer):
+        requestId = request.get("id") if isinstance(request, dict) else None
+        try:
+            result = await self.__submit(request)
+            reply = {"id": requestId, "result": result}
+        except Exception as e:
+            reply = {"id": requestId, "error": str(e)}
+
+        writeFrame(writer, reply)
+        await writer.drain()
+
+    # check the request, and add it to the batch for its filter and op.
+    # everything that could fail for one request's keys is checked here,
+    # so that a bad request can't fail (or half apply) the batch it joins
+    def __submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        name = request.get("filter")
+        op = request.get("op")
+        keys = request.get("keys")
+        n = request.get("n", 1)
+        if not isinstance(name, str) or name not in self.__filters:
+            raise ValueError("no filter named " + repr(name))
+        if op not in ("find", "insert", "delete"):
+            raise ValueError("unknown op " + repr(op))
+        if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+            raise ValueError("keys must be a list of strings")
+        if not isinstance(n, int) or isinstance(n, bool):
+            raise ValueError("n must be an integer")
+
+        future = asyncio.get_running_loop().create_future()
+        if name not in self.__pending:
+            self.__pending[name] = []
+            asyncio.get_running_loop().call_soon(self.__runBatches, name)
+        batches = self.__pending[name]
+        if not batches or batches[-1][:2] != [op, n]:
+            batches.append([op, n, []])
+        batches[-1][2].append((keys, future))
+        return future
+
+    # run the batches waiting on one filter, in the order they came in
+    def __runBatches(self, name):
+        for op, n, requests in self.__pending.pop(name):
+            self.__runBatch(name, op, n, requests)
+
+    # run every request of one batch as a single pass,
+    # then hand each request back its own part of the results
+    def __runBatch(self, name, op, n, requests):
+        keys = [key for reqKeys, future in requests for key in reqKeys]
+
+        try:
+            results = self.__apply(self.__filters[name], op, n, keys)
+        except Exception as e:
+            for reqKeys, future in requests:
+                future.set_exception(e)
+            return
+
+        start = 0
+        for reqKeys, future in requests:
+            future.set_result(results[start:start + len(reqKeys)] if results is not None else None)
+            start += len(reqKeys)
+
+    # do op on every key, using the filter's batch methods when it has them
+    def __apply(self, filt, op, n, keys):
+        if op == "find":
+            if isinstance(filt, CountingBloomFilter):
+                return filt.find_many(keys, n)
+            if hasattr(filt, "find_many"):
+                return filt.find_many(keys)
+            return [filt.find(key) for key in keys]
+
+        if op == "insert":
+            if hasattr(filt, "insert_many"):
+                filt.insert_many(keys)
+            else:
+                for key in keys: filt.insert(key)
+            return None
+
+        if not hasattr(filt, "delete"):
+            raise ValueError("this filter can't delete")
+        if hasattr(filt, "delete_many"):
+            filt.delete_many(keys)
+        else:
+            for key in keys: filt.delete(key)
+        return None
+
+# one connection of a BloomClient. Requests are written as soon as they
+# are made, and a reader task hands each reply to whoever is waiting on its id
+class _Connection(object):
+
+    def __init__(self, reader, writer):
+        self.__reader = reader
+        self.__writer = writer
+        self.__waiting = {}
+        self.__nextId = 0
+        self.__readerTask = asyncio.ensure_future(self.__readReplies())
+
+    async def __readReplies(self):
+        try:
+            while True:
+                reply = await readFrame(self.__reader)
+                if reply is None: break
+
+                future = self.__waiting.pop(reply["id"], None)
+                if future is None or future.done(): continue
+                if "error" in reply:
+                    future.set_exception(ValueError(reply["error"]))
+                else:
+                    future.set_result(reply["result"])
+        except (ValueError, ConnectionError) as e:
+            error = e
+        else:
+            error = ConnectionError("server closed the connection")
+
+        for future in self.__waiting.values():
+            if not future.done(): future.set_exception(error)
+        self.__waiting.clear()
+
+    async def request(self, message):
+        self.__nextId += 1
+        message["id"] = self.__nextId
+        future = asyncio.get_running_loop().create_future()
+        self.__waiting[self.__nextId] = future
+
+        writeFrame(self.__writer, message)
+        await self.__writer.drain()
+        return await future
+
+    async def close(self):
+        self.__writer.close()
+        self.__readerTask.cancel()
+        try:
+            await self.__readerTask
+        except asyncio.CancelledError:
+            pass
+
+# a client for a BloomServer, with a pool of poolSize connections. Requests
+# are spread over the connections in turn, and many requests can be in
+# flight on each one at once.
+class BloomClient(object):
+
+    def __init__(self, host = "127.0.0.1", port = None, path = None, poolSize = 4):
+        self.__host = host
+        self.__port = port
+        self.__path = path
+        self.__poolSize = poolSize
+        self.__pool = []
+        self.__next = 0
+        self.__lock = asyncio.Lock()
+
+    # returns the next connection of the pool, opening them on first use
+    async def __connection(self):
+        if len(self.__pool) < self.__poolSize:
+            async with self.__lock:
+                while len(self.__pool) < self.__poolSize:
+                    if self.__path is not None:
+                        reader, writer = await asyncio.open_unix_connection(self.__path)
+                    else:
+                        reader, writer = await asyncio.open_connection(self.__host, self.__port)
+                    self.__pool.append(_Connection(reader, writer))
+
+        self.__next = (self.__next + 1) % len(self.__pool)
+        return self.__pool[self.__next]
+
+    async def __request(self, op, name, keys, **extra):
+        message = {"op": op, "filter": name, "keys": list(keys)}
+        message.update(extra)
+        return await (await self.__connection()).request(message)
+
+    # returns a list with one bool per key: True if the filter may have it
+    # (at least n times, for a counting filter)
+    async def find(self, name, keys, n = 1):
+        return await self.__request("find", name, keys, n = n)
+
+    async def insert(self, name, keys):
+        await self.__request("insert", name, keys)
+
+    async def delete(self, name, keys):
+        await self.__request("delete", name, keys)
+
+    async def close(self):
+        for conn in self.__pool:
+            await conn.close()
+        self.__pool = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+# turn the command line filter specs into a dict of filters by name
+def makeFilters(args):
+    filters = {}
+    for spec in args.bloom or []:
+        name, numKeys, numHashes, maxFalse = spec.split(":")
+        filters[name] = BloomFilter(int(numKeys), int(numHashes), float(maxFalse))
+    for spec in args.counting or []:
+        name, numCells, numHashes, maxCount = spec.split(":")
+        filters[name] = CountingBloomFilter(int(numCells), int(numHashes), int(maxCount))
+    for spec in args.saved or []:
+        name, path, *mode = spec.split(":")
+        filters[name] = BloomFilter.open(path, *mode)
+    return filters
+
+def __main():
+    parser = argparse.ArgumentParser(description = "serve Bloom filters over a socket")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 7878)
+    parser.add_argument("--unix", help = "listen on this unix socket instead of TCP")
+    parser.add_argument("--bloom", action = "append", metavar = "NAME:NUMKEYS:NUMHASHES:MAXFALSE",
+                        help = "serve a new BloomFilter")
+    parser.add_argument("--counting", action = "append", metavar = "NAME:NUMCELLS:NUMHASHES:MAXCOUNT",
+                        help = "serve a new CountingBloomFilter")
+    parser.add_argument("--saved", action = "append", metavar = "NAME:PATH[:MODE]",
+                        help = "serve a BloomFilter file written by save (mode r or r+)")
+    args = parser.parse_args()
+
+    filters = makeFilters(args)
+    if not filters:
+        parser.error("give at least one --bloom, --counting or --saved filter")
+
+    async def run():
+        server = BloomServer(filters)
+        address = await server.start(args.host, args.port, args.unix)
+        print("serving", ", ".join(sorted(filters)), "on", address, file = sys.stderr)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for filt in filters.values():
+            if isinstance(filt, BloomFilter): filt.close()
+
+# implement pytests to check the server and client work together
+
+# run coroutine fn(client) against a server for filters, over a unix socket
+def runWithServer(filters, fn, tmp_path, poolSize = 2):
+    async def run():
+        server = BloomServer(filters)
+        path = str(tmp_path / "bloom.sock")
+        await server.start(path = path)
+        try:
+            async with BloomClient(path = path, poolSize = poolSize) as client:
+                return await fn(client)
+        finally:
+            await server.close()
+    return asyncio.run(run())
+
+# test that many pipelined requests all get the right answers
+def test_pipelined(tmp_path):
+    filters = {"bloom": BloomFilter(1000, 4, .01), "counting": CountingBloomFilter(10000, 4, 15)}
+
+    async def fn(client):
+        keys = ["key" + str(i) for i in range(200)]
+        await asyncio.gather(*(client.insert("bloom", [key]) for key in keys))
+        await client.insert("counting", ["shira"] * 3 + ["jacob"])
+
+        found = await asyncio.gather(*(client.find("bloom", [key]) for key in keys))
+        assert found == [[True]] * len(keys)
+        assert await client.find("counting", ["shira", "jacob"], 3) == [True, False]
+
+        await client.delete("counting", ["shira"])
+        assert await client.find("counting", ["shira", "jacob", "reuven"]) == [True, True, False]
+        assert await client.find("counting", ["shira"], 3) == [False]
+
+    runWithServer(filters, fn, tmp_path)
+    assert filters["counting"].count("shira") == 2
+
+# test that a bad request gets an error back, and doesn't hurt the others
+def test_errors(tmp_path):
+    async def fn(client):
+        with pytest.raises(ValueError):
+            await client.find("nobody", ["shira"])
+        with pytest.raises(ValueError):
+            await client.delete("bloom", ["shira"])
+        await client.insert("bloom", ["shira"])
+        assert await client.find("bloom", ["shira"]) == [True]
+
+    runWithServer({"bloom": BloomFilter(100, 4, .01)}, fn, tmp_path)
+
+# test that requests pipelined on one connection run in the order they were sent:
+# a find after an insert always sees it, even with a find before the insert
+def test_order(tmp_path):
+    filters = {"bloom": BloomFilter(100, 4, .01), "counting": CountingBloomFilter(1000, 4, 15)}
+
+    async def fn(client):
+        for name in filters:
+            found = await asyncio.gather(client.find(name, ["shira"]), client.insert(name, ["shira"]),
+                                         client.find(name, ["shira"]), client.delete(name, ["shira"])
+                                         if name == "counting" else client.find(name, ["jacob"]),
+                                         client.find(name, ["shira"]))
+            assert found[0] == [False] and found[2] == [True]
+            assert found[4] == ([False] if name == "counting" else [True])
+
+    runWithServer(filters, fn, tmp_path, poolSize = 1)
+
+# test that a request with bad keys, or that isn't even a JSON object, gets
+# an error of its own, while the requests batched along with it go through
+def test_badRequests(tmp_path):
+    filters = {"bloom": BloomFilter(100, 4, .01), "counting": CountingBloomFilter(1000, 4, 15)}
+
+    async def fn(client):
+        inserts = await asyncio.gather(client.insert("bloom", ["shira"]),
+                                       client.insert("bloom", ["jacob", 7]),
+                                       client.insert("bloom", ["dina"]),
+                                       return_exceptions = True)
+        assert inserts[0] is None and inserts[2] is None
+        assert isinstance(inserts[1], ValueError)
+        assert await client.find("bloom", ["shira", "jacob", "dina"]) == [True, False, True]
+
+        with pytest.raises(ValueError):
+            await client.find("counting", ["shira"], "2")
+
+        # a body that is JSON, but not an object
+        reader, writer = await asyncio.open_unix_connection(str(tmp_path / "bloom.sock"))
+        writeFrame(writer, ["find", "bloom"])
+        await writer.drain()
+        reply = await readFrame(reader)
+        assert reply["id"] is None and "error" in reply
+        writer.close()
+
+        # and the server is still there
+        assert await client.find("bloom", ["shira"]) == [True]
+
+    runWithServer(filters, fn, tmp_path)
+
+if __name__ == '__main__':
+    __main()
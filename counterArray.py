@@ -0,0 +1,295 @@
+from array import array
+import numpy as np
+
+# an array of numCells small unsigned counters, each bitsPerCell bits wide,
+# packed as tightly as python lets us read and write them cheaply:
+#   bitsPerCell <= 4   two counters per byte of a bytearray (nibbles)
+#   bitsPerCell <= 8   one counter per byte of a bytearray
+#   bitsPerCell <= 64  an array of the smallest unsigned type that fits
+#   anything bigger    a plain list of python ints
+# unlike slicing a BitVector, reading or writing a counter doesn't create
+# any new objects.
+#
+# with trackPages (or from startTracking() on), the counters are also split
+# into pages of PAGE_BYTES bytes, and every page remembers the version it
+# was last written in. checkpoint() starts a new version, so the pages 
+# written since any earlier checkpoint can be found and copied without 
+# reading the rest.
+class CounterArray(object):
+
+    # the array typecodes to try for the wider counters, smallest first
+    __TYPECODES = ("H", "I", "L", "Q")
+
+    # bytes of counters per page
+    PAGE_BYTES = 4096
+
+    def __init__(self, numCells, bitsPerCell, trackPages = False):
+        self.__numCells = numCells
+        self.__bitsPerCell = bitsPerCell
+        self.__nibbles = bitsPerCell <= 4
+
+        if self.__nibbles:
+            self.__cells = bytearray((numCells + 1) // 2)
+        elif bitsPerCell <= 8:
+            self.__cells = bytearray(numCells)
+        elif bitsPerCell <= 64:
+            typecode = next(t for t in self.__TYPECODES if array(t).itemsize * 8 >= bitsPerCell)
+            self.__cells = array(typecode, bytes(array(typecode).itemsize * numCells))
+        else:
+            self.__cells = [0] * numCells
+
+        # how many counters fit in a page (a list of ints is paged as if it were packed)
+        if self.__nibbles:
+            self.__cellsPerPage = 2 * self.PAGE_BYTES
+        elif isinstance(self.__cells, list):
+            self.__cellsPerPage = max(1, self.PAGE_BYTES // self.__cellWidth())
+        else:
+            self.__cellsPerPage = self.PAGE_BYTES // memoryview(self.__cells).itemsize
+
+        # the version each page was last written in, or None when not tracking.
+        # pages start at version 0, and writes go into version 1 until the first checkpoint
+        self.__pageVersions = None
+        self.__version = 1
+        if trackPages:
+            self.startTracking()
+
+    # starts keeping track of the pages written, if it isn't already. Every
+    # page counts as written before the first checkpoint
+    def startTracking(self):
+        if self.__pageVersions is None:
+            self.__pageVersions = array("Q", bytes(8 * self.numPages()))
+
+    # returns True if the pages written are being kept track of
+    def tracksPages(self):
+        return self.__pageVersions is not None
+
+    # returns the value of counter i
+    def get(self, i):
+        if self.__nibbles:
+            # the even counter is the low half of the byte, the odd one the high half
+            return (self.__cells[i >> 1] >> ((i & 1) << 2)) & 0xF
+        return self.__cells[i]
+
+    # makes the value of counter i be val (which must fit in bitsPerCell bits)
+    def set(self, i, val):
+        if self.__pageVersions is not None:
+            self.__pageVersions[i // self.__cellsPerPage] = self.__version
+        if self.__nibbles:
+            shift = (i & 1) << 2
+            byte = i >> 1
+            self.__cells[byte] = (self.__cells[byte] & (0xF0 >> shift)) | (val << shift)
+        else:
+            self.__cells[i] = val
+
+    # add amounts[k] to counter cells[k] for every k in one numpy pass, 
+    # never letting a counter go below zero or above maxCount. The same 
+    # cell can be in cells more than once, and all of its amounts are added.
+    # amounts must be all >= 0 or all <= 0, so that clamping once at the 
+    # end gives what clamping after every single +1 or -1 would have given.
+    # returns how many of the +1s or -1s were lost to the clamping.
+    def addMany(self, cells, amounts, maxCount):
+        if len(cells) == 0: return 0
+        
+        # add up the amounts for each distinct cell
+        cells, which = np.unique(cells, return_inverse = True)
+        totals = np.zeros(len(cells), dtype=np.int64)
+        np.add.at(totals, which, amounts)
+        
+        if self.__pageVersions is not None:
+            np.frombuffer(self.__pageVersions, dtype=np.uint64)[cells // self.__cellsPerPage] = self.__version
+        
+        # counters too wide for int64 math are done one at a time
+        if self.__bitsPerCell > 32:
+            lost = 0
+            for cell, total in zip(cells.tolist(), totals.tolist()):
+                val = self.get(cell) + total
+                self.set(cell, min(max(val, 0), maxCount))
+                lost += max(val - maxCount, -val, 0)
+            return lost
+        
+        raw = self.__getMany(cells) + totals
+        vals = np.clip(raw, 0, maxCount)
+        self.__setMany(cells, vals)
+        return int(np.abs(raw - vals).sum())
+    
+    # returns the counters at cells, a numpy array of cell indexes of any
+    # shape (the same cell may be there more than once), as an array of the
+    # same shape: int64, or python ints for counters wider than 32 bits
+    def getMany(self, cells):
+        if self.__bitsPerCell > 32:
+            return np.array([self.get(cell) for cell in cells.ravel().tolist()], 
+                            dtype=object).reshape(cells.shape)
+        return self.__getMany(cells)
+    
+    # returns the counters at the cells as an int64 numpy array
+    def __getMany(self, cells):
+        view = self.__view()
+        if self.__nibbles:
+            return ((view[cells >> 1] >> ((cells & 1) << 2).astype(np.uint8)) & 0xF).astype(np.int64)
+        return view[cells].astype(np.int64)
+    
+    # sets the counters at the (distinct) cells to vals
+    def __setMany(self, cells, vals):
+        view = self.__view()
+        if not self.__nibbles:
+            view[cells] = vals
+            return
+        
+        # two cells can share a byte, so do the low halves and then the high 
+        # halves, since within each of those every cell has its own byte
+        vals = vals.astype(np.uint8)
+        low = (cells & 1) == 0
+        byte = cells[low] >> 1
+        view[byte] = (view[byte] & 0xF0) | vals[low]
+        byte = cells[~low] >> 1
+        view[byte] = (view[byte] & 0x0F) | (vals[~low] << 4)
+    
+    # the counters as a numpy array that shares their memory
+    def __view(self):
+        return np.frombuffer(self.__cells, dtype = "u%d" % memoryview(self.__cells).itemsize)
+    
+    # sets every counter back to zero, in one pass over the memory
+    def clear(self):
+        if self.__pageVersions is not None:
+            np.frombuffer(self.__pageVersions, dtype=np.uint64)[:] = self.__version
+        if isinstance(self.__cells, list):
+            self.__cells[:] = [0] * self.__numCells
+        else:
+            self.__view()[:] = 0
+    
+    # returns how many counters are not zero
+    def numNonzero(self):
+        if isinstance(self.__cells, list):
+            return sum(1 for val in self.__cells if val)
+        view = self.__view()
+        if not self.__nibbles:
+            return int(np.count_nonzero(view))
+        
+        # a zero high half past the last counter doesn't matter
+        return int(np.count_nonzero(view & 0x0F) + np.count_nonzero(view & 0xF0))
+    
+    # returns the number of counters
+    def __len__(self):
+        return self.__numCells
+
+    # returns the fewest bits per cell that count up to maxCount: the
+    # smallest n with 2**n - 1 >= maxCount. Every filter that keeps its
+    # counters in a CounterArray sizes them with this
+    @staticmethod
+    def bitsFor(maxCount):
+        return max(0, maxCount).bit_length()
+
+    # returns how many bits each counter of bitsPerCell bits really takes up
+    # (4 for nibbles, 8 for bytes, the whole item of an array). A counter
+    # can go up to 2**that - 1 for the same memory.
+    @classmethod
+    def storageBits(cls, bitsPerCell):
+        if bitsPerCell <= 4: return 4
+        if bitsPerCell <= 8: return 8
+        if bitsPerCell <= 64:
+            return next(array(t).itemsize * 8 for t in cls.__TYPECODES if array(t).itemsize * 8 >= bitsPerCell)
+        return bitsPerCell
+    
+    # returns how many bytes the counters themselves take up
+    # (for the list of python ints, how many they would take packed)
+    def nbytes(self):
+        if isinstance(self.__cells, list):
+            return (self.__numCells * self.__bitsPerCell + 7) // 8
+        return len(self.__cells) * memoryview(self.__cells).itemsize
+
+    # bytes per counter of a list of ints, when it is written out as bytes
+    def __cellWidth(self):
+        return (self.__bitsPerCell + 7) // 8
+
+    # returns the number of pages
+    def numPages(self):
+        return (self.__numCells + self.__cellsPerPage - 1) // self.__cellsPerPage
+
+    # ends the current version and returns it: every write so far is in a
+    # version <= the one returned, and every later one is in a higher version
+    def checkpoint(self):
+        if self.__pageVersions is None:
+            raise ValueError("this CounterArray doesn't track its pages")
+        self.__version += 1
+        return self.__version - 1
+
+    # returns, in order, the pages written after version since ended
+    def dirtyPages(self, since):
+        if self.__pageVersions is None:
+            raise ValueError("this CounterArray doesn't track its pages")
+        return np.flatnonzero(np.frombuffer(self.__pageVersions, dtype=np.uint64) > since).tolist()
+
+    # returns a copy of the counters of pages first up to (not including) last, as bytes
+    def readPages(self, first, last):
+        start = first * self.__cellsPerPage
+        stop = min(last * self.__cellsPerPage, self.__numCells)
+        if isinstance(self.__cells, list):
+            width = self.__cellWidth()
+            return b"".join(val.to_bytes(width, "little") for val in self.__cells[start:stop])
+        if self.__nibbles:
+            return bytes(self.__cells[start >> 1:(stop + 1) >> 1])
+        return memoryview(self.__cells)[start:stop].tobytes()
+
+    # overwrites the counters from the start of page first on with data,
+    # which came from readPages of a CounterArray of the same shape
+    def writePages(self, first, data):
+        # the counters of data, as elements of self.__cells (bytes, for nibbles)
+        if isinstance(self.__cells, list):
+            width = self.__cellWidth()
+            vals = [int.from_bytes(data[k:k + width], "little") for k in range(0, len(data), width)]
+        else:
+            vals = np.frombuffer(data, dtype=self.__view().dtype)
+
+        perPage = self.PAGE_BYTES if self.__nibbles else self.__cellsPerPage
+        start = first * perPage
+        if start + len(vals) > len(self.__cells):
+            raise ValueError("pages don't fit in this CounterArray")
+
+        if isinstance(self.__cells, list):
+            self.__cells[start:start + len(vals)] = vals
+        else:
+            self.__view()[start:start + len(vals)] = vals
+
+        # the pages written now count as changed, so a replica can pass them on
+        if self.__pageVersions is not None:
+            last = first + (len(vals) + perPage - 1) // perPage
+            np.frombuffer(self.__pageVersions, dtype=np.uint64)[first:last] = self.__version
+
+# an array of numCells unsigned values of exactly bitsPerCell bits each, one
+# right after the other with no padding: value i is bits i*bitsPerCell up
+# to (i+1)*bitsPerCell of a bytearray, lowest bit first. Reading or writing
+# one costs more than with a CounterArray, but a 10 or 13 bit value takes
+# up 10 or 13 bits, not 16, so it is for fingerprints whose whole point is
+# to be small.
+class PackedArray(object):
+
+    def __init__(self, numCells, bitsPerCell):
+        self.__numCells = numCells
+        self.__bitsPerCell = bitsPerCell
+        self.__mask = (1 << bitsPerCell) - 1
+        self.__cells = bytearray((numCells * bitsPerCell + 7) // 8)
+
+    # returns the first bit of value i, and the range of bytes it is in
+    def __bytesOf(self, i):
+        start = i * self.__bitsPerCell
+        return start & 7, start >> 3, (start + self.__bitsPerCell + 7) >> 3
+
+    # returns the value of cell i
+    def get(self, i):
+        shift, first, last = self.__bytesOf(i)
+        return (int.from_bytes(self.__cells[first:last], "little") >> shift) & self.__mask
+
+    # makes the value of cell i be val (which must fit in bitsPerCell bits)
+    def set(self, i, val):
+        shift, first, last = self.__bytesOf(i)
+        word = int.from_bytes(self.__cells[first:last], "little")
+        word = (word & ~(self.__mask << shift)) | (val << shift)
+        self.__cells[first:last] = word.to_bytes(last - first, "little")
+
+    # returns the number of cells
+    def __len__(self):
+        return self.__numCells
+
+    # returns how many bytes the cells take up
+    def nbytes(self):
+        return len(self.__cells)
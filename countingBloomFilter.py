@@ -1,172 +1,437 @@
-from BitVector import BitVector
-from BitHash import BitHash
+from counterArray import CounterArray
+from filterStats import FilterStats
+import filterPlanner
+import math
+import bloomHashing
+import numpy as np
+import itertools
 import pytest
+import time
 
 class CountingBloomFilter(object):
     
-    # find bits per cell: 2**n -1 = max count for each cell
-    # n is the number of bits per cell 
-    # loop to try solving for n - keep going higher until you reach a number thats >= maxcount
-    def __numBitsPerCell(self, maxCount):
-        numBitsPerCell = 0
-        
-        while (2**numBitsPerCell) -1 < maxCount:
-            numBitsPerCell+=1
-            
-        # once you've fallen out of the loop, the number of bits per cell is >= to the maxCount
-        return numBitsPerCell
-
     # returns the number of bitsNeeded for this CBF
     def __bitsNeeded(self, numBitsPerCell, numCells):
         # get the total bits needed by mulitplying bits per cell and 
         # the total number of cells speciifed by client        
         return  int(numBitsPerCell * numCells)
     
+    # picks numHashes and numCells for a filter that counts numKeys keys up
+    # to maxCount with a false positive rate of maxFalsePositive, the same
+    # way BloomFilter.plan does (max_bytes, max_probes, max_ns and calibrate
+    # mean the same there). Counters are stored in nibbles, bytes or wider
+    # words, so the maxCount in the answer is the highest count the chosen 
+    # width holds for free. The filter is
+    #     CountingBloomFilter(p["numCells"], p["numHashes"], p["maxCount"], hashing)
+    @staticmethod
+    def plan(numKeys, maxFalsePositive, maxCount = 15, max_bytes = None, max_probes = None, 
+             max_ns = None, hashing = bloomHashing.CHAINED, calibrate = False):
+        bloomHashing.checkHashing(hashing)
+        bitsPerCell = CounterArray.storageBits(CounterArray.bitsFor(maxCount))
+        
+        # the cells needed come from the same equations B and D as the bits of a BloomFilter
+        def cellsNeeded(d, P):
+            phi = 1 - P**(1/d)
+            return math.ceil(d / (1 - phi**(1/numKeys)))
+        
+        def bytesNeeded(d, P):
+            return (cellsNeeded(d, P) * bitsPerCell + 7) // 8
+        
+        def falsePositiveAt(d, numBytes):
+            numCells = numBytes * 8 // bitsPerCell
+            if d >= numCells: return 1.0
+            return (1 - (1 - d / numCells)**numKeys)**d
+        
+        ans = filterPlanner.plan(numKeys, maxFalsePositive, bytesNeeded, falsePositiveAt, max_bytes, 
+                                 max_probes, max_ns, hashing, 0, calibrate, (bitsPerCell + 7) // 8)
+        ans["numCells"] = cellsNeeded(ans["numHashes"], ans["maxFalsePositive"])
+        ans["bitsPerCell"] = bitsPerCell
+        ans["maxCount"] = 2**bitsPerCell - 1
+        return ans
+    
     # Create a Counting Bloom Filter that will keep track 
     # of the number of inserted keys, using numHashes hash 
     # functions, and that will count each key up to the maxCount.
+    # hashing picks how the numHashes cells of a key are computed,
+    # the same choices as for the BloomFilter (see bloomHashing.py).
+    # with conservative, an insert only increments the cells of the key 
+    # that hold its current (minimum) count, since the others are already
+    # too high because of other keys. Counts come out much closer to the 
+    # truth, but a delete can then take a key's cells below its real count,
+    # so only use it when keys are never (or rarely) deleted.
+    # cacheSize is how many keys to remember the cells of (see setCacheSize).
     # All attributes must be private.
-    def __init__(self, numCells, numHashes, maxCount):
-        # will need to use __numBitsPerCell to find the number of bits per cell needed
-        self.__bitsPC = self.__numBitsPerCell(maxCount)
+    def __init__(self, numCells, numHashes, maxCount, hashing = bloomHashing.CHAINED, 
+                 conservative = False, cacheSize = 0):
+        # the number of bits per cell needed: 2**n -1 >= max count for each cell
+        self.__bitsPC = CounterArray.bitsFor(maxCount)
           
-        # will need to use __bitsNeeded to figure out how big
-        # of a BitVector will be needed
+        # will need to use __bitsNeeded to figure out how many
+        # bits the counters need all together
         self.__N = self.__bitsNeeded(self.__bitsPC,numCells)
         
-        #bitvector
-        self.__BV = BitVector(size = self.__N)
+        #the counters, packed as tightly as bitsPC allows (see counterArray.py).
+        #which pages changed is only kept track of from the first snapshot_full on
+        self.__BV = CounterArray(numCells, self.__bitsPC)
         
         #numhashes
         self.__numHashes = numHashes
         
+        #how the cells of each key are computed
+        self.__hashing = bloomHashing.checkHashing(hashing)
+        
         #numCells
         self.__numCells = numCells
         
         #maxCount
         self.__maxCount = maxCount
         
+        #whether inserts only raise the cells at the minimum
+        self.__conservative = conservative
+        
+        #recently used keys and their cells, None when turned off
+        self.__cache = None
+        self.setCacheSize(cacheSize)
+        
         #keys inserted - this was part of the false positive rate eq therefore i dont need right?
         self.__numInserted = 0
         
+        #counters and latencies, None unless enableStats is called
+        self.__stats = None
+        
     # insert the specified key into the Counting Bloom Filter.
     # Doesn't return anything, since an insert into 
     # a Counting Bloom Filter always succeeds!
     def insert(self, key):
+        if self.__stats is not None:
+            self.__addWithStats(key, 1, "insert")
+            return
+        if self.__conservative:
+            self.__conservativeAdd(key, 1)
+            return
         
-        # by default it will be zero 
-        hashval = 0
-        
-        # for each i, bithash the key for the hashval which will be the prev hashval 
-        for i in range(self.__numHashes): #loop numHashes times
-            
-            hashval = BitHash(key, hashval)
-    
-            # mod by the number of cells
-            moddedHashval = hashval % self.__numCells
+        # get each of the numHashes cells of the key, already modded by the number of cells
+        # (for the chained strategy, bithash the key for the hashval which will be the prev hashval)
+        for moddedHashval in self.__positions(key):
             
-            # extract the binary value of the location of insertion: 
-            # to do this, slice the bit vector starting at the moddedHashval times the number of bits per cell,
-            # up until that number, plus the number of bits per cell minus 1
-            # for example, if it was a 4 bit cell and the moddedHashval was 2, you want to set the 8th-11th bits of the BV
-            
-            # i is the start of my slice
-            i = moddedHashval*self.__bitsPC
-            
-            # j is where I'm slicing until
-            j = i + self.__bitsPC
-            
-            # save the current binary val of the location you will later be updating 
-            curBinaryVal = self.__BV[i:j]
-            
-            # switch the value from binary to int: 
-            # to do this, use the in_val() method
-            integerVal = curBinaryVal.int_val()
+            # get the current count of the cell, 
+            # which is sitting in the CounterArray already as an int
+            integerVal = self.__BV.get(moddedHashval)
             
             # incrememnt the value of this location by 1, assuming the number will 
             # be less than or equal to the limit specified by user(maxCount)
             if integerVal < self.__maxCount: 
-                integerVal+=1
-            
-            # switch back to binary value so we can update the CBF appropriately: 
-            # to do this, construct a small bv from the incremented integer above
-            bv2 = BitVector(intVal = integerVal, size = len(self.__BV[i:j]))
-           
-            # update the value at location of insertion 
-            # assign the small bv2 back into the specified slice of bits in the main BitVector
-            self.__BV[i:j] = bv2
+                # update the value at location of insertion
+                self.__BV.set(moddedHashval, integerVal+1)
          
          # you dont need to return anything because it always succeeds    
    
     # the find method Returns True if key has been inserted into the CBF n or more times. 
     # Returns False otherwise 
     def find(self, key, n = 1):
-        hashval = 0
+        if self.__stats is not None:
+            return self.__countWithStats(key, "find") >= n
+        
+        # if inserted n or more times meaning minVal >= n, return True 
+        # return False otherwise
+        return self.count(key) >= n
+    
+    # returns how many times key has (probably) been inserted: the minimum
+    # count over its cells. It is never less than the real count (unless 
+    # keys were deleted in conservative mode), and is at most maxCount.
+    def count(self, key):
+        if self.__stats is not None:
+            return self.__countWithStats(key, "count")
         
         # set the default value of the minimum hash to the maxCount
         # as you find each hash of the key, update the minVal to the accurate min
         minVal = self.__maxCount
         
         # loop through all locations of the key to get the minVal of the key
-        for i in range(self.__numHashes):
-            hashval = BitHash(key, hashval)
-            moddedHashval = hashval % self.__numCells
+        for moddedHashval in self.__positions(key):
             
-            # get the slice of the BV where the key will be found
-            i = moddedHashval*self.__bitsPC
-            j = i + self.__bitsPC
-              
-            curBinaryVal = self.__BV[i:j]
-        
-            # switch the value from binary to int to see how many times the key was inserted in int form
-            # to do this, use the in_val() method
-            integerVal = curBinaryVal.int_val()
+            # get the count of the cell where the key will be found
+            integerVal = self.__BV.get(moddedHashval)
             
             # if the current cell has a val that's lower than minVal, update minVal
             if integerVal < minVal: 
                 minVal = integerVal
                         
-        # if inserted n or more times meaning minVal >= n, return True 
-        if minVal >=n: return True
-        
-        # return False otherwise
-        return False
+        return minVal
        
     # delete function - delete one occurance per bit of the key
     # to delete one occurance of the key, loop through numHashes and decrement each hash by one     
     def delete(self, key):
+        if self.__stats is not None:
+            self.__addWithStats(key, -1, "delete")
+            return
         
-        # by default it will be zero 
-        hashval = 0
-        
-        # for each i, bithash the key for the hashval which will be the prev hashval    
-        for i in range(self.__numHashes): #loop numHashes times
-           
-            hashval = BitHash(key, hashval)
-            moddedHashval = hashval % self.__numCells
+        # get each of the numHashes cells of the key, already modded by the number of cells
+        for moddedHashval in self.__positions(key):
               
-            # extract the binary value of the location of insertion
-            # slice locations are i to j-1
-            i = moddedHashval*self.__bitsPC
-            j = i + self.__bitsPC
-            
-            curBinaryVal = self.__BV[i:j]
-            
-            # switch the value from binary to int
-            # to do this, use the in_val() method
-            integerVal = curBinaryVal.int_val()
+            integerVal = self.__BV.get(moddedHashval)
           
             # decrement by 1, never allowing the value to go below zero
             if integerVal > 0: 
-                integerVal-=1
+                # update the value at location of deletion
+                self.__BV.set(moddedHashval, integerVal-1)
+            
+    # add n to the count of key: the same as calling insert n times 
+    # (or delete -n times, when n is negative), but every cell of the key
+    # only gets read and written once
+    def add(self, key, n = 1):
+        if self.__stats is not None:
+            self.__addWithStats(key, n, "add")
+            return
+        if self.__conservative and n > 0:
+            self.__conservativeAdd(key, n)
+            return
+        
+        for moddedHashval in self.__positions(key):
+            integerVal = self.__BV.get(moddedHashval)
+            
+            # clamp to the range the repeated inserts or deletes would have left it in
+            self.__BV.set(moddedHashval, min(max(integerVal + n, 0), self.__maxCount))
+    
+    # returns how many bytes the counters take up
+    def numBytes(self):
+        return self.__BV.nbytes()
+    
+    # returns the cells of key, from the cache if it is turned on
+    def __positions(self, key):
+        if self.__cache is None:
+            return bloomHashing.positions(key, self.__numHashes, self.__numCells, self.__hashing)
+        return self.__cache.get(key, lambda: bloomHashing.positions(
+            key, self.__numHashes, self.__numCells, self.__hashing))
+    
+    # keep the cells of the cacheSize most recently used keys, so that 
+    # inserting, finding or deleting a hot key again skips the hashing. 
+    # 0 turns the cache off (and empties it), which is the default
+    def setCacheSize(self, cacheSize):
+        self.__cache = bloomHashing.PositionCache(cacheSize) if cacheSize > 0 else None
+    
+    # returns the size, maxSize, hits and misses of the cache, or None if it is off
+    def cacheStats(self):
+        return None if self.__cache is None else self.__cache.stats()
+    
+    # start keeping stats (see filterStats.py) of this filter's calls, and
+    # return them. The counters are "hashRounds" (BitHash digests computed), 
+    # "probes" (cells read by finds and counts), "finds", "inserts", 
+    # "deletes", "saturated" (increments lost because a cell was already at 
+    # maxCount) and "clamped" (decrements lost because a cell was already 
+    # at zero), and fillRatio is the fraction of cells that aren't zero.
+    # If stats are already on, the same object is returned.
+    def enableStats(self):
+        if self.__stats is None:
+            self.__stats = FilterStats(lambda: self.__BV.numNonzero() / self.__numCells)
+        return self.__stats
+    
+    # stop keeping stats, which makes every call as fast as before
+    def disableStats(self):
+        self.__stats = None
+    
+    # returns the FilterStats of this filter, or None if they are off
+    def stats(self):
+        return self.__stats
+    
+    # the hash rounds it takes to compute all the cells of count keys
+    def __rounds(self, count = 1):
+        return count * bloomHashing.hashRounds(self.__hashing, self.__numHashes, self.__numHashes)
+    
+    # returns the cells of key, counting the hash rounds unless they came from the cache
+    def __statsPositions(self, key):
+        if self.__cache is None:
+            self.__stats.add("hashRounds", self.__rounds())
+            return self.__positions(key)
+        
+        def compute():
+            self.__stats.add("hashRounds", self.__rounds())
+            return bloomHashing.positions(key, self.__numHashes, self.__numCells, self.__hashing)
+        return self.__cache.get(key, compute)
+    
+    # count (for find or count), counting its probes and timing it into the stats
+    def __countWithStats(self, key, method):
+        stats = self.__stats
+        start = time.perf_counter()
+        
+        minVal = self.__maxCount
+        probes = 0
+        for moddedHashval in self.__statsPositions(key):
+            probes += 1
+            minVal = min(minVal, self.__BV.get(moddedHashval))
+        
+        stats.add("finds")
+        stats.add("probes", probes)
+        stats.time(method, time.perf_counter() - start)
+        return minVal
+    
+    # insert (n > 0) or delete (n < 0) key n times, the same way insert, 
+    # delete or add would have, counting and timing it into the stats
+    def __addWithStats(self, key, n, method):
+        stats = self.__stats
+        start = time.perf_counter()
+        
+        if self.__conservative and n > 0:
+            lost = self.__conservativeAdd(key, n, self.__statsPositions(key))
+        else:
+            lost = 0
+            for moddedHashval in self.__statsPositions(key):
+                integerVal = self.__BV.get(moddedHashval) + n
+                self.__BV.set(moddedHashval, min(max(integerVal, 0), self.__maxCount))
+                lost += max(integerVal - self.__maxCount, -integerVal, 0)
+        
+        stats.add("inserts" if n > 0 else "deletes", abs(n))
+        stats.add("saturated" if n > 0 else "clamped", lost)
+        stats.time(method, time.perf_counter() - start)
+    
+    # conservative update: n inserts of key, each raising only the cells that 
+    # are at the key's minimum count. Together that leaves every cell of the
+    # key at least at min + n (but not past maxCount), and the rest alone.
+    # returns how many of the n went past maxCount
+    def __conservativeAdd(self, key, n, cells = None):
+        cells = tuple(self.__positions(key) if cells is None else cells)
+        wanted = min(self.__BV.get(cell) for cell in cells) + n
+        target = min(wanted, self.__maxCount)
+        
+        for cell in cells:
+            if self.__BV.get(cell) < target:
+                self.__BV.set(cell, target)
+        return wanted - target
+    
+    # splits an iterable of items into batches of at most __BATCH (keys, counts).
+    # an item is either a key, which counts once, or a (key, count) pair
+    __BATCH = 1 << 16
+    def __batches(self, items):
+        items = iter(items)
+        while True:
+            batch = list(itertools.islice(items, self.__BATCH))
+            if not batch: return
+            
+            keys = []
+            counts = []
+            for item in batch:
+                if isinstance(item, tuple):
+                    key, count = item
+                    if count < 0: 
+                        raise ValueError("count for " + repr(key) + " can't be negative")
+                else:
+                    key, count = item, 1
+                keys.append(key)
+                counts.append(count)
+            yield keys, counts
+    
+    # add (or with sign -1, take away) the counts of a whole batch of keys 
+    # to their cells in one vectorized pass of the CounterArray
+    def __addMany(self, items, sign):
+        stats = self.__stats
+        if stats is not None:
+            start = time.perf_counter()
+        
+        for keys, counts in self.__batches(items):
+            # a conservative insert depends on what the keys before it did,
+            # so those go one key at a time
+            if self.__conservative and sign > 0:
+                lost = 0
+                for key, count in zip(keys, counts):
+                    lost += self.__conservativeAdd(key, count)
+            else:
+                cells = bloomHashing.positionsMany(keys, self.__numHashes, self.__numCells, self.__hashing)
                 
-            # switch back to binary value
-            # construct a small bv from the decremented integer above
-            bv2 = BitVector(intVal = integerVal, size =len(self.__BV[i:j]))
+                # every one of a key's numHashes cells gets the key's count
+                amounts = np.repeat(np.array(counts, dtype=np.int64) * sign, self.__numHashes)
+                lost = self.__BV.addMany(cells.ravel(), amounts, self.__maxCount)
             
-            # update the value at location of deletion
-            # assign the small bv2 back into the specified slice of bits in the main BitVector
-            self.__BV[i:j] = bv2
+            if stats is not None:
+                stats.add("inserts" if sign > 0 else "deletes", sum(counts))
+                stats.add("saturated" if sign > 0 else "clamped", lost)
+                stats.add("hashRounds", self.__rounds(len(keys)))
+        
+        if stats is not None:
+            stats.time("insert_many" if sign > 0 else "delete_many", time.perf_counter() - start)
+    
+    # returns a snapshot of all the counters, as a dict with the version
+    # it was taken at, and a list of (first page, bytes) runs of pages.
+    # apply_delta on a CountingBloomFilter made with the same numCells and
+    # maxCount turns it into a copy of this one.
+    # the first one starts keeping track of the pages that change, which 
+    # writes cost a little more for, so filters never snapshotted don't pay it.
+    def snapshot_full(self):
+        self.__BV.startTracking()
+        version = self.__BV.checkpoint()
+        return self.__snapshot(version, None, [(0, self.__BV.numPages())])
+    
+    # returns a snapshot of only the pages of counters that changed after 
+    # the snapshot with version since (full or delta) was taken. Applied to 
+    # a replica that has that snapshot, it brings the replica up to date.
+    def snapshot_delta(self, since):
+        if not self.__BV.tracksPages():
+            raise ValueError("snapshot_delta needs a snapshot_full of this filter to be since")
+        version = self.__BV.checkpoint()
+        
+        # group the changed pages into runs of neighbouring pages
+        runs = []
+        for page in self.__BV.dirtyPages(since):
+            if runs and runs[-1][1] == page:
+                runs[-1][1] = page + 1
+            else:
+                runs.append([page, page + 1])
+        return self.__snapshot(version, since, runs)
+    
+    def __snapshot(self, version, since, runs):
+        return {"version": version, "since": since, 
+                "numCells": self.__numCells, "bitsPerCell": self.__bitsPC,
+                "pages": [(first, self.__BV.readPages(first, last)) for first, last in runs]}
+    
+    # copy the pages of a snapshot from snapshot_full or snapshot_delta into
+    # this filter. A delta only makes sense on top of the snapshot it is since.
+    def apply_delta(self, snapshot):
+        if (snapshot["numCells"], snapshot["bitsPerCell"]) != (self.__numCells, self.__bitsPC):
+            raise ValueError("snapshot is of a CountingBloomFilter with different numCells or maxCount")
+        
+        for first, data in snapshot["pages"]:
+            self.__BV.writePages(first, data)
+    
+    # returns count(key) for every key of the iterable, as a list, hashing
+    # and reading the cells of a whole batch of keys at a time
+    def count_many(self, keys):
+        stats = self.__stats
+        if stats is not None:
+            start = time.perf_counter()
+        
+        keys = iter(keys)
+        ans = []
+        while True:
+            batch = list(itertools.islice(keys, self.__BATCH))
+            if not batch: break
+            
+            cells = bloomHashing.positionsMany(batch, self.__numHashes, self.__numCells, self.__hashing)
+            ans.extend(self.__BV.getMany(cells).min(axis = 1).tolist())
+            
+            if stats is not None:
+                stats.add("finds", len(batch))
+                stats.add("probes", cells.size)
+                stats.add("hashRounds", self.__rounds(len(batch)))
+        
+        if stats is not None:
+            stats.time("count_many", time.perf_counter() - start)
+        return ans
+    
+    # returns a list of one bool per key of the iterable, the same as 
+    # find(key, n) for each of them, but hashed and read a batch at a time
+    def find_many(self, keys, n = 1):
+        return [count >= n for count in self.count_many(keys)]
+    
+    # insert every item of the iterable, where an item is a key (inserted 
+    # once) or a (key, count) pair (inserted count times). Ends up exactly 
+    # like calling insert that many times, saturating at maxCount.
+    def insert_many(self, items):
+        self.__addMany(items, 1)
+    
+    # delete every item of the iterable, where an item is a key (deleted 
+    # once) or a (key, count) pair (deleted count times). Ends up exactly
+    # like calling delete that many times, never going below zero.
+    def delete_many(self, items):
+        self.__addMany(items, -1)
             
 # implement pytests to check the methods work accurately
 
@@ -291,6 +556,237 @@ def test_deleteBelowZero():
     # assert that there are exactly zero instances of shira and not -1 instances
     assert BV.find("shira",0) == True
     
+# test that every hashing strategy counts the same way, and that 
+# an unknown one is refused
+def test_hashingStrategies():
+    for hashing in bloomHashing.STRATEGIES:
+        BV = CountingBloomFilter(100, 4, 15, hashing)
+        for i in range(3):
+            BV.insert("shira")
+        
+        assert BV.find("shira",3) == True
+        assert BV.find("shira",4) == False
+        
+        BV.delete("shira")
+        assert BV.find("shira",3) == False
+        
+    with pytest.raises(ValueError):
+        CountingBloomFilter(100, 4, 15, "sha1")
+    
+# test that the counters saturate at maxCount for every width of 
+# counter (nibbles, bytes, and the wider array types)
+def test_counterWidths():
+    for maxCount in (3, 15, 200, 1000, 100000):
+        BV = CountingBloomFilter(10000, 3, maxCount)
+        for i in range(maxCount + 5):
+            BV.insert("shira")
+        BV.insert("jacob")
+        
+        assert BV.find("shira", maxCount) == True
+        assert BV.find("shira", maxCount + 1) == False
+        assert BV.find("jacob") == True
+        
+        # a delete starts from the saturated count
+        BV.delete("shira")
+        assert BV.find("shira", maxCount) == False
+        assert BV.find("shira", maxCount - 1) == True
+    
+    # the cell widths all the counting filters share: the fewest bits that reach maxCount
+    assert [CounterArray.bitsFor(m) for m in (0, 1, 2, 3, 4, 15, 16, 255, 256)] == [0, 1, 2, 2, 3, 4, 5, 8, 9]
+    
+# test that the bulk methods leave the counts exactly where the 
+# same number of single inserts and deletes would have
+def test_bulkMatchesSingle():
+    for maxCount in (15, 200, 1000):
+        single = CountingBloomFilter(40, 3, maxCount)
+        bulk = CountingBloomFilter(40, 3, maxCount)
+        added = CountingBloomFilter(40, 3, maxCount)
+        
+        items = [("shira", 7), "jacob", ("jacob", 2), ("dina", maxCount + 10), ("levi", 0)]
+        for item in items:
+            key, count = item if isinstance(item, tuple) else (item, 1)
+            for i in range(count):
+                single.insert(key)
+            added.add(key, count)
+        bulk.insert_many(items)
+        
+        for BV in (single, bulk, added):
+            BV.delete("dina")
+        bulk.delete_many([("shira", 4)])
+        added.add("shira", -4)
+        for i in range(4):
+            single.delete("shira")
+        
+        for key in ("shira", "jacob", "dina", "levi", "reuven"):
+            for n in range(maxCount + 2):
+                assert single.find(key, n) == bulk.find(key, n) == added.find(key, n)
+    
+    with pytest.raises(ValueError):
+        bulk.insert_many([("shira", -1)])
+    
+# test that count_many and find_many give what count and find give, for
+# every hashing strategy and counter width
+def test_findMany():
+    keys = ["key" + str(i) for i in range(300)] + ["shira"] * 3
+    for hashing in bloomHashing.STRATEGIES:
+        for maxCount in (15, 200, 70000, 2**40):
+            BV = CountingBloomFilter(500, 3, maxCount, hashing)
+            BV.insert_many(keys[::2])
+            BV.insert_many([("shira", 5), ("jacob", maxCount + 1)])
+            
+            probe = keys + ["jacob", "reuven"]
+            assert BV.count_many(probe) == [BV.count(key) for key in probe]
+            for n in (0, 1, 2, 6, maxCount):
+                assert BV.find_many(probe, n) == [BV.find(key, n) for key in probe]
+            assert BV.find_many([]) == []
+
+# test that count gives the count find is based on
+def test_count():
+    BV = CountingBloomFilter(1000, 3, 15)
+    for i in range(4):
+        BV.insert("shira")
+    for i in range(20):
+        BV.insert("jacob")
+    
+    assert BV.count("shira") == 4
+    assert BV.count("jacob") == 15
+    assert BV.count("reuven") == 0
+
+# test that conservative update never undercounts, and overcounts no 
+# more than the ordinary update does when keys collide
+def test_conservative():
+    plain = CountingBloomFilter(20, 3, 255)
+    conservative = CountingBloomFilter(20, 3, 255, conservative = True)
+    bulk = CountingBloomFilter(20, 3, 255, conservative = True)
+    
+    counts = {}
+    for i in range(60):
+        key = "key" + str(i % 15)
+        counts[key] = counts.get(key, 0) + 1
+        plain.insert(key)
+        conservative.insert(key)
+    bulk.insert_many(counts.items())
+    
+    for key in counts:
+        assert counts[key] <= conservative.count(key) <= plain.count(key)
+        assert counts[key] <= bulk.count(key)
+    
+# test that the position cache gives the same answers, counts hits and 
+# misses, stays within its size, and can be turned off
+def test_positionCache():
+    plain = CountingBloomFilter(100, 4, 15)
+    cached = CountingBloomFilter(100, 4, 15, cacheSize = 2)
+    
+    for key in ("shira", "jacob", "shira", "shira", "dina", "jacob"):
+        plain.insert(key)
+        cached.insert(key)
+    cached.delete("shira")
+    plain.delete("shira")
+    
+    for key in ("shira", "jacob", "dina", "levi"):
+        assert plain.count(key) == cached.count(key)
+    
+    stats = cached.cacheStats()
+    assert stats["size"] == 2
+    assert stats["hits"] + stats["misses"] == 11
+    assert stats["hits"] == 4
+    
+    cached.setCacheSize(0)
+    assert cached.cacheStats() == None
+    assert cached.find("shira", 2) == True
+    
+# test that a replica kept up to date with deltas matches the original,
+# and that a delta only holds the pages that changed
+def test_snapshots():
+    for maxCount in (15, 255, 65535, 2**40):
+        BV = CountingBloomFilter(100000, 3, maxCount)
+        replica = CountingBloomFilter(100000, 3, maxCount)
+        BV.insert_many("key" + str(i) for i in range(1000))
+        
+        # pages are only kept track of from the first full snapshot on
+        with pytest.raises(ValueError):
+            BV.snapshot_delta(0)
+        full = BV.snapshot_full()
+        replica.apply_delta(full)
+        
+        BV.insert("shira")
+        BV.add("jacob", 2)
+        delta = BV.snapshot_delta(full["version"])
+        assert sum(len(data) for first, data in delta["pages"]) <= 6 * CounterArray.PAGE_BYTES
+        replica.apply_delta(delta)
+        
+        # nothing changed since the delta
+        assert BV.snapshot_delta(delta["version"])["pages"] == []
+        
+        BV.delete_many(["key1", "shira"])
+        replica.apply_delta(BV.snapshot_delta(delta["version"]))
+        for key in ["key" + str(i) for i in range(1000)] + ["shira", "jacob", "reuven"]:
+            assert replica.count(key) == BV.count(key)
+    
+    with pytest.raises(ValueError):
+        CountingBloomFilter(100, 3, 15).apply_delta(full)
+
+# test that stats count saturated inserts, clamped deletes and probes,
+# and that turning them on doesn't change any answers
+def test_stats():
+    BV = CountingBloomFilter(1000, 3, 3, bloomHashing.DOUBLE)
+    assert BV.stats() is None
+    stats = BV.enableStats()
+    
+    for i in range(5):
+        BV.insert("shira")
+    BV.insert_many(["jacob"] * 4)
+    for i in range(5):
+        BV.delete("jacob")
+    
+    assert BV.count("shira") == 3
+    assert BV.find("jacob") == False
+    
+    counters = stats.asDict()["counters"]
+    assert counters["inserts"] == 9
+    assert counters["saturated"] == 2 * 3 + 1 * 3
+    assert counters["deletes"] == 5
+    assert counters["clamped"] == 2 * 3
+    assert counters["finds"] == 2
+    assert counters["probes"] == 2 * 3
+    assert counters["hashRounds"] == 16 * 2
+    assert 0 < stats.asDict()["fillRatio"] <= 3 / 1000
+    
+    text = stats.prometheus("cbf")
+    assert "cbf_saturated_total 9" in text
+    assert 'cbf_latency_seconds_count{method="insert"} 5' in text
+    
+    BV.disableStats()
+    BV.insert("reuven")
+    assert BV.stats() is None and BV.find("reuven") == True
+
+# test that a planned filter fits its budget, and finds its keys
+def test_plan():
+    p = CountingBloomFilter.plan(1000, .01, maxCount = 10)
+    assert (p["bitsPerCell"], p["maxCount"], p["meetsTarget"]) == (4, 15, True)
+    
+    # within budget: fewer hashes for more memory
+    roomy = CountingBloomFilter.plan(1000, .01, max_bytes = 4 * p["numBytes"])
+    assert roomy["numHashes"] < p["numHashes"] and roomy["numBytes"] <= 4 * p["numBytes"]
+    assert CountingBloomFilter.plan(1000, .01, max_probes = 2)["numHashes"] <= 2
+    
+    # too small a budget gives up on the rate, not the budget
+    tight = CountingBloomFilter.plan(1000, .01, max_bytes = p["numBytes"] // 2)
+    assert tight["meetsTarget"] == False and tight["maxFalsePositive"] > .01
+    
+    BV = CountingBloomFilter(tight["numCells"], tight["numHashes"], tight["maxCount"])
+    assert BV.numBytes() <= p["numBytes"] // 2
+    for i in range(1000):
+        BV.insert(str(i))
+    assert all(BV.find(str(i)) for i in range(1000))
+    
+    # a budget that can't hold a useful filter is rejected
+    for maxBytes in (0, 1, 100):
+        with pytest.raises(ValueError):
+            CountingBloomFilter.plan(10000, .01, max_bytes = maxBytes)
+    with pytest.raises(ValueError):
+        CountingBloomFilter.plan(10, .01, maxCount = 2**20, max_bytes = 2)
+
 # test an empty CBF
 def test_emptyCBF():
     numCells = 20
@@ -300,4 +796,5 @@ def test_emptyCBF():
     assert BV.find("shira") == False
     
     
-pytest.main(["-v", "-s", "countingBloomFilter.py"])
\ No newline at end of file
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "countingBloomFilter.py"])
\ No newline at end of file
@@ -0,0 +1,253 @@
+from counterArray import PackedArray
+from BitHash import BitHash
+import random
+import math
+import pytest
+
+# a cuckoo filter (Fan et al.) answers "may this key have been inserted?"
+# like a Bloom Filter, and supports delete like a Counting Bloom Filter,
+# but only stores a short fingerprint of each key, in one of two buckets.
+#
+# the two buckets of a key are i1 = hash(key) and i2 = hash(fingerprint) - i1
+# (mod the number of buckets), so the other bucket of a fingerprint can be
+# found from the bucket it is in and the fingerprint alone, since
+# hash(fingerprint) - i2 is i1 again. That is what lets an insert into two
+# full buckets kick a fingerprint out to its other bucket, which may kick
+# out another, and so on, up to maxKicks times. Unlike i1 xor hash(fingerprint)
+# it works for any number of buckets, not just a power of 2.
+#
+# the fingerprints are packed at their real width (see PackedArray), so a
+# filter takes about fingerprintBits / .95 bits per key.
+class CuckooFilter(object):
+
+    # the fraction of the slots a cuckoo filter with 4 slot buckets can
+    # fill before inserts start failing
+    __LOAD = .95
+
+    # Create a Cuckoo Filter that will store numKeys keys and that will
+    # have a false positive rate of maxFalsePositive, using buckets of
+    # bucketSize fingerprints.
+    # All attributes must be private.
+    def __init__(self, numKeys, maxFalsePositive, bucketSize = 4, maxKicks = 500, seed = 0):
+        # a lookup compares against 2*bucketSize fingerprints, each of which
+        # matches by chance with probability 1/2**f, so P is about 2b/2**f
+        self.__fingerprintBits = min(32, max(1, math.ceil(math.log2(2 * bucketSize / maxFalsePositive))))
+
+        self.__numBuckets = max(1, math.ceil(numKeys / (bucketSize * self.__LOAD)))
+        self.__bucketSize = bucketSize
+        self.__maxKicks = maxKicks
+        self.__falsePositive = maxFalsePositive
+
+        # the fingerprints, bucketSize slots per bucket. 0 is an empty slot,
+        # so fingerprints are never 0
+        self.__slots = PackedArray(self.__numBuckets * bucketSize, self.__fingerprintBits)
+
+        # keys inserted
+        self.__numInserted = 0
+
+        # picks which fingerprint gets kicked out
+        self.__random = random.Random(seed)
+
+    # returns the fingerprint and the two buckets of key
+    def __hash(self, key):
+        h = BitHash(key)
+        fingerprint = (h >> 32) % ((1 << self.__fingerprintBits) - 1) + 1
+        i1 = (h & 0xFFFFFFFF) % self.__numBuckets
+        return fingerprint, i1, self.__altBucket(i1, fingerprint)
+
+    # the other bucket of a fingerprint that is in bucket i
+    def __altBucket(self, i, fingerprint):
+        # mix up the fingerprint, so that nearby fingerprints go far away
+        mixed = (fingerprint * 0x5BD1E995) & 0xFFFFFFFF
+        mixed ^= mixed >> 15
+        return (mixed - i) % self.__numBuckets
+
+    # put fingerprint in an empty slot of bucket i, returning False if it is full
+    def __putInBucket(self, i, fingerprint):
+        first = i * self.__bucketSize
+        for slot in range(first, first + self.__bucketSize):
+            if not self.__slots.get(slot):
+                self.__slots.set(slot, fingerprint)
+                return True
+        return False
+
+    # returns how many copies of fingerprint bucket i holds
+    def __countInBucket(self, i, fingerprint):
+        first = i * self.__bucketSize
+        count = 0
+        for slot in range(first, first + self.__bucketSize):
+            if self.__slots.get(slot) == fingerprint:
+                count += 1
+        return count
+
+    # take one copy of fingerprint out of bucket i, returning False if there was none
+    def __removeFromBucket(self, i, fingerprint):
+        first = i * self.__bucketSize
+        for slot in range(first, first + self.__bucketSize):
+            if self.__slots.get(slot) == fingerprint:
+                self.__slots.set(slot, 0)
+                return True
+        return False
+
+    # insert the specified key into the Cuckoo Filter.
+    # Returns True if the key was inserted, and False if the filter is full,
+    # in which case the filter is left just as it was.
+    def insert(self, key):
+        fingerprint, i1, i2 = self.__hash(key)
+        if self.__putInBucket(i1, fingerprint) or self.__putInBucket(i2, fingerprint):
+            self.__numInserted += 1
+            return True
+
+        # both buckets are full: kick a random fingerprint out of one of them
+        # into its other bucket, and repeat for whatever that one kicks out.
+        # every (slot, fingerprint) kicked out is kept, to undo them all
+        kicks = []
+        i = self.__random.choice((i1, i2))
+        for kick in range(self.__maxKicks):
+            slot = i * self.__bucketSize + self.__random.randrange(self.__bucketSize)
+            kicked = self.__slots.get(slot)
+            self.__slots.set(slot, fingerprint)
+            kicks.append((slot, kicked))
+
+            fingerprint = kicked
+            i = self.__altBucket(i, fingerprint)
+            if self.__putInBucket(i, fingerprint):
+                self.__numInserted += 1
+                return True
+
+        # out of kicks, with a fingerprint left that has nowhere to go. put
+        # every kicked fingerprint back, last first, so the key isn't in and
+        # every one that was in still is
+        for slot, kicked in reversed(kicks):
+            self.__slots.set(slot, kicked)
+        return False
+
+    # Returns True if key MAY have been inserted into the Cuckoo Filter
+    # n or more times (up to 2*bucketSize copies of a key can be stored).
+    # Returns False if it definitely hasn't been.
+    def find(self, key, n = 1):
+        fingerprint, i1, i2 = self.__hash(key)
+
+        count = self.__countInBucket(i1, fingerprint)
+        if i2 != i1:
+            count += self.__countInBucket(i2, fingerprint)
+        return count >= n
+
+    # delete one occurance of the key. Returns True if it was found and
+    # deleted, and False if the filter doesn't have it.
+    # only delete keys that were inserted, or another key's copy may go instead.
+    def delete(self, key):
+        fingerprint, i1, i2 = self.__hash(key)
+
+        if not (self.__removeFromBucket(i1, fingerprint) or self.__removeFromBucket(i2, fingerprint)):
+            return False
+
+        self.__numInserted -= 1
+        return True
+
+    # Returns the PROJECTED current false positive rate: a key that isn't
+    # there is compared against 2*bucketSize slots, each of which (at the
+    # current load) holds a fingerprint that matches with probability 1/(2**f - 1)
+    def falsePositiveRate(self):
+        load = self.__numInserted / (self.__numBuckets * self.__bucketSize)
+        return 1 - (1 - 1 / ((1 << self.__fingerprintBits) - 1))**(2 * self.__bucketSize * load)
+
+    # returns how many bytes the fingerprints take up
+    def numBytes(self):
+        return self.__slots.nbytes()
+
+# implement pytests to check the methods work accurately
+
+# throw a lot of keys in the filter and make sure they are all found
+def test_insertManyKeys():
+    numKeys = 2000
+    BV = CuckooFilter(numKeys, .01)
+    for i in range(numKeys):
+        assert BV.insert("key" + str(i)) == True
+
+    for i in range(numKeys):
+        assert BV.find("key" + str(i)) == True
+
+# test that copies of a key are counted, and deleted one at a time
+def test_delete():
+    BV = CuckooFilter(100, .01)
+    for i in range(3):
+        BV.insert("shira")
+
+    assert BV.find("shira", 3) == True
+    assert BV.find("shira", 4) == False
+
+    assert BV.delete("shira") == True
+    assert BV.find("shira", 3) == False
+    assert BV.find("shira", 2) == True
+
+    BV.delete("shira")
+    BV.delete("shira")
+    assert BV.find("shira") == False
+    assert BV.delete("shira") == False
+
+# test that inserting into a full filter fails instead of losing keys,
+# and that deletes make room again
+def test_full():
+    BV = CuckooFilter(8, .1, bucketSize = 2, maxKicks = 20)
+    inserted = []
+    for i in range(100):
+        if not BV.insert(str(i)): break
+        inserted.append(str(i))
+
+    assert len(inserted) < 100
+    for key in inserted:
+        assert BV.find(key) == True
+
+    for key in inserted:
+        assert BV.delete(key) == True
+    assert BV.insert("shira") == True
+    assert BV.find("shira") == True
+
+# test an empty filter
+def test_emptyFilter():
+    BV = CuckooFilter(100, .01)
+    assert BV.find("shira") == False
+
+# test that the fingerprints take their real width, about 10 bits a key
+# at .01 and 13 at .001 with 5% of the slots left over, even when the
+# number of buckets isn't a power of 2
+def test_bitsPerKey():
+    for maxFalse, bits in ((.01, 10), (.001, 13)):
+        numKeys = 20000     # 5264 buckets
+        BV = CuckooFilter(numKeys, maxFalse)
+        for i in range(numKeys):
+            assert BV.insert("key" + str(i)) == True
+        for i in range(numKeys):
+            assert BV.find("key" + str(i)) == True
+
+        assert BV.numBytes() * 8 / numKeys == pytest.approx(bits / .95, rel = .01)
+
+        falses = sum(BV.find("nokey" + str(i)) for i in range(20000))
+        assert falses / 20000 < 1.5 * maxFalse
+
+# test that an insert that runs out of kicks changes nothing: the key
+# isn't in, every key that was in still is, and deletes still work
+def test_failedInsert():
+    BV = CuckooFilter(24, .01, bucketSize = 2, maxKicks = 10)
+    inserted = []
+    failed = []
+    for i in range(200):
+        if BV.insert(str(i)): inserted.append(str(i))
+        else: failed.append(str(i))
+    assert failed
+
+    rate = BV.falsePositiveRate()
+    for key in inserted:
+        assert BV.find(key) == True
+    assert sum(BV.find(key) for key in failed) < len(failed) / 4
+
+    # the failed inserts weren't counted, and aren't there to delete
+    for key in inserted:
+        assert BV.delete(key) == True
+    assert BV.falsePositiveRate() == 0 < rate
+    for key in failed:
+        assert BV.delete(key) == False
+
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "cuckooFilter.py"])
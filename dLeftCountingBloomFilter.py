@@ -0,0 +1,223 @@
+from counterArray import CounterArray, PackedArray
+from BitHash import BitHash
+import math
+import pytest
+
+# a d-left counting bloom filter (Bonomi et al.) answers the same questions
+# as a CountingBloomFilter, with the same insert, find(key, n) and delete,
+# in a fraction of the memory.
+#
+# instead of numHashes counters per key it keeps ONE cell per key: a short
+# fingerprint of the key and a small counter. The cells are grouped into
+# buckets of cellsPerBucket cells, and the buckets into numHashes subtables.
+# a key can go in one bucket of each subtable, and is put in whichever of
+# those is least full (the leftmost one on a tie), which keeps the buckets
+# very evenly loaded.
+#
+# the bucket and fingerprint for each subtable come from one hash of the key
+# through a different permutation per subtable. Since a permutation can be
+# undone, two keys share a (bucket, fingerprint) in one subtable only if they
+# share it in all of them, so a key's fingerprint is never in two places and
+# delete always knows which cell to decrement.
+#
+# each cell is one PackedArray value of fingerprintBits + counter bits, the
+# fingerprint above the counter, so a 12 bit fingerprint with a 4 bit
+# counter takes 16 bits and not the 32 of a uint16 next to a nibble.
+class DLeftCountingBloomFilter(object):
+
+    # Create a d-left Counting Bloom Filter of about numCells cells, split
+    # into numHashes subtables, that will count each key up to the maxCount.
+    # each cell holds a fingerprintBits bit fingerprint next to its counter.
+    # the false positive rate is roughly numHashes * cellsPerBucket * load / 2**fingerprintBits.
+    # All attributes must be private.
+    def __init__(self, numCells, numHashes, maxCount, fingerprintBits = 12, cellsPerBucket = 8):
+        if numHashes < 1 or cellsPerBucket < 1 or fingerprintBits < 1:
+            raise ValueError("numHashes, cellsPerBucket and fingerprintBits must be at least 1")
+
+        self.__numHashes = numHashes
+        self.__maxCount = maxCount
+        self.__fingerprintBits = fingerprintBits
+        self.__cellsPerBucket = cellsPerBucket
+
+        # buckets in each subtable
+        self.__numBuckets = max(1, math.ceil(numCells / (numHashes * cellsPerBucket)))
+        self.__numCells = self.__numBuckets * numHashes * cellsPerBucket
+
+        # a "true fingerprint" is a number below M: a bucket and a fingerprint together
+        self.__M = self.__numBuckets << fingerprintBits
+
+        # one permutation x -> (a*x + b) % M per subtable. it is a
+        # permutation as long as a has no factor in common with M
+        self.__perms = []
+        for t in range(numHashes):
+            a = (0x9E3779B97F4A7C15 + 2 * t * 0x632BE59BD9B4E019) % self.__M | 1
+            while math.gcd(a, self.__M) != 1:
+                a += 2
+            self.__perms.append((a, (0xD1B54A32D192ED03 * (t + 1)) % self.__M))
+
+        # the fingerprint and the counter of every cell, as
+        # fingerprint << countBits | count. a cell with a count of zero is
+        # empty, whatever fingerprint is left in it
+        self.__countBits = CounterArray.bitsFor(maxCount)
+        self.__countMask = (1 << self.__countBits) - 1
+        self.__cells = PackedArray(self.__numCells, fingerprintBits + self.__countBits)
+
+    # returns, for each subtable, the index of the first cell of the key's
+    # bucket in that subtable, and the key's fingerprint there
+    def __candidates(self, key):
+        x = BitHash(key) % self.__M
+        mask = (1 << self.__fingerprintBits) - 1
+
+        ans = []
+        for t in range(self.__numHashes):
+            a, b = self.__perms[t]
+            y = (a * x + b) % self.__M
+            bucket = t * self.__numBuckets + (y >> self.__fingerprintBits)
+            ans.append((bucket * self.__cellsPerBucket, y & mask))
+        return ans
+
+    # returns the index of the cell that holds key, or None if it isn't in any
+    def __findCell(self, candidates):
+        for first, fingerprint in candidates:
+            for cell in range(first, first + self.__cellsPerBucket):
+                val = self.__cells.get(cell)
+                if val & self.__countMask and val >> self.__countBits == fingerprint:
+                    return cell
+        return None
+
+    # returns the count of cell
+    def __count(self, cell):
+        return self.__cells.get(cell) & self.__countMask
+
+    # insert the specified key into the filter.
+    # Returns True, unless the key wasn't in the filter yet and every bucket
+    # it could go in was full, in which case nothing is inserted and it
+    # returns False.
+    def insert(self, key):
+        candidates = self.__candidates(key)
+
+        # already there: count it again, up to maxCount
+        cell = self.__findCell(candidates)
+        if cell is not None:
+            if self.__count(cell) < self.__maxCount:
+                self.__cells.set(cell, self.__cells.get(cell) + 1)
+            return True
+
+        # otherwise take the first empty cell of the least loaded bucket
+        bestCell = None
+        bestLoad = self.__cellsPerBucket
+        for first, fingerprint in candidates:
+            load = 0
+            emptyCell = None
+            for cell in range(first, first + self.__cellsPerBucket):
+                if self.__count(cell):
+                    load += 1
+                elif emptyCell is None:
+                    emptyCell = cell
+
+            # strictly less, so that ties go to the leftmost subtable
+            if load < bestLoad:
+                bestLoad = load
+                bestCell = emptyCell
+                bestFingerprint = fingerprint
+
+        if bestCell is None:
+            return False
+
+        self.__cells.set(bestCell, (bestFingerprint << self.__countBits) | min(1, self.__maxCount))
+        return True
+
+    # Returns True if key has been inserted into the filter n or more times.
+    # Returns False otherwise
+    def find(self, key, n = 1):
+        cell = self.__findCell(self.__candidates(key))
+        count = 0 if cell is None else self.__count(cell)
+        return count >= n
+
+    # delete one occurance of the key, never going below zero.
+    # when its count gets to zero the key's cell is free again
+    def delete(self, key):
+        cell = self.__findCell(self.__candidates(key))
+        if cell is not None:
+            # the count is the low bits, and isn't zero
+            self.__cells.set(cell, self.__cells.get(cell) - 1)
+
+    # returns the number of cells (some may be unused)
+    def numCells(self):
+        return self.__numCells
+
+    # returns how many bytes the fingerprints and counters take up
+    def numBytes(self):
+        return self.__cells.nbytes()
+
+# implement pytests to check the methods work accurately
+
+# test that counts go up to maxCount and stop there
+def test_maxCountInsert():
+    BV = DLeftCountingBloomFilter(64, 4, 15)
+    for i in range(90):
+        assert BV.insert("shira") == True
+
+    assert BV.find("shira", 15) == True
+    assert BV.find("shira", 16) == False
+
+# test that counts of different keys are kept apart
+def test_find():
+    BV = DLeftCountingBloomFilter(64, 4, 15)
+    for i in range(4):
+        BV.insert("shira")
+    for i in range(15):
+        BV.insert("jacob")
+
+    assert BV.find("shira", 4) == True
+    assert BV.find("shira", 5) == False
+    assert BV.find("jacob", 15) == True
+    assert BV.find("reuven") == False
+
+# test that delete takes away one occurance, and frees the cell at zero
+def test_delete():
+    BV = DLeftCountingBloomFilter(64, 4, 15)
+    for i in range(4):
+        BV.insert("shira")
+
+    BV.delete("shira")
+    assert BV.find("shira", 4) == False
+    assert BV.find("shira", 3) == True
+
+    for i in range(5):
+        BV.delete("shira")
+    assert BV.find("shira") == False
+    assert BV.find("shira", 0) == True
+
+# test that a full filter reports the keys it couldn't take
+def test_overflow():
+    BV = DLeftCountingBloomFilter(2, 2, 15, fingerprintBits = 16, cellsPerBucket = 1)
+    results = [BV.insert(str(i)) for i in range(10)]
+
+    # the first two keys always fit, and there's no room for all ten
+    assert results[:2] == [True, True]
+    assert results.count(False) > 0
+    for i in range(10):
+        assert BV.find(str(i)) == results[i]
+
+# test that a cell takes exactly its fingerprint and counter bits, and
+# that fingerprints and counts next to each other don't run into each other
+def test_packedCells():
+    for fingerprintBits in (8, 12, 13, 16):
+        BV = DLeftCountingBloomFilter(1000, 4, 15, fingerprintBits)
+        assert BV.numBytes() == -(-BV.numCells() * (fingerprintBits + 4) // 8)
+
+    BV = DLeftCountingBloomFilter(400, 4, 7, fingerprintBits = 13, cellsPerBucket = 2)
+    for i in range(150):
+        for j in range(i % 9):
+            assert BV.insert(str(i)) == True
+    for i in range(150):
+        assert BV.find(str(i), min(i % 9, 7)) == True
+        assert BV.find(str(i), min(i % 9, 7) + 1) == False
+    for i in range(150):
+        BV.delete(str(i))
+        assert BV.find(str(i), min(i % 9, 7) - 1) == True
+        assert BV.find(str(i), min(i % 9, 7)) == (i % 9 == 0)
+
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "dLeftCountingBloomFilter.py"])
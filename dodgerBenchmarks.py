@@ -0,0 +1,258 @@
+from dodgerGuys import GuyStore, updateGuysList, collidesList, CLOWN_SIZE, CLOWN_RADIUS
+from dodgerRender import Renderer, CountingDraw
+import dodgerEngine
+import numpy as np
+import random
+import math
+import time
+import sys
+
+# headless benchmarks for the dodger game: no window, no Draw, just the
+# game's hot paths on boards with far more guys than a real game reaches.
+# run all of them with
+#     python dodgerBenchmarks.py
+# or just some of them by name, e.g.
+#     python dodgerBenchmarks.py collision
+
+# make num guys like addGuys does, spread over the whole board
+def makeGuys(num, seed = 0):
+    rnd = random.Random(seed)
+    return [[rnd.randint(0, 505), rnd.uniform(0, 549), rnd.randint(8, 30), rnd.random() + .5, 0]
+            for i in range(num)]
+
+# the way gameOver used to check: a sqrt for every guy
+def collidesWithSqrt(playerX, playerY, guys):
+    for g in guys:
+        d = math.sqrt(((g[0]+(g[2]/2))-(playerX+25))**2 + \
+                      ((g[1]+(g[2]/2)-(playerY+25))**2))
+        if d < g[2]/2 + 18:
+            return True
+    return False
+
+# the biggest a bad guy gets (see GuyStore.add)
+MAX_GUY_SIZE = 30
+
+# a uniform grid broad phase over columns of x, y and size like GuyStore's:
+# one numpy pass puts every guy in the square cell its center is in, and a
+# stable sort on the cell numbers leaves the guys of each row of cells
+# together, in order of column. A cell is as big as the furthest a hit can
+# be from the clown's center, so a check only looks at the 3x3 cells
+# around the clown, three slices of the sorted guys.
+# the guys move every frame, so in a game the grid has to be built again
+# before every check.
+class CellGrid(object):
+
+    def __init__(self, x, y, size, width = 556, height = 600, cellSize = CLOWN_RADIUS + MAX_GUY_SIZE // 2 + 1):
+        self.__cellSize = cellSize
+        self.__cols = width // cellSize + 1
+        self.__rows = height // cellSize + 1
+
+        # a cell number of 16 bits lets numpy radix sort them
+        half = size / 2
+        cells = self.__row(y + half).astype(np.int16) * self.__cols + self.__col(x + half).astype(np.int16)
+        order = np.argsort(cells, kind = "stable")
+        self.__x, self.__y, self.__half = (x + half)[order], (y + half)[order], half[order]
+        self.__starts = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength = self.__rows * self.__cols))))
+
+    # the cell column of x and the cell row of y. anything off the grid is
+    # in the cell at its edge, which keeps the guys near the clown within a cell of it
+    def __col(self, x):
+        return np.clip(x // self.__cellSize, 0, self.__cols - 1)
+
+    def __row(self, y):
+        return np.clip(y // self.__cellSize, 0, self.__rows - 1)
+
+    # Return True if the clown at (playerX, playerY) touches any guy
+    def collides(self, playerX, playerY):
+        cx = playerX + CLOWN_SIZE / 2
+        cy = playerY + CLOWN_SIZE / 2
+        col, row = int(self.__col(cx)), int(self.__row(cy))
+        first, last = max(col - 1, 0), min(col + 1, self.__cols - 1)
+
+        for r in range(max(row - 1, 0), min(row + 1, self.__rows - 1) + 1):
+            lo = self.__starts[r * self.__cols + first]
+            hi = self.__starts[r * self.__cols + last + 1]
+            dx = self.__x[lo:hi] - cx
+            dy = self.__y[lo:hi] - cy
+            reach = self.__half[lo:hi] + CLOWN_RADIUS
+            if np.any(dx*dx + dy*dy < reach*reach):
+                return True
+        return False
+
+# microseconds per frame to check for a hit with the old sqrt loop, with
+# squared distances over a list of guys, with the columns of a GuyStore,
+# and with a CellGrid over the same columns, for boards of more and more
+# guys. "grid" builds the grid and checks once, as a frame would have to;
+# "grid check" is the check alone, on a grid built beforehand
+def benchCollision(sizes = (100, 1000, 3000, 10000), frames = 200, numSpots = 10):
+    print("collision: us per frame, %d frames, clown never touching" % frames)
+    print("%7s %10s %10s %10s %10s %10s" % ("guys", "sqrt", "squared", "store", "grid", "grid check"))
+
+    # the clown cycles through a few spots, and the guys touching any of
+    # them are left out, so every check looks at all the guys it can
+    rnd = random.Random(0)
+    spots = [(rnd.randint(0, 505), rnd.randint(1, 505)) for i in range(numSpots)]
+
+    for num in sizes:
+        guys = [g for g in makeGuys(num) if not any(collidesList(x, y, [g]) for x, y in spots)]
+        store = GuyStore()
+        for g in guys: store.put(*g)
+
+        columns = [np.array([g[i] for g in guys], dtype=float) for i in range(3)]
+        grid = CellGrid(*columns)
+        assert all(grid.collides(px, py) == store.collides(px, py)
+                   for px in range(0, 506, 10) for py in range(-20, 560, 10))
+
+        times = []
+        for check in (lambda x, y: collidesWithSqrt(x, y, guys),
+                      lambda x, y: collidesList(x, y, guys),
+                      store.collides,
+                      lambda x, y: CellGrid(*columns).collides(x, y),
+                      grid.collides):
+            start = time.perf_counter()
+            for frame in range(frames):
+                x, y = spots[frame % numSpots]
+                assert not check(x, y)
+            times.append((time.perf_counter() - start) * 1e6 / frames)
+
+        print("%7d %10.1f %10.1f %10.1f %10.1f %10.1f" % ((len(guys),) + tuple(times)))
+
+# add num guys to a list the way addGuys used to, drawing from rnd just
+# like GuyStore.add does, so both get the same guys
+def addGuysList(num, guys, rnd):
+    for i in range(num):
+        guys.append([rnd.randint(0, 505), 0, rnd.randint(8, 30), rnd.random() + .5, rnd.randrange(6)])
+
+# microseconds per frame to move the guys down (taking out the ones that
+# fell off the bottom) and to check for a hit, with guys kept as a list of
+# lists the way updateGuys used to, and with the columns of a GuyStore.
+# Both get the same new guys every frame, as many as fall off the bottom
+# at a score of 50, so the board stays at about num guys. The clown is
+# checked off the board, where nothing hits it, so every guy is looked at
+def benchGuys(sizes = (100, 1000, 3000, 10000), frames = 200):
+    print("guys: us per frame, %d frames at a score of 50" % frames)
+    print("%7s %10s %10s %10s %10s" % ("guys", "list move", "store move", "list hit", "store hit"))
+
+    for num in sizes:
+        perFrame = max(1, num // 85)
+        guys, listRnd = [], random.Random(0)
+        store, storeRnd = GuyStore(), random.Random(0)
+
+        # fill the board before timing
+        for frame in range(300):
+            addGuysList(perFrame, guys, listRnd)
+            guys = updateGuysList(guys, 50)
+            store.add(perFrame, rnd = storeRnd)
+            store.update(50)
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            addGuysList(perFrame, guys, listRnd)
+            guys = updateGuysList(guys, 50)
+        listMove = (time.perf_counter() - start) * 1e6 / frames
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            store.add(perFrame, rnd = storeRnd)
+            store.update(50)
+        storeMove = (time.perf_counter() - start) * 1e6 / frames
+        assert len(store) == len(guys)
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            assert not collidesList(frame % 505, -200, guys)
+        listHit = (time.perf_counter() - start) * 1e6 / frames
+
+        start = time.perf_counter()
+        for frame in range(frames):
+            assert not store.collides(frame % 505, -200)
+        storeHit = (time.perf_counter() - start) * 1e6 / frames
+
+        print("%7d %10.1f %10.1f %10.1f %10.1f" % (len(guys), listMove, storeMove, listHit, storeHit))
+
+# the way redrawScreen used to draw a frame: everything, from scratch
+def redrawScreenOld(draw, guys, playerX, playerY, score, bestScore):
+    draw.clear()
+    for x, y, size, color in guys:
+        draw.setColor(color)
+        draw.filledOval(x, y, size, size)
+    draw.picture("clown.gif", playerX, playerY)
+    for text, at in (("SCORE:" + str(score), (10, 10)), ("BEST SCORE:" + str(bestScore), (10, 30))):
+        draw.setFontSize(20)
+        draw.setFontBold(True)
+        draw.setFontFamily("Futura")
+        draw.setColor("yellow")
+        draw.string(text, at[0], at[1])
+    draw.show()
+
+# Draw calls, thousands of pixels painted and microseconds spent per
+# frame, drawing a game with about num guys on the board the old way and
+# with a Renderer, with no window (CountingDraw only counts the calls and
+# their pixels, so the time is what it takes to decide on the calls, not to
+# draw). "cleared" is how many of the frames the Renderer drew from scratch.
+# The clown moves every 10th frame and the score goes up every 60th, like in a game
+def benchRender(sizes = (5, 20, 50, 200), frames = 600):
+    print("render: per frame, %d frames" % frames)
+    print("%7s %10s %10s %10s %10s %10s %10s %10s" % ("guys", "old calls", "new calls", 
+          "old kpx", "new kpx", "old us", "new us", "cleared"))
+
+    for num in sizes:
+        rnd = random.Random(0)
+        store = GuyStore()
+        perSecond = max(1, num // 4)
+        for frame in range(600):
+            if frame % 60 == 0: store.add(perSecond, rnd = rnd)
+            store.update(0, 2)
+
+        # the same frames for both
+        scenes = []
+        for frame in range(frames):
+            if frame % 60 == 0: store.add(perSecond, rnd = rnd)
+            store.update(0, 2)
+            scenes.append((store.live(), 225 + 15 * (frame // 10 % 10), 505, frame // 60, 20))
+
+        oldDraw = CountingDraw()
+        start = time.perf_counter()
+        for guys, playerX, playerY, score, bestScore in scenes:
+            redrawScreenOld(oldDraw, guys, playerX, playerY, score, bestScore)
+        oldUs = (time.perf_counter() - start) * 1e6 / frames
+
+        newDraw = CountingDraw()
+        screen = Renderer(newDraw, list(range(6)), "black", "yellow")
+        start = time.perf_counter()
+        for scene in scenes:
+            screen.frame(*scene)
+        newUs = (time.perf_counter() - start) * 1e6 / frames
+
+        print("%7d %10.1f %10.1f %10.1f %10.1f %10.1f %10.1f %10d" % (len(scenes[-1][0]), 
+              oldDraw.numCalls() / frames, newDraw.numCalls() / frames, 
+              oldDraw.pixels / frames / 1e3, newDraw.pixels / frames / 1e3, 
+              oldUs, newUs, newDraw.calls["clear"]))
+
+# ticks a second of whole games with no window (see dodgerEngine.py),
+# with and without drawing every tick with a CountingDraw
+def benchEngine(numGames = 50):
+    for render in (False, True):
+        ticks, scores, timings, elapsed = dodgerEngine.runGames(numGames, render = render)
+        print("engine: %d games%s" % (numGames, ", drawing every tick" if render else ""))
+        print("\n".join(dodgerEngine.report(ticks, timings, elapsed)))
+        print()
+
+BENCHMARKS = {
+    "collision": benchCollision,
+    "guys": benchGuys,
+    "render": benchRender,
+    "engine": benchEngine,
+}
+
+def __main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit("unknown benchmark " + repr(name) + ", expected one of " + ", ".join(BENCHMARKS))
+
+        BENCHMARKS[name]()
+        print()
+
+if __name__ == '__main__':
+    __main()
@@ -0,0 +1,273 @@
+from concurrent.futures import ProcessPoolExecutor
+from dodgerGuys import GuyStore
+from dodgerRender import Renderer, CountingDraw
+import argparse
+import random
+import pytest
+import json
+import time
+
+# the dodger game with no window: everything that happens in a tick of
+# the game, which playGame in dodgerGame.py runs with Draw for the keys and
+# the screen, and which this module runs on its own, as fast as it can.
+#
+# a Game draws its guys from its own random.Random(seed), and moves only
+# by ticks, never by the clock, so the same seed and the same keys at the
+# same ticks always play out the same. Every key a Game is given is kept
+# with its tick, so a game played in the window can be saved (see
+# saveKeys, and dodgerGame.py --record) and played back here.
+#
+# run thousands of games, e.g. for 1000 games over 4 processes, drawing
+# each frame with a Renderer that only counts the Draw calls:
+#     python dodgerEngine.py --games 1000 --workers 4 --render
+# or play back a recorded game:
+#     python dodgerEngine.py --replay game.json
+# it prints how many ticks a second were simulated, and how long each of
+# the game's functions took.
+
+# the game moves in TICK_RATE ticks a second (see dodgerLoop.py)
+TICK_RATE = 60
+
+# how many frames' worth of movement a bad guy makes in a second: a guy
+# of speed 1 falls this many pixels a second at the start of the game
+GUY_SPEED = 120
+
+# the number of colors a bad guy can be
+NUM_COLORS = 6
+
+# how far the clown moves for each arrow key
+INCREMENT = 15
+
+class Game(object):
+
+    # timings, when given, is a dict that gets name -> [calls, seconds] for
+    # each of addGuys, updateGuys and gameOver
+    def __init__(self, seed = None, bestScore = 0, timings = None):
+        self.seed = seed
+        self.__rnd = random.Random(seed)
+        self.__timings = timings
+
+        # initialize the starting position of clown, and the store of bad guys
+        self.playerX = 225
+        self.playerY = 505
+        self.guys = GuyStore()
+
+        self.score = 0
+        self.bestScore = bestScore
+        self.ticks = 0        # ticks of game time since the game began
+        self.over = False
+
+        # (tick, key) for every key pressed, to play the game back
+        self.keys = []
+
+    # move the clown by the arrow key pressed, keeping it on the board
+    def press(self, key):
+        self.keys.append((self.ticks, key))
+        if key == "Right":
+            self.playerX = min(self.playerX + INCREMENT, 505)
+        elif key == "Left":
+            self.playerX = max(self.playerX - INCREMENT, 0)
+        elif key == "Up":
+            self.playerY = max(self.playerY - INCREMENT, 1)
+        elif key == "Down":
+            self.playerY = min(self.playerY + INCREMENT, 505)
+
+    # add num bad guys to the top of the board
+    def addGuys(self, num):
+        self.guys.add(num, NUM_COLORS, self.__rnd)
+
+    # take out the guys that reached the bottom, and move the rest as far
+    # as they go in one tick
+    def updateGuys(self):
+        self.guys.update(self.score, GUY_SPEED / TICK_RATE)
+
+    # Return True if the clown touches any bad guy
+    def gameOver(self):
+        return self.guys.collides(self.playerX, self.playerY)
+
+    # call method with args, adding the time it took to the timings
+    def __timed(self, method, *args):
+        start = time.perf_counter()
+        ans = method(*args)
+        t = self.__timings.setdefault(method.__name__, [0, 0.0])
+        t[0] += 1
+        t[1] += time.perf_counter() - start
+        return ans
+
+    # move the game on by one tick, and return True if the game is over.
+    # for each second the game continues, 3 bad guys are added and the
+    # score goes up by 1 point
+    def tick(self):
+        self.ticks += 1
+        timed = self.__timings is not None
+
+        if self.ticks % TICK_RATE == 0:
+            if timed: self.__timed(self.addGuys, 3)
+            else: self.addGuys(3)
+            self.score += 1
+
+        # if player exceeds the best score, save the new best score
+        if self.score >= self.bestScore:
+            self.bestScore = self.score
+
+        if timed:
+            self.__timed(self.updateGuys)
+            self.over = self.__timed(self.gameOver)
+        else:
+            self.updateGuys()
+            self.over = self.gameOver()
+        return self.over
+
+# save the seed and keys of game to path, to play it back with playBack
+def saveKeys(game, path):
+    with open(path, "w") as f:
+        json.dump({"seed": game.seed, "keys": game.keys}, f)
+
+# returns (seed, keys) saved by saveKeys
+def loadKeys(path):
+    with open(path) as f:
+        saved = json.load(f)
+    return saved["seed"], [tuple(k) for k in saved["keys"]]
+
+# returns a random stream of (tick, key), about perSecond arrow keys a
+# second for maxTicks ticks, like a player dodging at random
+def randomKeys(seed, maxTicks, perSecond = 4):
+    rnd = random.Random(seed)
+    keys = []
+    tick = 0
+    while True:
+        tick += 1 + int(rnd.expovariate(perSecond / TICK_RATE))
+        if tick >= maxTicks: return keys
+        keys.append((tick, rnd.choice(("Right", "Left", "Up", "Down"))))
+
+# play a game with seed and keys, a list of (tick, key) in tick order,
+# until it is over or maxTicks have gone by, and return the Game. With
+# timings, the game's functions are timed into it, and with render
+# every tick is drawn by a Renderer with a CountingDraw (timed as "render")
+def playBack(seed, keys, maxTicks = TICK_RATE * 600, timings = None, render = False):
+    game = Game(seed, timings = timings)
+    screen = Renderer(CountingDraw(), list(range(NUM_COLORS)), "black", "yellow") if render else None
+
+    next = 0
+    while game.ticks < maxTicks:
+        while next < len(keys) and keys[next][0] <= game.ticks:
+            game.press(keys[next][1])
+            next += 1
+        if game.tick(): break
+
+        if screen is not None:
+            start = time.perf_counter()
+            screen.frame(game.guys.live(), game.playerX, game.playerY, game.score, game.bestScore)
+            t = timings.setdefault("render", [0, 0.0])
+            t[0] += 1
+            t[1] += time.perf_counter() - start
+    return game
+
+# play the game with seed and random keys, returning its ticks, score,
+# and the timings of its functions
+def _runGame(job):
+    seed, maxTicks, render = job
+    timings = {}
+    game = playBack(seed, randomKeys(seed, maxTicks), maxTicks, timings, render)
+    return game.ticks, game.score, timings
+
+# play numGames games, seeds seed, seed + 1, ..., over workers processes
+# (or in this one, with no workers). Returns the total ticks, the scores,
+# the summed timings and the seconds it took
+def runGames(numGames, seed = 0, maxTicks = TICK_RATE * 600, workers = 0, render = False):
+    jobs = [(seed + i, maxTicks, render) for i in range(numGames)]
+    start = time.perf_counter()
+    if workers == 0:
+        results = list(map(_runGame, jobs))
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_runGame, jobs, chunksize = max(1, numGames // (4 * workers))))
+    elapsed = time.perf_counter() - start
+
+    ticks = 0
+    scores = []
+    timings = {}
+    for gameTicks, score, gameTimings in results:
+        ticks += gameTicks
+        scores.append(score)
+        for name, (calls, seconds) in gameTimings.items():
+            t = timings.setdefault(name, [0, 0.0])
+            t[0] += calls
+            t[1] += seconds
+    return ticks, scores, timings, elapsed
+
+# returns lines with the ticks a second and, for each function, its calls,
+# total seconds and microseconds a call
+def report(ticks, timings, elapsed):
+    lines = ["%d ticks in %.2f s: %.0f ticks/s" % (ticks, elapsed, ticks / elapsed if elapsed else 0)]
+    lines.append("%12s %10s %10s %10s" % ("function", "calls", "seconds", "us/call"))
+    for name, (calls, seconds) in sorted(timings.items(), key = lambda t: -t[1][1]):
+        lines.append("%12s %10d %10.3f %10.2f" % (name, calls, seconds, seconds * 1e6 / calls if calls else 0))
+    return lines
+
+def __main():
+    parser = argparse.ArgumentParser(description = "play dodger games with no window, as fast as possible")
+    parser.add_argument("--games", type = int, default = 100, help = "how many games to play, with random keys")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the first game")
+    parser.add_argument("--max-seconds", type = float, default = 600, help = "end a game after this many seconds of game time")
+    parser.add_argument("--workers", type = int, default = 0, help = "processes to play in (0 plays in this one)")
+    parser.add_argument("--render", action = "store_true", help = "draw every tick, counting the Draw calls")
+    parser.add_argument("--replay", help = "play back the game recorded in this file instead")
+    args = parser.parse_args()
+
+    maxTicks = int(args.max_seconds * TICK_RATE)
+    if args.replay:
+        seed, keys = loadKeys(args.replay)
+        timings = {}
+        start = time.perf_counter()
+        game = playBack(seed, keys, maxTicks, timings, args.render)
+        elapsed = time.perf_counter() - start
+        print("score %d after %d ticks" % (game.score, game.ticks))
+        print("\n".join(report(game.ticks, timings, elapsed)))
+        return
+
+    ticks, scores, timings, elapsed = runGames(args.games, args.seed, maxTicks, args.workers, args.render)
+    print("%d games, scores %d to %d, mean %.1f" % (len(scores), min(scores), max(scores), sum(scores) / len(scores)))
+    print("\n".join(report(ticks, timings, elapsed)))
+
+# implement pytests to check games play out the same every time
+
+# test that a game recorded key by key plays back the same, from the saved file
+def test_replay(tmp_path):
+    rnd = random.Random(5)
+    game = Game(seed = 42)
+    while not game.tick() and game.ticks < TICK_RATE * 600:
+        if rnd.random() < .05: game.press(rnd.choice(("Right", "Left", "Up", "Down")))
+    assert game.over and game.keys
+
+    path = str(tmp_path / "game.json")
+    saveKeys(game, path)
+    again = playBack(*loadKeys(path))
+    assert (again.ticks, again.score, again.playerX, again.playerY) == \
+           (game.ticks, game.score, game.playerX, game.playerY)
+    assert again.keys == game.keys
+
+    # and a different seed plays out differently
+    assert playBack(43, game.keys).ticks != game.ticks
+
+# test that the clown stays on the board
+def test_press():
+    game = Game(0)
+    for i in range(40): game.press("Right")
+    for i in range(40): game.press("Down")
+    assert (game.playerX, game.playerY) == (505, 505)
+    for i in range(40): game.press("Left")
+    for i in range(40): game.press("Up")
+    assert (game.playerX, game.playerY) == (0, 1)
+
+# test that many games play the same in worker processes, and are timed
+def test_runGames():
+    ticks, scores, timings, elapsed = runGames(6, maxTicks = TICK_RATE * 60, render = True)
+    assert (ticks, scores) == runGames(6, maxTicks = TICK_RATE * 60, workers = 2)[:2]
+    assert timings["updateGuys"][0] == timings["gameOver"][0] == ticks
+    # every tick is drawn, but the one that ends a game
+    assert ticks - 6 <= timings["render"][0] <= ticks
+    assert timings["addGuys"][0] == sum(scores)
+
+if __name__ == '__main__':
+    __main()
@@ -1,57 +1,20 @@
 
+from dodgerEngine import Game, TICK_RATE, saveKeys
+from dodgerLoop import FixedTimestep
+from dodgerRender import Renderer
+import argparse
 import Draw
 import time
-import random
-import math
+import sys
 
-Draw.setCanvasSize(550, 550)    # create the size of the game board itself
-Draw.setBackground(Draw.BLACK)  # draw backdrop of gameboard
+# the game moves in TICK_RATE ticks a second, whatever the speed of the
+# machine, and draws at most FRAME_RATE frames a second (see dodgerLoop.py).
+# what happens in a tick is up to the Game (see dodgerEngine.py)
+FRAME_RATE = 60
 
-# create a list that represents the five parameters for each bad guy:
-# its location(x,y), size, speed, and color
-def addGuys(num, guys): 
-    # create a list of random color options
-    colors = [Draw.RED, Draw.GREEN, Draw.BLUE, Draw.WHITE, Draw.VIOLET, Draw.YELLOW]
-    
-    for i in range(num):
-        guys.append( [ random.randint(0,505), # x coord
-                     0,                       # y coord 
-                     random.randint(8,30),    # size 
-                     random.random() +.5,     # speed
-                     random.choice(colors)] ) # colors 
-    return guys
-
-# draw the bad guy using parameters from the list 'guys'
-def drawGuys(guys):
-    for g in guys:                           # for each bad guy in the list of 'guys'
-        Draw.setColor(g[4])                  # choose a random color
-        Draw.filledOval(g[0],g[1],g[2],g[2]) # draw the circle
-        
-# draw the clown on the canvas, at (x,y):
-def drawPlayer(playerX,playerY):
-    Draw.picture("clown.gif",playerX,playerY)
-
-# update the list of 'guys' by removing from the list all guys that reached 
-# bottom of screen. Move bad guys down the screen as the game continues. 
-def updateGuys(guys,score):
-    # ans is the resulting list of the new bad guys
-    ans = []
-    
-    # if the bad guy has not reached the end of screen, append to new list 
-    for g in guys:     # for each bad guy in the list 'guys'
-        if g[1]<= 549: ans.append(g)
-            
-# move bad guys down the screen by adding to the y coord
-    for g in ans:
-        g[1] += g[3]  # increment the y coord of the bad guy by a random speed
-        if score >=10: g[1]+= g[3] +.1 # as game continues, increases speed 
-        if score >=20: g[1]+= g[3] +.1
-        if score >=30: g[1]+= g[3] +.1
-        if score >=40: g[1]+= g[3] +.1
-        if score >=50: g[1]+= g[3] +.1
+# the colors a bad guy can be, which the store keeps the index of
+COLORS = [Draw.RED, Draw.GREEN, Draw.BLUE, Draw.WHITE, Draw.VIOLET, Draw.YELLOW]
 
-    return ans
-    
 # Draw the score in the corner of gameboard
 def drawScore(score, gameOver = False):
     Draw.setFontSize(20)
@@ -71,39 +34,12 @@ def drawBestScore(bestScore,gameOver =False):
         Draw.string("BEST SCORE:" + str(bestScore), 200,270) 
     else: Draw.string("BEST SCORE:" + str(bestScore), 10,30)
 
-# Draw the gameboard 
-def redrawScreen (guys,playerX,playerY,score,bestScore):
-    # clear the screen
-    Draw.clear()  
-    
-    # draw the bad guys
-    drawGuys(guys)
-    
-    # Draw the clown in its new position
-    drawPlayer(playerX,playerY)
+# Draw the gameboard: the bad guys, the clown, and the score and best
+# score. screen (a Renderer, see dodgerRender.py) only draws again what
+# changed since the last frame
+def redrawScreen (screen,guys,playerX,playerY,score,bestScore):
+    screen.frame(guys.live(),playerX,playerY,score,bestScore)
     
-    # Display score and best score
-    drawScore(score)
-    drawBestScore(bestScore)
-   
-    Draw.show()
-    
-# Return True if the clown intersects any side of an incoming bad guy
-# If True is returned, the game is over and a scoreboard is drawn
-def gameOver(playerX, playerY, guys, score, bestScore):
-    for g in guys:   
-        radGuy = g[2]/2         # radius of bad guys
-        radClown = 18           # radius of clown
-        
-        # calculate the distance between clown and bad guys
-        d = math.sqrt(((g[0]+(g[2]/2))-(playerX+25))**2 + \
-                      ((g[1]+(g[2]/2)-(playerY+25))**2))
-        
-        if d < radGuy + radClown:
-            drawScoreBoard(score, bestScore)
-            return True
-    return False
-
 # Draw scoreboard for the end of game
 def drawScoreBoard(score,bestScore):
     drawBestScore(bestScore, True)
@@ -112,72 +48,55 @@ def drawScoreBoard(score,bestScore):
     Draw.show()
     time.sleep(5)
 
-def playGame(bestScore):
-    
-    # initialize the starting position of clown
-    playerX= 225 
-    playerY= 505
+# play a game until the clown hits a bad guy, and return the best score.
+# with record, the game's seed and keys are saved in that file, to play it
+# back with dodgerEngine.py --replay
+def playGame(bestScore, record = None):
     
-    # initialize the starting list of bad guys, falling 2 at a time
-    guys = []
-    num=2 
-    
-    score = 0
-    curTime = time.time()     #current time that game began
-    scoreTime = time.time()
+    # the clown starts at the bottom, with no bad guys yet
+    game = Game(seed = int(time.time() * 1000), bestScore = bestScore)
+    loop = FixedTimestep(TICK_RATE, FRAME_RATE)
+    screen = Renderer(Draw, COLORS, Draw.BLACK, Draw.YELLOW)
     
     # display the entire gameboard
-    redrawScreen(guys,playerX,playerY,score,bestScore)
+    redrawScreen(screen,game.guys,game.playerX,game.playerY,game.score,game.bestScore)
     
     # so long as the clown and a bad guy have not intersected...
-    while not gameOver(playerX, playerY, guys, score, bestScore):
+    while not game.over:
         
-        # if the user touched any arrow key ...
-        if Draw.hasNextKeyTyped():
-            
-            newKey = Draw.nextKeyTyped() # save the key that was pressed
-            # increment the clown's x or y coord by 15 when arrow is pressed
-            increment = 15               
+        # move the game on by however many ticks of time passed since the last frame
+        for i in range(loop.ticks()):
             
-            if newKey == "Right":
-                playerX += increment
-                if playerX >= 505: playerX = 505  #don't let clown go off board
-            elif newKey == "Left":
-                playerX -= increment
-                if playerX <= 0:playerX = 0            
-            elif newKey == "Up":
-                playerY -= increment
-                if playerY <=1:playerY = 1           
-            elif newKey == "Down":
-                playerY += increment
-                if playerY >= 505: playerY = 505 
-                
-        # for each second the game continues, add 3 bad guys to the list
-        if time.time() - curTime >= 1:
-            guys = addGuys(3, guys)
-            curTime = time.time()
+            # for each arrow key the user touched, move the clown
+            while Draw.hasNextKeyTyped():
+                game.press(Draw.nextKeyTyped())
             
-        # as time is increasing, increment the score by 1 point and redraw it 
-        # in the top left corner
-        if time.time() - scoreTime >= 1: 
-            score+=1
-            scoreTime = time.time()
-            drawScore(score)
-        
-        # if player exceeds the best score, save the new best score
-        if score >= bestScore:
-            bestScore = score
+            if game.tick():
+                break
         
-        # move bad guys to their new location
-        guys = updateGuys(guys,score) 
-        
-        # redraw the whole game board
-        redrawScreen(guys,playerX,playerY,score,bestScore) 
-           
-    return bestScore
+        # redraw the whole game board, and wait for the next frame
+        if not game.over:
+            redrawScreen(screen,game.guys,game.playerX,game.playerY,game.score,game.bestScore) 
+        loop.endFrame()
+    
+    # how smooth the game ran, and how hard it worked the cpu. The score
+    # board (and its 5 second pause) comes after, so it isn't a frame
+    print(loop.report(), file = sys.stderr)
+    drawScoreBoard(game.score, game.bestScore)
+    if record: saveKeys(game, record)
+    return game.bestScore
 
 def main():
+    parser = argparse.ArgumentParser(description = "dodge the bad guys with the arrow keys")
+    parser.add_argument("--record", help = "save each game's seed and keys in this file, to play back")
+    args = parser.parse_args()
+    
+    Draw.setCanvasSize(550, 550)    # create the size of the game board itself
+    Draw.setBackground(Draw.BLACK)  # draw backdrop of gameboard
+    
     bestScore = 0
     while True:
-        bestScore = playGame(bestScore)
-main()
+        bestScore = playGame(bestScore, args.record)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import numpy as np
+import random
+import pytest
+
+# the bad guys of the dodger game, kept as columns (struct of arrays)
+# instead of one 5 element list per guy: numpy arrays of x, y, size and
+# speed, and the index of each guy's color in the game's list of colors.
+# Moving, culling and checking for a hit are then one numpy pass over the
+# columns each, instead of a python loop over the guys.
+#
+# a guy that falls off the bottom leaves its slot behind, on a free list,
+# and the next new guy takes it, so the columns only grow when every slot
+# is in use. A free slot has speed 0 and y of +inf: it never moves back on
+# to the board and is never close enough to the clown to hit it.
+
+# the bottom of the board: a guy below it is gone
+BOTTOM = 549
+
+# the clown's picture is 50x50, and a guy that close to its center hits it
+CLOWN_SIZE = 50
+CLOWN_RADIUS = 18
+
+class GuyStore(object):
+
+    def __init__(self, capacity = 64):
+        self.__x = np.zeros(capacity)
+        self.__y = np.full(capacity, np.inf)
+        self.__size = np.zeros(capacity)
+        self.__speed = np.zeros(capacity)
+        self.__color = np.zeros(capacity, dtype=np.uint8)
+        self.__alive = np.zeros(capacity, dtype=bool)
+
+        # the free slots, taken from the end
+        self.__free = list(range(capacity - 1, -1, -1))
+
+    # double the number of slots
+    def __grow(self):
+        old = len(self.__x)
+        self.__x = np.concatenate((self.__x, np.zeros(old)))
+        self.__y = np.concatenate((self.__y, np.full(old, np.inf)))
+        self.__size = np.concatenate((self.__size, np.zeros(old)))
+        self.__speed = np.concatenate((self.__speed, np.zeros(old)))
+        self.__color = np.concatenate((self.__color, np.zeros(old, dtype=np.uint8)))
+        self.__alive = np.concatenate((self.__alive, np.zeros(old, dtype=bool)))
+        self.__free[:0] = range(2 * old - 1, old - 1, -1)
+
+    # add num new guys at the top of the board, drawn from rnd just the way
+    # addGuys always has: x, size, speed, then one of numColors colors
+    def add(self, num, numColors = 6, rnd = random):
+        for i in range(num):
+            self.put(rnd.randint(0, 505), 0, rnd.randint(8, 30), rnd.random() + .5, rnd.randrange(numColors))
+
+    # add one guy at (x, y), of the size, speed and color index given
+    def put(self, x, y, size, speed, color):
+        if not self.__free: self.__grow()
+        slot = self.__free.pop()
+
+        self.__x[slot] = x
+        self.__y[slot] = y
+        self.__size[slot] = size
+        self.__speed[slot] = speed
+        self.__color[slot] = color
+        self.__alive[slot] = True
+
+    # take out the guys that went past the bottom, then move the rest down.
+    # a guy moves its speed each frame, and another speed + .1 for every 10
+    # points of score, up to 50. frames scales that, for a game that moves
+    # by the time that passed rather than by the frame
+    def update(self, score, frames = 1):
+        gone = self.__alive & (self.__y > BOTTOM)
+        if gone.any():
+            slots = np.flatnonzero(gone)
+            self.__alive[slots] = False
+            self.__y[slots] = np.inf
+            self.__speed[slots] = 0
+            self.__free.extend(slots.tolist())
+
+        steps = min(score // 10, 5)
+        self.__y += (self.__speed * (1 + steps) + .1 * steps) * frames
+
+    # Return True if the clown at (playerX, playerY) touches any guy
+    def collides(self, playerX, playerY):
+        half = self.__size / 2
+        dx = self.__x + half - (playerX + CLOWN_SIZE / 2)
+        dy = self.__y + half - (playerY + CLOWN_SIZE / 2)
+        reach = half + CLOWN_RADIUS
+        return bool(np.any(dx*dx + dy*dy < reach*reach))
+
+    # returns a list of (x, y, size, color index) for every guy on the board
+    def live(self):
+        slots = np.flatnonzero(self.__alive)
+        return list(zip(self.__x[slots].tolist(), self.__y[slots].tolist(),
+                        self.__size[slots].tolist(), self.__color[slots].tolist()))
+
+    # returns how many slots there are, in use or free
+    def capacity(self):
+        return len(self.__x)
+
+    # returns the number of guys on the board
+    def __len__(self):
+        return len(self.__x) - len(self.__free)
+
+# implement pytests to check the store plays out like the list of guys did
+
+# the way updateGuys used to move a list of [x, y, size, speed, color] guys
+def updateGuysList(guys, score):
+    ans = [g for g in guys if g[1] <= BOTTOM]
+    for g in ans:
+        g[1] += g[3]
+        if score >= 10: g[1] += g[3] + .1
+        if score >= 20: g[1] += g[3] + .1
+        if score >= 30: g[1] += g[3] + .1
+        if score >= 40: g[1] += g[3] + .1
+        if score >= 50: g[1] += g[3] + .1
+    return ans
+
+# the way gameOver used to check a list of [x, y, size, ...] guys, with
+# squared distances instead of a sqrt for each
+def collidesList(playerX, playerY, guys):
+    cx = playerX + CLOWN_SIZE / 2
+    cy = playerY + CLOWN_SIZE / 2
+    for g in guys:
+        half = g[2] / 2
+        dx = g[0] + half - cx
+        dy = g[1] + half - cy
+        reach = half + CLOWN_RADIUS
+        if dx*dx + dy*dy < reach*reach:
+            return True
+    return False
+
+# test that the store has the same guys in the same places as the list
+# would, at every score, while slots are freed and taken again
+def test_matchesList():
+    store = GuyStore(4)
+    guys = []
+    most = 0
+    storeRnd, listRnd = random.Random(1), random.Random(1)
+
+    for frame in range(3000):
+        score = frame // 50
+        if frame % 20 == 0:
+            store.add(3, rnd = storeRnd)
+            for i in range(3):
+                guys.append([listRnd.randint(0, 505), 0, listRnd.randint(8, 30),
+                             listRnd.random() + .5, listRnd.randrange(6)])
+
+        store.update(score)
+        guys = updateGuysList(guys, score)
+
+        assert len(store) == len(guys)
+        most = max(most, len(guys))
+        got = sorted(store.live())
+        want = sorted((g[0], g[1], g[2], g[4]) for g in guys)
+        assert [g[:1] + g[2:] for g in got] == [g[:1] + g[2:] for g in want]
+        assert all(abs(a[1] - b[1]) < 1e-6 for a, b in zip(got, want))
+
+    # the slots of the guys that fell off were reused
+    assert store.capacity() < 2 * most
+
+# test that the store finds the same hits as checking the list of guys
+def test_collides():
+    store = GuyStore()
+    rnd = random.Random(2)
+    store.add(200, rnd = rnd)
+    for frame in range(600):
+        store.update(10)
+        guys = [[x, y, size] for x, y, size, color in store.live()]
+        for playerX in range(0, 506, 50):
+            assert store.collides(playerX, 300) == collidesList(playerX, 300, guys)
+
+    # nothing is left, and free slots never hit
+    assert len(store) == 0
+    assert not any(store.collides(x, y) for x in range(0, 506, 5) for y in range(1, 506, 5))
+
+# test hits right at the edge of touching
+def test_edge():
+    store = GuyStore()
+    store.add(1, rnd = random.Random(0))
+    x, y, size, color = store.live()[0]
+    cx, cy = x + size / 2, y + size / 2
+    reach = size / 2 + CLOWN_RADIUS
+
+    # the clown's center is at (playerX + 25, playerY + 25)
+    assert store.collides(cx - 25 + reach - .1, cy - 25) == True
+    assert store.collides(cx - 25 + reach, cy - 25) == False
+    assert store.collides(cx - 25 - reach + .1, cy - 25) == True
+
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "dodgerGuys.py"])
@@ -0,0 +1,165 @@
+import time
+import pytest
+
+# the clock of the dodger game's loop. The game moves in fixed ticks of
+# simulated time (tickRate a second) no matter how fast the machine is,
+# and draws at most frameRate frames a second, sleeping in between instead
+# of spinning. Each frame, ticks() says how many ticks of time passed since
+# the last one, and endFrame() sleeps until the next frame is due:
+#
+#     loop = FixedTimestep()
+#     while playing:
+#         for i in range(loop.ticks()):
+#             ... move everything one tick ...
+#         ... draw ...
+#         loop.endFrame()
+#
+# a machine too slow to keep up runs at most maxTicks ticks a frame and
+# lets the game slow down, rather than falling further and further behind.
+#
+# the time between frames and the time each frame spent working (not
+# sleeping) are kept, so report() can show the p50 and p99 frame times and
+# how busy the loop kept the cpu.
+class FixedTimestep(object):
+
+    # clock and sleep are only there for tests to pass fake ones
+    def __init__(self, tickRate = 60, frameRate = 60, maxTicks = 5,
+                 clock = time.perf_counter, sleep = time.sleep):
+        self.__tick = 1 / tickRate
+        self.__frame = 1 / frameRate
+        self.__maxTicks = maxTicks
+        self.__clock = clock
+        self.__sleep = sleep
+
+        # the time not yet simulated, and when the current frame started
+        self.__behind = 0.0
+        self.__frameStart = None
+
+        self.frameTimes = FrameTimes()
+        self.busyTimes = FrameTimes()
+
+    # start a frame, and return how many ticks to move everything by
+    def ticks(self):
+        now = self.__clock()
+        if self.__frameStart is None:
+            self.__frameStart = now
+            return 0
+
+        self.frameTimes.add(now - self.__frameStart)
+        self.__behind += now - self.__frameStart
+        self.__frameStart = now
+
+        n = int(self.__behind / self.__tick)
+        if n > self.__maxTicks:
+            n = self.__maxTicks
+            self.__behind = 0.0
+        else:
+            self.__behind -= n * self.__tick
+        return n
+
+    # end a frame, sleeping until the next one is due
+    def endFrame(self):
+        now = self.__clock()
+        self.busyTimes.add(now - self.__frameStart)
+        wait = self.__frameStart + self.__frame - now
+        if wait > 0: self.__sleep(wait)
+
+    # returns a line with the frame time percentiles, and the fraction of
+    # the time spent working
+    def report(self):
+        total = sum(self.frameTimes)
+        busy = sum(self.busyTimes) / total if total else 0.0
+        return "%d frames: p50 %.1f ms, p99 %.1f ms, busy %.0f%%" % (
+            len(self.frameTimes), self.frameTimes.percentile(50) * 1e3,
+            self.frameTimes.percentile(99) * 1e3, busy * 100)
+
+# the durations, in seconds, of the last maxLen frames
+class FrameTimes(object):
+
+    def __init__(self, maxLen = 100000):
+        self.__times = []
+        self.__maxLen = maxLen
+
+    # add the time of one more frame, forgetting the oldest half when full
+    def add(self, seconds):
+        if len(self.__times) >= self.__maxLen:
+            del self.__times[:self.__maxLen // 2]
+        self.__times.append(seconds)
+
+    # returns the time p percent of the frames took no longer than (0 with no frames)
+    def percentile(self, p):
+        if not self.__times: return 0.0
+        times = sorted(self.__times)
+        return times[max(0, -(-len(times) * p // 100) - 1)]
+
+    def __len__(self):
+        return len(self.__times)
+
+    def __iter__(self):
+        return iter(self.__times)
+
+# implement pytests to check the loop keeps time
+
+# a clock that only moves when told to, and sleeps by moving it
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.slept = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+
+# test that fast frames sleep to the frame rate and run one tick each
+def test_fastFrames():
+    clock = FakeClock()
+    loop = FixedTimestep(60, 60, clock = clock, sleep = clock.sleep)
+    ticks = 0
+    for frame in range(601):
+        ticks += loop.ticks()
+        clock.now += .002    # 2ms of work
+        loop.endFrame()
+
+    # 10 seconds of game time in 600 frames, most of it asleep
+    assert abs(clock.now - 100 - 601 / 60) < 1e-6
+    assert ticks in (599, 600, 601)
+    assert loop.frameTimes.percentile(50) == pytest.approx(1 / 60)
+    assert loop.busyTimes.percentile(99) == pytest.approx(.002)
+    assert "p50 16.7 ms" in loop.report() and "busy 12%" in loop.report()
+
+# test that slow frames catch up with more ticks, up to maxTicks
+def test_slowFrames():
+    clock = FakeClock()
+    loop = FixedTimestep(100, 60, maxTicks = 5, clock = clock, sleep = clock.sleep)
+    loop.ticks()
+
+    clock.now += .035
+    loop.endFrame()
+    assert loop.ticks() == 3    # 35ms is 3 ticks, with 5ms left over
+    clock.now += .017
+    loop.endFrame()
+    assert loop.ticks() == 2    # and with those 5ms, 22ms is 2 ticks
+    assert clock.slept == 0
+
+    # a frame that takes a whole second only gets 5 ticks, and the rest is dropped
+    clock.now += 1
+    loop.endFrame()
+    assert loop.ticks() == 5
+    clock.now += .005
+    loop.endFrame()
+    assert loop.ticks() == 1    # 5ms of work, then asleep to 16.7ms
+
+# test the percentiles of 1 to 100
+def test_percentile():
+    times = FrameTimes()
+    assert times.percentile(50) == 0.0
+    for t in range(1, 101): times.add(t)
+    assert times.percentile(50) == 50
+    assert times.percentile(99) == 99
+    assert times.percentile(100) == 100
+
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "dodgerLoop.py"])
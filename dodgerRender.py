@@ -0,0 +1,343 @@
+import collections
+import numpy as np
+import random
+import pytest
+
+# draws the dodger game's board, doing only the Draw calls a frame needs.
+# redrawScreen used to clear the board and draw everything on it again
+# every frame: every guy, the clown (Draw.picture, which goes back to the
+# gif file each time) and both scores, with the font set up again for each.
+# A Renderer instead remembers what it drew last frame and:
+#   - cuts the board into square tiles, and only erases (fills with the
+#     background, a rectangle of tiles at a time) and draws again the
+#     tiles something moved in or out of
+#   - draws the clown only when it moved or something was erased under it
+#   - builds the score strings only when the score changes, and draws them
+#     only then or when something was erased under them
+#   - sets the font once, and a color only when it isn't already the one set
+#
+# the guys all move every frame, so they are all drawn again either way,
+# and what erasing tiles saves over a clear is the area painted: a frame
+# costs a few more Draw calls (a rectangle per run of tiles) but paints
+# far fewer pixels. When more than maxDirty of the tiles need erasing
+# that saving is gone, so the frame is drawn from scratch, and so it is
+# every fullEvery frames in case Draw keeps everything drawn since the
+# last clear.
+#
+# draw is the Draw module, or anything with the same functions (see
+# CountingDraw, which just counts the calls and the pixels they paint). Make a new Renderer, or call
+# invalidate(), after drawing anything on the board without it.
+
+# the size of the board, and of the clown's picture
+BOARD_SIZE = 550
+CLOWN_SIZE = 50
+
+# where the scores go, and about how big 20pt bold text is per character
+SCORE_AT = (10, 10)
+BEST_SCORE_AT = (10, 30)
+CHAR_WIDTH = 16
+TEXT_HEIGHT = 24
+
+class Renderer(object):
+
+    def __init__(self, draw, colors, background, textColor, clownPicture = "clown.gif",
+                 tileSize = 25, fullEvery = 600, maxDirty = .75):
+        self.__draw = draw
+        self.__colors = colors
+        self.__background = background
+        self.__textColor = textColor
+        self.__clownPicture = clownPicture
+        self.__tileSize = tileSize
+        self.__tiles = -(-BOARD_SIZE // tileSize)
+        self.__fullEvery = fullEvery
+
+        # the most tiles a frame erases, before it clears the board instead
+        self.__maxDirty = int(maxDirty * self.__tiles * self.__tiles)
+
+        # the dirty tiles with a clean column on either side, for __eraseRects
+        self.__padded = np.zeros((self.__tiles, self.__tiles + 2), dtype=np.int8)
+
+        # the score strings, and the scores they were built for
+        self.__score = self.__bestScore = None
+        self.__scoreText = self.__bestScoreText = None
+
+        self.invalidate()
+
+    # draw the next frame from scratch
+    def invalidate(self):
+        self.__color = None
+        self.__fontSet = False
+        self.__frames = 0
+
+        # what was drawn last frame: the tiles the guys were in, the clown,
+        # and the two score strings with their boxes
+        self.__guyTiles = None
+        self.__clown = None
+        self.__texts = self.__textBoxes = None
+
+    # set the color, unless it is already set
+    def __setColor(self, color):
+        if color != self.__color:
+            self.__draw.setColor(color)
+            self.__color = color
+
+    # the (first, last) tile along one side of a box that starts at lo and is width long
+    def __span(self, lo, width):
+        last = self.__tiles - 1
+        return max(0, min(last, int(lo // self.__tileSize))), max(0, min(last, int((lo + width) // self.__tileSize)))
+
+    # the same for numpy arrays of boxes
+    def __spans(self, lo, width):
+        last = self.__tiles - 1
+        first = np.clip(lo // self.__tileSize, 0, last).astype(np.int64)
+        return first, np.clip((lo + width) // self.__tileSize, 0, last).astype(np.int64)
+
+    # mark on the grid of tiles the ones a box (x, y, width, height) is in, or partly in
+    def __mark(self, grid, box):
+        x, y, w, h = box
+        col0, col1 = self.__span(x, w)
+        row0, row1 = self.__span(y, h)
+        grid[row0:row1 + 1, col0:col1 + 1] = True
+
+    # returns a grid of the tiles (rows by columns, True for a tile some
+    # guy is in) of guys, each in a square box
+    def __tilesOfGuys(self, guys):
+        grid = np.zeros((self.__tiles, self.__tiles), dtype=bool)
+        if not guys: return grid
+
+        x, y, size, color = np.array(guys, dtype=float).T
+        col0, col1 = self.__spans(x, size)
+        row0, row1 = self.__spans(y, size)
+
+        # a guy is in every tile from (row0, col0) to (row1, col1), so
+        # mark the k-th row and column of each, for every k any guy has
+        for dr in range(int((row1 - row0).max()) + 1):
+            rows = np.minimum(row0 + dr, row1)
+            for dc in range(int((col1 - col0).max()) + 1):
+                grid[rows, np.minimum(col0 + dc, col1)] = True
+        return grid
+
+    # returns True if any of the tiles of box are dirty
+    def __touches(self, box, dirty):
+        x, y, w, h = box
+        col0, col1 = self.__span(x, w)
+        row0, row1 = self.__span(y, h)
+        return bool(dirty[row0:row1 + 1, col0:col1 + 1].any())
+
+    # returns the rectangles (first col, last col + 1, first row, last row + 1)
+    # of tiles to fill with the background to erase the dirty tiles: each
+    # run of them along a row, and the same run in the rows below it too
+    def __eraseRects(self, dirty):
+        # the runs of each row, from where a row goes from clean to dirty
+        # to where it goes back, in row order
+        padded = self.__padded
+        padded[:, 1:-1] = dirty
+        edges = np.diff(padded, axis = 1)
+        rows, firsts = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1]
+
+        rects = []
+        opened = {}    # (first col, last col + 1) -> first row of the open rectangle
+        k = 0
+        while k < len(rows):
+            row = rows[k]
+            runs = set()
+            while k < len(rows) and rows[k] == row:
+                runs.add((int(firsts[k]), int(ends[k])))
+                k += 1
+
+            # close the rectangles whose run doesn't go on into this row
+            for run in list(opened):
+                if prev != row - 1 or run not in runs:
+                    rects.append(run + (opened.pop(run), prev + 1))
+            for run in runs:
+                opened.setdefault(run, int(row))
+            prev = int(row)
+        rects.extend(run + (top, prev + 1) for run, top in opened.items())
+        return rects
+
+    # returns the score strings, building them only when a score changed
+    def __scoreTexts(self, score, bestScore):
+        if score != self.__score:
+            self.__score = score
+            self.__scoreText = "SCORE:" + str(score)
+        if bestScore != self.__bestScore:
+            self.__bestScore = bestScore
+            self.__bestScoreText = "BEST SCORE:" + str(bestScore)
+        return ((self.__scoreText, SCORE_AT), (self.__bestScoreText, BEST_SCORE_AT))
+
+    # draw the board with guys, a list of (x, y, size, color index) like
+    # GuyStore.live returns, the clown at (playerX, playerY), and the scores
+    def frame(self, guys, playerX, playerY, score, bestScore):
+        draw = self.__draw
+        guyTiles = self.__tilesOfGuys(guys)
+        clown = (playerX, playerY, CLOWN_SIZE, CLOWN_SIZE)
+        texts = self.__scoreTexts(score, bestScore)
+        textBoxes = [(at[0], at[1], CHAR_WIDTH * len(text), TEXT_HEIGHT) for text, at in texts]
+
+        full = self.__guyTiles is None or self.__frames >= self.__fullEvery
+        if not full:
+            # everything the guys left or moved into, and the clown and the
+            # scores if they changed
+            dirty = guyTiles | self.__guyTiles
+            if clown != self.__clown:
+                self.__mark(dirty, self.__clown)
+                self.__mark(dirty, clown)
+            for oldText, text, old, new in zip(self.__texts, texts, self.__textBoxes, textBoxes):
+                if oldText != text:
+                    self.__mark(dirty, old)
+                    self.__mark(dirty, new)
+            full = np.count_nonzero(dirty) > self.__maxDirty
+
+        if full:
+            draw.clear()
+            self.__frames = 0
+        else:
+            size = self.__tileSize
+            self.__setColor(self.__background)
+            for first, end, top, bottom in self.__eraseRects(dirty):
+                draw.filledRect(first * size, top * size, (end - first) * size, (bottom - top) * size)
+        self.__frames += 1
+
+        # the guys, a color at a time: all of them are in dirty tiles
+        colors = self.__colors
+        for x, y, size, color in sorted(guys, key = lambda guy: guy[3]):
+            if colors[color] != self.__color:
+                self.__setColor(colors[color])
+            draw.filledOval(x, y, size, size)
+
+        if full or self.__touches(clown, dirty):
+            draw.picture(self.__clownPicture, playerX, playerY)
+
+        for (text, at), box in zip(texts, textBoxes):
+            if full or self.__touches(box, dirty):
+                if not self.__fontSet:
+                    draw.setFontSize(20)
+                    draw.setFontBold(True)
+                    draw.setFontFamily("Futura")
+                    self.__fontSet = True
+                self.__setColor(self.__textColor)
+                draw.string(text, at[0], at[1])
+
+        draw.show()
+        self.__guyTiles, self.__clown = guyTiles, clown
+        self.__texts, self.__textBoxes = texts, textBoxes
+
+# a stand in for the Draw module that draws nothing and counts the calls
+# made to each of its functions, for running the game with no window, and
+# about how many pixels the clears, shapes and pictures would have painted
+class CountingDraw(object):
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.pixels = 0
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.calls[name] += 1
+            if name == "clear":
+                self.pixels += BOARD_SIZE * BOARD_SIZE
+            elif name == "picture":
+                self.pixels += CLOWN_SIZE * CLOWN_SIZE
+            elif name in ("filledRect", "filledOval"):
+                self.pixels += args[2] * args[3]
+        return call
+
+    # returns the number of calls made, to all the functions
+    def numCalls(self):
+        return sum(self.calls.values())
+
+# implement pytests to check the renderer draws what it has to
+
+# a stand in for Draw that keeps the calls, for checking what was drawn
+class RecordingDraw(object):
+
+    def __init__(self):
+        self.log = []
+
+    def __getattr__(self, name):
+        def call(*args):
+            self.log.append((name,) + args)
+        return call
+
+    # returns the calls made to the function called name
+    def named(self, name):
+        return [c for c in self.log if c[0] == name]
+
+# test that a frame from scratch draws everything, and that nothing is
+# drawn again when nothing changed
+def test_fullThenNothing():
+    draw = RecordingDraw()
+    r = Renderer(draw, ["red", "green"], "black", "yellow")
+    guys = [(100, 100, 20, 1), (300, 20, 10, 0), (120, 110, 15, 1)]
+
+    r.frame(guys, 225, 505, 0, 7)
+    assert len(draw.named("clear")) == 1
+    assert [c[1:] for c in draw.named("filledOval")] == [(300, 20, 10, 10), (100, 100, 20, 20), (120, 110, 15, 15)]
+    assert len(draw.named("setColor")) == 3     # green, red, and yellow for the text
+    assert [c[1] for c in draw.named("string")] == ["SCORE:0", "BEST SCORE:7"]
+    assert len(draw.named("picture")) == 1 and len(draw.named("setFontSize")) == 1
+
+    # the same frame again: only the guys' tiles are erased and redrawn
+    draw.log = []
+    r.frame(guys, 225, 505, 0, 7)
+    assert not draw.named("clear") and not draw.named("picture") and not draw.named("string")
+    assert len(draw.named("filledOval")) == 3 and draw.named("filledRect")
+    assert draw.named("show")
+
+# test that whatever was erased under the clown or the scores is drawn again
+def test_dirtyRedraws():
+    draw = RecordingDraw()
+    r = Renderer(draw, ["red"], "black", "yellow")
+    r.frame([(30, 20, 10, 0)], 225, 505, 0, 0)
+
+    # a guy moving past the scores gets them drawn again, but not the clown
+    draw.log = []
+    r.frame([(30, 22, 10, 0)], 225, 505, 0, 0)
+    assert [c[1] for c in draw.named("string")] == ["SCORE:0", "BEST SCORE:0"]
+    assert not draw.named("picture") and not draw.named("setFontSize")
+
+    # the clown moving, or a score changing, gets only that drawn again
+    draw.log = []
+    r.frame([], 240, 505, 1, 0)
+    assert draw.named("picture") == [("picture", "clown.gif", 240, 505)]
+    assert "SCORE:1" in [c[1] for c in draw.named("string")]
+
+# test that a busy board, and every fullEvery frames, is drawn from scratch
+def test_fullRedraws():
+    draw = RecordingDraw()
+    r = Renderer(draw, ["red"], "black", "yellow", fullEvery = 5)
+    everywhere = [(x, y, 30, 0) for x in range(0, 550, 50) for y in range(0, 550, 50)]
+    r.frame(everywhere, 225, 505, 0, 0)
+    r.frame(everywhere, 225, 505, 0, 0)
+    assert len(draw.named("clear")) == 2
+
+    draw.log = []
+    for i in range(10): r.frame([], 225, 505, 0, 0)
+    assert len(draw.named("clear")) == 2
+
+# test that a board of 60 falling guys, like a game a minute in, erases
+# tiles instead of clearing, and paints much less than a clear every frame
+def test_busyBoard():
+    rnd = random.Random(0)
+    guys = [[rnd.randint(0, 505), rnd.uniform(0, 549), rnd.randint(8, 30), rnd.randrange(6)] for i in range(60)]
+    draw = CountingDraw()
+    r = Renderer(draw, list(range(6)), "black", "yellow")
+    for frame in range(100):
+        for g in guys: g[1] = (g[1] + 2) % 549
+        r.frame([tuple(g) for g in guys], 225, 505, 0, 0)
+
+    assert draw.calls["clear"] == 1
+    assert draw.pixels / 100 < .6 * BOARD_SIZE * BOARD_SIZE
+
+# test that every call is counted
+def test_countingDraw():
+    draw = CountingDraw()
+    draw.clear()
+    draw.filledOval(1, 2, 3, 4)
+    draw.filledOval(1, 2, 3, 4)
+    assert draw.calls["filledOval"] == 2 and draw.numCalls() == 3
+    assert draw.pixels == BOARD_SIZE * BOARD_SIZE + 24
+
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "dodgerRender.py"])
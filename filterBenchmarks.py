@@ -0,0 +1,470 @@
+from BloomFilter import BloomFilter, FLAT, BLOCKED, LAYOUTS
+from countingBloomFilter import CountingBloomFilter
+from dLeftCountingBloomFilter import DLeftCountingBloomFilter
+from cuckooFilter import CuckooFilter
+from counterArray import CounterArray
+from bloomServer import BloomServer, BloomClient
+import multiprocessing
+import bloomHashing
+import numpy as np
+import itertools
+import platform
+import argparse
+import resource
+import asyncio
+import json
+import tempfile
+import random
+import math
+import sys
+import time
+import os
+
+# benchmarks for the filters. run all of them with
+#     python filterBenchmarks.py
+# or just some of them by name, e.g.
+#     python filterBenchmarks.py hashing
+# the suite sweeps up to --max-keys keys (10**6 unless told otherwise), and 
+# can save its results with --json, e.g.
+#     python filterBenchmarks.py suite --max-keys 1e8 --json results.json
+
+# make count synthetic keys, so the benchmarks don't depend on wordlist.txt
+def makeKeys(count, seed = 0):
+    rnd = random.Random(seed)
+    return ["%016x" % rnd.getrandbits(64) for i in range(count)]
+
+# yields the same keys as makeKeys(count, seed), chunk keys at a time, so
+# that even 10**8 keys never all have to be in memory at once
+def keyChunks(count, seed = 0, chunk = 100000):
+    rnd = random.Random(seed)
+    for first in range(0, count, chunk):
+        yield ["%016x" % rnd.getrandbits(64) for i in range(min(chunk, count - first))]
+
+# returns the average number of nanoseconds it takes to call fn on each key
+def nsPerOp(fn, keys):
+    start = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - start) * 1e9 / len(keys)
+
+# the proportion of keys that the filter (falsely) claims to have seen
+def measuredFalsePositiveRate(bf, absentKeys):
+    return sum(bf.find_many(absentKeys)) / len(absentKeys)
+
+# ns per insert and per find against numHashes for each hashing strategy,
+# and how the measured false positive rate of each strategy compares to
+# the projected one
+def benchHashing(numKeys = 20000, maxFalse = .01):
+    keys = makeKeys(numKeys, 1)
+    absent = makeKeys(numKeys, 2)
+    
+    print("hashing: %d keys, maxFalsePositive %g" % (numKeys, maxFalse))
+    print("%-8s %9s %10s %10s %10s %10s" % 
+          ("strategy", "numHashes", "insert ns", "find ns", "projected", "measured"))
+    
+    for numHashes in (1, 2, 4, 8, 12, 16):
+        for hashing in bloomHashing.STRATEGIES:
+            bf = BloomFilter(numKeys, numHashes, maxFalse, hashing)
+            insertNs = nsPerOp(bf.insert, keys)
+            findNs = nsPerOp(bf.find, keys)
+            print("%-8s %9d %10.0f %10.0f %10.5f %10.5f" % 
+                  (hashing, numHashes, insertNs, findNs, 
+                   bf.falsePositiveRate(), measuredFalsePositiveRate(bf, absent)))
+
+# returns how many keys a FLAT filter of about numBits bits is sized for
+def keysForBits(numBits, numHashes, maxFalse):
+    # N/n from equations B and D of __bitsNeeded, for large n
+    return max(1, int(numBits * -math.log(1 - maxFalse**(1/numHashes)) / numHashes))
+
+# lookup latency of FLAT against BLOCKED filters from 10**6 to 10**9 bits.
+# "find_many ns" is the whole lookup through a filter that was saved and 
+# opened again, so its bits are real pages of the file (a new bytearray is
+# one shared page of zeros, which is always in cache). That is mostly the 
+# BitHash rounds, so "probe ns" times only the numHashes bit reads per key,
+# done the same way find_many does them, over random bits of the same size.
+# the probe time is what the layout changes.
+def benchBlocked(sizes = (10**6, 10**7, 10**8, 10**9), numHashes = 7, maxFalse = .01,
+                 numLookups = 100000, hashing = bloomHashing.DOUBLE):
+    keys = makeKeys(numLookups, 3)
+    rnd = np.random.default_rng(0)
+    
+    print("blocked: numHashes %d, %d lookups, %s hashing" % (numHashes, numLookups, hashing))
+    print("%12s %-8s %12s %10s" % ("bits", "layout", "find_many ns", "probe ns"))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.bloom")
+        
+        for size in sizes:
+            numKeys = keysForBits(size, numHashes, maxFalse)
+            size -= size % 512
+            bits = rnd.integers(0, 256, size // 8, dtype = np.uint8)
+            
+            for layout in LAYOUTS:
+                BloomFilter(numKeys, numHashes, maxFalse, hashing, layout).save(path)
+                with BloomFilter.open(path) as bf:
+                    # one pass to fault the pages in, then the timed one
+                    bf.find_many(keys)
+                    start = time.perf_counter()
+                    bf.find_many(keys)
+                    findNs = (time.perf_counter() - start) * 1e9 / numLookups
+                os.remove(path)
+                
+                block = 512 if layout == BLOCKED else 0
+                positions = bloomHashing.positionsMany(keys, numHashes, size, hashing, block)
+                start = time.perf_counter()
+                for i in range(10):
+                    ((bits[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1).all(axis = 1)
+                probeNs = (time.perf_counter() - start) * 1e9 / (10 * numLookups)
+                
+                print("%12d %-8s %12.0f %10.1f" % (size, layout, findNs, probeNs))
+
+# returns how many times per second fn can be called on each key
+def opsPerSec(fn, keys):
+    return 1e9 / nsPerOp(fn, keys)
+
+# counter updates per second with the CounterArray, against the way 
+# CountingBloomFilter used to update a cell of its BitVector (slice it, 
+# int_val() it, build a new BitVector from the new count and assign it back).
+# then whole insert/find/delete ops per second of a CountingBloomFilter
+def benchCounters(numCells = 100000, numOps = 200000, numHashes = 4, maxCounts = (15, 255, 65535)):
+    from BitVector import BitVector
+    
+    rnd = random.Random(4)
+    cells = [rnd.randrange(numCells) for i in range(numOps)]
+    keys = makeKeys(numOps // 4, 4)
+    
+    print("counters: %d cells, %d counter updates, %d keys" % (numCells, numOps, len(keys)))
+    print("%9s %12s %12s %8s %12s %12s %12s" % 
+          ("maxCount", "BitVector/s", "array/s", "speedup", "insert/s", "find/s", "delete/s"))
+    
+    for maxCount in maxCounts:
+        bitsPC = CounterArray.bitsFor(maxCount)
+        
+        BV = BitVector(size = numCells * bitsPC)
+        start = time.perf_counter()
+        for cell in cells:
+            i = cell * bitsPC
+            j = i + bitsPC
+            val = BV[i:j].int_val()
+            if val < maxCount: val += 1
+            BV[i:j] = BitVector(intVal = val, size = len(BV[i:j]))
+        oldRate = numOps / (time.perf_counter() - start)
+        
+        counters = CounterArray(numCells, bitsPC)
+        start = time.perf_counter()
+        for cell in cells:
+            val = counters.get(cell)
+            if val < maxCount: counters.set(cell, val + 1)
+        newRate = numOps / (time.perf_counter() - start)
+        
+        cbf = CountingBloomFilter(numCells, numHashes, maxCount, bloomHashing.DOUBLE)
+        print("%9d %12.0f %12.0f %7.1fx %12.0f %12.0f %12.0f" % 
+              (maxCount, oldRate, newRate, newRate / oldRate, opsPerSec(cbf.insert, keys), 
+               opsPerSec(cbf.find, keys), opsPerSec(cbf.delete, keys)))
+
+# memory against measured false positive rate for the CountingBloomFilter 
+# and the d-left one, both holding the same numKeys keys.
+# "overflow" is how many inserts the d-left filter had no room for
+def benchDLeft(numKeys = 20000, maxCount = 15, numHashes = 4):
+    keys = makeKeys(numKeys, 5)
+    absent = makeKeys(numKeys, 6)
+    
+    print("dleft: %d keys, maxCount %d" % (numKeys, maxCount))
+    print("%-7s %-28s %10s %9s %9s %9s" % 
+          ("filter", "config", "bytes", "bits/key", "measured", "overflow"))
+    
+    for cellsPerKey in (4, 8, 16, 32):
+        cbf = CountingBloomFilter(numKeys * cellsPerKey, numHashes, maxCount, bloomHashing.DOUBLE)
+        cbf.insert_many(keys)
+        measured = sum(cbf.find(key) for key in absent) / numKeys
+        print("%-7s %-28s %10d %9.1f %9.5f %9s" % 
+              ("cbf", "%d cells/key, %d hashes" % (cellsPerKey, numHashes), cbf.numBytes(), 
+               8 * cbf.numBytes() / numKeys, measured, "-"))
+    
+    # the d-left filter only needs a little more than one cell per key
+    for fingerprintBits in (8, 12, 16):
+        dlcbf = DLeftCountingBloomFilter(int(numKeys * 1.25), numHashes, maxCount, fingerprintBits)
+        overflow = sum(not dlcbf.insert(key) for key in keys)
+        measured = sum(dlcbf.find(key) for key in absent) / numKeys
+        print("%-7s %-28s %10d %9.1f %9.5f %9d" % 
+              ("d-left", "%d bit fingerprints, d=%d" % (fingerprintBits, numHashes), dlcbf.numBytes(),
+               8 * dlcbf.numBytes() / numKeys, measured, overflow))
+
+# ops per second and bits per key of a CuckooFilter against a BloomFilter 
+# and a CountingBloomFilter, all sized for the same false positive rate.
+# (the Counting Bloom Filter gets the Bloom Filter's number of cells, 
+# which gives it the same false positive rate with a counter per bit.)
+# a Bloom Filter can't delete, so it has no delete column
+def benchCuckoo(numKeys = 50000, maxFalses = (.01, .001), numHashes = 7, maxCount = 15):
+    keys = makeKeys(numKeys, 7)
+    absent = makeKeys(numKeys, 8)
+    
+    print("cuckoo: %d keys" % numKeys)
+    print("%-7s %8s %9s %11s %11s %11s %9s" % 
+          ("filter", "target", "bits/key", "insert/s", "find/s", "delete/s", "measured"))
+    
+    for maxFalse in maxFalses:
+        bf = BloomFilter(numKeys, numHashes, maxFalse, bloomHashing.DOUBLE)
+        cbf = CountingBloomFilter(bf.numBytes() * 8, numHashes, maxCount, bloomHashing.DOUBLE)
+        cf = CuckooFilter(numKeys, maxFalse)
+        
+        for name, filt in (("bloom", bf), ("cbf", cbf), ("cuckoo", cf)):
+            insertRate = opsPerSec(filt.insert, keys)
+            findRate = opsPerSec(filt.find, keys)
+            measured = sum(filt.find(key) for key in absent) / numKeys
+            deleteRate = "%11.0f" % opsPerSec(filt.delete, keys) if name != "bloom" else "%11s" % "-"
+            print("%-7s %8g %9.1f %11.0f %11.0f %s %9.5f" % 
+                  (name, maxFalse, 8 * filt.numBytes() / numKeys, insertRate, findRate, 
+                   deleteRate, measured))
+
+# how far count(key) is above the real count, for ordinary and conservative
+# update, against the memory of the CountingBloomFilter. The stream has 
+# numKeys distinct keys with skewed (zipf-like) counts, as real traffic does
+def benchConservative(numKeys = 5000, numEvents = 100000, numHashes = 4, maxCount = 255):
+    keys = makeKeys(numKeys, 9)
+    rnd = random.Random(9)
+    weights = [1 / (i + 1) for i in range(numKeys)]
+    
+    counts = {}
+    for key in rnd.choices(keys, weights, k = numEvents):
+        counts[key] = counts.get(key, 0) + 1
+    
+    print("conservative: %d events over %d keys, maxCount %d" % (numEvents, len(counts), maxCount))
+    print("%10s %10s %-13s %10s %10s %10s" % 
+          ("cells", "bytes", "update", "mean err", "max err", "exact"))
+    
+    for cellsPerKey in (1, 2, 4, 8):
+        for conservative in (False, True):
+            cbf = CountingBloomFilter(numKeys * cellsPerKey, numHashes, maxCount, 
+                                      bloomHashing.DOUBLE, conservative)
+            cbf.insert_many(counts.items())
+            
+            errors = [cbf.count(key) - min(count, maxCount) for key, count in counts.items()]
+            print("%10d %10d %-13s %10.2f %10d %9.1f%%" % 
+                  (numKeys * cellsPerKey, cbf.numBytes(), "conservative" if conservative else "ordinary",
+                   sum(errors) / len(errors), max(errors), 100 * errors.count(0) / len(errors)))
+
+# run a BloomServer with a "bloom" and a "counting" filter in this (child)
+# process, sending the port it got back down conn
+def _runServer(conn, numKeys, numHashes):
+    async def run():
+        server = BloomServer({
+            "bloom": BloomFilter(numKeys, numHashes, .01, bloomHashing.DOUBLE),
+            "counting": CountingBloomFilter(numKeys * 10, numHashes, 15, bloomHashing.DOUBLE)})
+        host, port = await server.start()
+        conn.send(port)
+        await server.serve_forever()
+    asyncio.run(run())
+
+# p50 and p99 latency of a request, and keys per second, for a load of
+# clients concurrent clients each sending requests of batchSize keys
+# (a find for 3 of every 4, an insert for the other) to a server in another
+# process, over a pool of connections
+def benchServer(numKeys = 100000, numRequests = 4000, numHashes = 7, 
+                loads = ((1, 1), (16, 1), (64, 1), (16, 64), (64, 64))):
+    conn, childConn = multiprocessing.Pipe()
+    child = multiprocessing.Process(target = _runServer, args = (childConn, numKeys, numHashes), daemon = True)
+    child.start()
+    port = conn.recv()
+    keys = makeKeys(numKeys, 10)
+    
+    async def client(bc, name, latencies, requests, batchSize, seed):
+        rnd = random.Random(seed)
+        for i in range(requests):
+            batch = rnd.sample(keys, batchSize)
+            start = time.perf_counter()
+            if i % 4 == 3:
+                await bc.insert(name, batch)
+            else:
+                await bc.find(name, batch)
+            latencies.append(time.perf_counter() - start)
+    
+    async def load(name, clients, batchSize):
+        latencies = []
+        async with BloomClient(port = port, poolSize = min(clients, 8)) as bc:
+            start = time.perf_counter()
+            await asyncio.gather(*(client(bc, name, latencies, numRequests // clients, batchSize, seed)
+                                   for seed in range(clients)))
+            elapsed = time.perf_counter() - start
+        
+        latencies.sort()
+        return (latencies[len(latencies) // 2], latencies[len(latencies) * 99 // 100],
+                len(latencies) * batchSize / elapsed)
+    
+    print("server: %d requests per load, server in another process" % numRequests)
+    print("%-9s %8s %6s %10s %10s %11s" % ("filter", "clients", "batch", "p50 us", "p99 us", "keys/sec"))
+    try:
+        for name in ("bloom", "counting"):
+            for clients, batchSize in loads:
+                p50, p99, rate = asyncio.run(load(name, clients, batchSize))
+                print("%-9s %8d %6d %10.0f %10.0f %11.0f" % 
+                      (name, clients, batchSize, p50 * 1e6, p99 * 1e6, rate))
+    finally:
+        child.terminate()
+        child.join()
+
+# size of the compressed form against the raw bits, for filters filled 
+# from almost empty to full, and how fast each one answers find_many: the 
+# raw BloomFilter, the filter decoded back with from_compressed, and a
+# CompressedBloomFilter querying the compressed bytes directly
+def benchCodec(numKeys = 100000, numHashes = 7, maxFalse = .01, numLookups = 50000):
+    keys = makeKeys(numKeys, 13)
+    lookups = makeKeys(numLookups // 2, 14) + keys[:numLookups // 2]
+    
+    print("codec: filter for %d keys, numHashes %d, %d lookups" % (numKeys, numHashes, numLookups))
+    print("%8s %7s %10s %10s %7s %10s %10s %10s %12s" % 
+          ("inserted", "fill", "raw bytes", "comp bytes", "ratio", "encode ms", "decode ms", 
+           "raw find/s", "comp find/s"))
+    
+    for fraction in (.001, .01, .1, .5, 1):
+        bf = BloomFilter(numKeys, numHashes, maxFalse, bloomHashing.DOUBLE)
+        bf.insert_many(keys[:int(numKeys * fraction)])
+        
+        start = time.perf_counter()
+        data = bf.to_compressed()
+        encodeMs = (time.perf_counter() - start) * 1e3
+        start = time.perf_counter()
+        BloomFilter.from_compressed(data)
+        decodeMs = (time.perf_counter() - start) * 1e3
+        
+        # both find/s include hashing the keys, which is the same work for both
+        cbf = BloomFilter.read_compressed(data)
+        rates = []
+        for filt in (bf, cbf):
+            start = time.perf_counter()
+            filt.find_many(lookups)
+            rates.append(numLookups / (time.perf_counter() - start))
+        
+        print("%8d %7.3f %10d %10d %7.3f %10.1f %10.1f %10.0f %12.0f" % 
+              (int(numKeys * fraction), bf.numBitsSet() / (8 * bf.numBytes()), bf.numBytes(), len(data), 
+               len(data) / bf.numBytes(), encodeMs, decodeMs, rates[0], rates[1]))
+
+# returns keys per second for calling batchFn on every chunk of keyChunks(count, seed),
+# not counting the time it takes to make the keys
+def batchOpsPerSec(batchFn, count, seed):
+    elapsed = 0
+    for keys in keyChunks(count, seed):
+        start = time.perf_counter()
+        batchFn(keys)
+        elapsed += time.perf_counter() - start
+    return count / elapsed
+
+# the false positive rate a filter of numCells cells (or bits) with numKeys
+# keys in it is projected to have (equations A and C of BloomFilter)
+def projectedFalsePositiveRate(numKeys, numHashes, numCells):
+    return (1 - (1 - numHashes / numCells)**numKeys)**numHashes
+
+# runs one configuration of the suite, and returns its results as a dict.
+# each one runs in a new process (see benchSuite), so that peak RSS is its own.
+# single key ops are timed on the first 10**5 keys, batch ops on all of them,
+# and the measured false positive rate on up to 10**6 keys that were never inserted
+def _suiteRun(config):
+    kind, numKeys, numHashes, maxCount = config
+    sample = makeKeys(min(numKeys, 10**5), 11)
+    numAbsent = min(numKeys, 10**6)
+    
+    ans = {"filter": kind, "numKeys": numKeys, "numHashes": numHashes, "hashing": bloomHashing.DOUBLE}
+    if kind == "bloom":
+        filt = BloomFilter(numKeys, numHashes, .01, bloomHashing.DOUBLE)
+        ans["maxFalsePositive"] = .01
+    else:
+        # as many cells as the BloomFilter for .01 has bits
+        numCells = BloomFilter(numKeys, numHashes, .01).numBytes() * 8
+        filt = CountingBloomFilter(numCells, numHashes, maxCount, bloomHashing.DOUBLE)
+        ans.update(maxCount = maxCount, numCells = numCells)
+    
+    ans["insert_many/sec"] = batchOpsPerSec(filt.insert_many, numKeys, 11)
+    ans["find/sec"] = opsPerSec(filt.find, sample)
+    
+    absent = 0
+    for keys in keyChunks(numAbsent, 12):
+        absent += sum(filt.find_many(keys))
+    ans["measuredFalsePositive"] = absent / numAbsent
+    ans["find_many/sec"] = batchOpsPerSec(filt.find_many, numKeys, 11)
+    
+    if kind == "bloom":
+        ans["projectedFalsePositive"] = filt.falsePositiveRate()
+        ans["insert/sec"] = opsPerSec(filt.insert, sample)
+    else:
+        ans["projectedFalsePositive"] = projectedFalsePositiveRate(numKeys, numHashes, ans["numCells"])
+        ans["delete/sec"] = opsPerSec(filt.delete, sample)
+        ans["insert/sec"] = opsPerSec(filt.insert, sample)
+        ans["delete_many/sec"] = batchOpsPerSec(filt.delete_many, numKeys, 11)
+    
+    ans["bitsPerKey"] = 8 * filt.numBytes() / numKeys
+    ans["peakRssMB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return ans
+
+# throughput, memory and false positive rates of BloomFilter and 
+# CountingBloomFilter for every power of 10 keys from 10**4 up to below 
+# maxKeys and for maxKeys itself, several numHashes and (for the 
+# CountingBloomFilter) several maxCounts. With jsonPath, the results are 
+# also saved there, so runs can be diffed against each other.
+def benchSuite(maxKeys = 10**6, numHashes = (3, 7, 10), maxCounts = (15, 255), jsonPath = None):
+    if maxKeys < 1:
+        raise ValueError("maxKeys must be at least 1, not " + repr(maxKeys))
+    sizes = [10**e for e in range(4, 9) if 10**e < maxKeys] + [maxKeys]
+    configs = [("bloom", n, d, None) for n in sizes for d in numHashes] + \
+              [("counting", n, d, c) for n in sizes for d in numHashes for c in maxCounts]
+    
+    print("suite: %d to %d keys" % (sizes[0], sizes[-1]))
+    print("%-8s %10s %2s %5s %10s %10s %10s %10s %10s %7s %8s %9s %9s" % 
+          ("filter", "keys", "d", "max", "insert/s", "find/s", "delete/s", "ins_many/s", "find_many/s",
+           "bits/key", "rss MB", "projected", "measured"))
+    
+    results = []
+    # a fresh process for every configuration, one at a time
+    with multiprocessing.Pool(1, maxtasksperchild = 1) as pool:
+        for r in pool.imap(_suiteRun, configs):
+            results.append(r)
+            print("%-8s %10d %2d %5s %10.0f %10.0f %10s %10.0f %10.0f %7.2f %8.1f %9.5f %9.5f" % 
+                  (r["filter"], r["numKeys"], r["numHashes"], r.get("maxCount", "-"), 
+                   r["insert/sec"], r["find/sec"], "%.0f" % r["delete/sec"] if "delete/sec" in r else "-",
+                   r["insert_many/sec"], r["find_many/sec"], r["bitsPerKey"], r["peakRssMB"],
+                   r["projectedFalsePositive"], r["measuredFalsePositive"]))
+    
+    if jsonPath is not None:
+        with open(jsonPath, "w") as f:
+            json.dump({"python": platform.python_version(), "numpy": np.__version__,
+                       "machine": platform.machine(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, f, indent = 1)
+        print("saved to", jsonPath)
+    return results
+
+BENCHMARKS = {
+    "hashing": benchHashing,
+    "blocked": benchBlocked,
+    "counters": benchCounters,
+    "dleft": benchDLeft,
+    "cuckoo": benchCuckoo,
+    "conservative": benchConservative,
+    "server": benchServer,
+    "suite": benchSuite,
+    "codec": benchCodec,
+}
+
+def __main():
+    parser = argparse.ArgumentParser(description = "benchmarks for the filters")
+    parser.add_argument("names", nargs = "*", help = "benchmarks to run (default all): " + ", ".join(BENCHMARKS))
+    parser.add_argument("--max-keys", type = float, default = 1e6, 
+                        help = "largest number of keys for the suite (up to 1e8)")
+    parser.add_argument("--json", help = "save the suite's results to this file")
+    args = parser.parse_args()
+    
+    if args.max_keys < 1:
+        parser.error("--max-keys must be at least 1")
+    
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit("unknown benchmark " + repr(name) + ", expected one of " + ", ".join(BENCHMARKS))
+    
+    for name in names:
+        if name == "suite":
+            benchSuite(int(args.max_keys), jsonPath = args.json)
+        else:
+            BENCHMARKS[name]()
+        print()
+
+if __name__ == '__main__':
+    __main()
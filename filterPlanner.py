@@ -0,0 +1,92 @@
+import bloomHashing
+import time
+
+# picks numHashes (and with it the size) of a filter for numKeys keys and a
+# target false positive rate, within a memory budget (maxBytes), a probe
+# budget (maxProbes), and, once the hashing has been timed on this machine,
+# a time budget per operation (maxNs). BloomFilter.plan and
+# CountingBloomFilter.plan describe their filter to plan() with two functions:
+#   bytesNeeded(d, P)      bytes the filter needs with d hashes for a rate of P
+#   falsePositiveAt(d, B)  the rate a filter of B bytes with d hashes gets
+#
+# a smaller numHashes is faster (fewer probes, and for CHAINED hashing fewer
+# BitHash rounds), and the memory needed is smallest near log2(1/P). So:
+#   no memory budget   the numHashes that needs the least memory
+#   a memory budget    the smallest numHashes that fits in it
+#   too small a budget the numHashes with the lowest rate that fits, and
+#                      that rate instead of P (meetsTarget is then False)
+#   a useless budget   a ValueError, when it can't hold minBytes (one block
+#                      or cell of the filter) or every filter that fits
+#                      would have a false positive rate of 1
+
+# the most hashes plan will consider
+MAX_HASHES = 32
+
+# the (baseNs, perProbeNs) of computing positions, for each (hashing, block)
+# already timed by calibrate
+__calibrated = {}
+
+# times computing the positions of numKeys keys with 1 and with 16 hashes,
+# and returns the cost of d hashes as baseNs + d * perProbeNs.
+# Only timed once per process for each hashing and block.
+def calibrate(hashing = bloomHashing.CHAINED, block = 0, numKeys = 2000):
+    if (hashing, block) not in __calibrated:
+        keys = ["%016x" % (i * 0x9E3779B97F4A7C15 & (2**64 - 1)) for i in range(numKeys)]
+        size = 1 << 30
+
+        ns = {}
+        for d in (1, 16):
+            start = time.perf_counter()
+            for key in keys:
+                for p in bloomHashing.positions(key, d, size, hashing, block): pass
+            ns[d] = (time.perf_counter() - start) * 1e9 / numKeys
+
+        perProbe = max(0.0, (ns[16] - ns[1]) / 15)
+        __calibrated[hashing, block] = (max(0.0, ns[1] - perProbe), perProbe)
+    return __calibrated[hashing, block]
+
+# returns a dict with the chosen numHashes, the maxFalsePositive to build the
+# filter with, its numBytes, how many hashRounds an insert costs, and
+# whether it meetsTarget. With calibrate (or a maxNs, which needs it),
+# also the estimated hashNs of hashing one key on this machine.
+def plan(numKeys, maxFalsePositive, bytesNeeded, falsePositiveAt, maxBytes = None, maxProbes = None,
+         maxNs = None, hashing = bloomHashing.CHAINED, block = 0, calibrated = False, minBytes = 1):
+    if maxBytes is not None and maxBytes < minBytes:
+        raise ValueError("max_bytes=%r can't hold even one block or cell of the filter (%d bytes)" % 
+                         (maxBytes, minBytes))
+
+    cost = None
+    if calibrated or maxNs is not None:
+        base, perProbe = calibrate(hashing, block)
+        cost = lambda d: base + d * perProbe
+
+    choices = [d for d in range(1, (maxProbes or MAX_HASHES) + 1)
+               if maxNs is None or cost(d) <= maxNs]
+    if not choices:
+        raise ValueError("even 1 hash takes longer than maxNs")
+
+    sizes = {d: bytesNeeded(d, maxFalsePositive) for d in choices}
+    fits = [d for d in choices if maxBytes is None or sizes[d] <= maxBytes]
+
+    if fits:
+        if maxBytes is None:
+            d = min(fits, key = lambda d: (sizes[d], d))
+        else:
+            d = min(fits)
+        P = maxFalsePositive
+    else:
+        d = min(choices, key = lambda d: falsePositiveAt(d, maxBytes))
+        P = falsePositiveAt(d, maxBytes)
+
+        # the sizing rounds up, so make sure the filter really comes out in budget
+        while P < 1 and bytesNeeded(d, P) > maxBytes:
+            P *= 1.0001
+        if P >= 1:
+            raise ValueError("max_bytes=%d is too small for %d keys: every filter that fits "
+                             "has a false positive rate of 1" % (maxBytes, numKeys))
+
+    ans = {"numHashes": d, "maxFalsePositive": P, "numBytes": bytesNeeded(d, P),
+           "hashRounds": bloomHashing.hashRounds(hashing, d, d), "meetsTarget": bool(fits)}
+    if cost is not None:
+        ans["hashNs"] = cost(d)
+    return ans
@@ -0,0 +1,95 @@
+import bisect
+import threading
+
+# counters and latency histograms for a filter, turned on with its
+# enableStats(). A filter without stats only pays for one "is None" check
+# per call; with stats, every call also updates this object.
+#
+# counters are plain names -> running totals, e.g. "hashRounds" (BitHash
+# digests computed), "probes" (cells looked at by finds) or "saturated"
+# (increments lost because a counter was already at maxCount). Which ones
+# a filter keeps is up to the filter (see its enableStats).
+class FilterStats(object):
+
+    # upper bounds, in seconds, of the latency histogram buckets: 250ns up to
+    # about 8 seconds, doubling each time. anything slower goes in +Inf
+    BUCKETS = tuple(250e-9 * 2**i for i in range(26))
+
+    # fillRatio, when given, is called with no arguments to get the current
+    # fraction of the filter in use (set bits, or nonzero counters)
+    def __init__(self, fillRatio = None):
+        self.__fillRatio = fillRatio
+        self.__lock = threading.Lock()
+        self.reset()
+
+    # set every counter and histogram back to zero
+    def reset(self):
+        self.__counters = {}
+
+        # method -> [count per bucket (the last one is +Inf), total seconds]
+        self.__latencies = {}
+
+    # add n to the counter called name
+    def add(self, name, n = 1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + n
+
+    # record that one call of method took seconds
+    def time(self, method, seconds):
+        with self.__lock:
+            hist = self.__latencies.get(method)
+            if hist is None:
+                hist = self.__latencies[method] = [[0] * (len(self.BUCKETS) + 1), 0.0]
+            hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+            hist[1] += seconds
+
+    # returns the value of the counter called name (0 if it was never added to)
+    def get(self, name):
+        with self.__lock:
+            return self.__counters.get(name, 0)
+
+    # returns everything as a dict: the counters, the fill ratio, and for
+    # each method its number of calls, total seconds, and the count of
+    # calls in each bucket keyed by the bucket's upper bound
+    def asDict(self):
+        with self.__lock:
+            ans = {"counters": dict(self.__counters), "latencies": {}}
+            for method, (counts, total) in self.__latencies.items():
+                ans["latencies"][method] = {
+                    "calls": sum(counts), "seconds": total,
+                    "buckets": dict(zip(self.BUCKETS + (float("inf"),), counts))}
+
+        if self.__fillRatio is not None:
+            ans["fillRatio"] = self.__fillRatio()
+        return ans
+
+    # returns the stats in the Prometheus text format, every metric name
+    # starting with prefix. counters become <prefix>_<name>_total, and the
+    # latencies one <prefix>_latency_seconds histogram labelled by method
+    def prometheus(self, prefix = "bloom"):
+        stats = self.asDict()
+        lines = []
+
+        for name, value in sorted(stats["counters"].items()):
+            metric = "%s_%s_total" % (prefix, name)
+            lines.append("# TYPE %s counter" % metric)
+            lines.append("%s %d" % (metric, value))
+
+        if "fillRatio" in stats:
+            lines.append("# TYPE %s_fill_ratio gauge" % prefix)
+            lines.append("%s_fill_ratio %r" % (prefix, stats["fillRatio"]))
+
+        if stats["latencies"]:
+            metric = prefix + "_latency_seconds"
+            lines.append("# TYPE %s histogram" % metric)
+            for method, hist in sorted(stats["latencies"].items()):
+                # prometheus buckets are cumulative
+                running = 0
+                for bound, count in hist["buckets"].items():
+                    running += count
+                    le = "+Inf" if bound == float("inf") else "%g" % bound
+                    lines.append('%s_bucket{method="%s",le="%s"} %d' % (metric, method, le, running))
+                lines.append('%s_sum{method="%s"} %r' % (metric, method, hist["seconds"]))
+                lines.append('%s_count{method="%s"} %d' % (metric, method, hist["calls"]))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,196 @@
+from BloomFilter import BloomFilter
+import bloomHashing
+import itertools
+import pytest
+import math
+
+# a scalable bloom filter is a chain of ordinary Bloom Filters ("slices").
+# when the newest slice has had as many keys inserted as it was sized for,
+# a new slice is added that holds growth times more keys, with a false
+# positive rate tightening times smaller. The rates of the slices add up
+# to at most maxFalsePositive (a geometric series), so however many keys
+# get inserted, the whole filter stays under maxFalsePositive without
+# knowing the number of keys up front.
+class ScalableBloomFilter(object):
+
+    # Create a Scalable Bloom Filter whose first slice will store numKeys
+    # keys using numHashes hash functions, and that will never have a
+    # false positive rate above maxFalsePositive.
+    # All attributes must be private.
+    def __init__(self, numKeys, numHashes, maxFalsePositive, growth = 2,
+                 tightening = .5, hashing = bloomHashing.CHAINED):
+        if growth < 1:
+            raise ValueError("growth must be at least 1")
+        if not 0 < tightening < 1:
+            raise ValueError("tightening must be between 0 and 1")
+
+        # capacity, numHashes, and false positive rate of the first slice.
+        # P0 + P0*r + P0*r**2 + ... = P0/(1-r), so P0 = P*(1-r) keeps the total <= P
+        self.__firstCapacity = numKeys
+        self.__firstHashes = numHashes
+        self.__firstFalsePositive = maxFalsePositive * (1 - tightening)
+
+        self.__growth = growth
+        self.__tightening = tightening
+        self.__falsePositive = maxFalsePositive
+        self.__hashing = bloomHashing.checkHashing(hashing)
+
+        # a tighter rate with the same numHashes would need exponentially more
+        # bits per key, so like the paper each slice gets log2(1/r) more hashes
+        self.__extraHashes = max(1, round(math.log2(1 / tightening)))
+
+        # the slices, oldest first, with how many keys each one was sized
+        # for and how many have actually been inserted into it
+        self.__slices = []
+        self.__capacities = []
+        self.__counts = []
+        self.__addSlice()
+
+    # add a new, bigger and tighter, slice to the end of the chain
+    def __addSlice(self):
+        i = len(self.__slices)
+        capacity = math.ceil(self.__firstCapacity * self.__growth**i)
+        numHashes = self.__firstHashes + i * self.__extraHashes
+        falsePositive = self.__firstFalsePositive * self.__tightening**i
+
+        self.__slices.append(BloomFilter(capacity, numHashes, falsePositive, self.__hashing))
+        self.__capacities.append(capacity)
+        self.__counts.append(0)
+
+    # how many more keys the newest slice can take, adding a new slice if it is full
+    def __room(self):
+        if self.__counts[-1] >= self.__capacities[-1]:
+            self.__addSlice()
+        return self.__capacities[-1] - self.__counts[-1]
+
+    # insert the specified key into the newest slice.
+    # Like any Bloom Filter insert, it always succeeds.
+    def insert(self, key):
+        self.__room()
+        self.__slices[-1].insert(key)
+        self.__counts[-1] += 1
+
+    # insert every key of the iterable, filling each slice in turn
+    # (a new slice is only added once there is a key for it)
+    def insert_many(self, keys):
+        keys = iter(keys)
+        for first in keys:
+            batch = [first] + list(itertools.islice(keys, self.__room() - 1))
+
+            self.__slices[-1].insert_many(batch)
+            self.__counts[-1] += len(batch)
+
+    # Returns True if key MAY have been inserted into any slice.
+    # The newest slice is checked first since it is the biggest one,
+    # and it holds the most recently inserted keys.
+    def find(self, key):
+        for bf in reversed(self.__slices):
+            if bf.find(key): return True
+        return False
+
+    # returns a list with one bool per key, the same answers find would give.
+    # each slice only gets asked about the keys no newer slice has found
+    def find_many(self, keys):
+        keys = list(keys)
+        ans = [False] * len(keys)
+        left = list(range(len(keys)))
+
+        for bf in reversed(self.__slices):
+            if not left: break
+            found = bf.find_many(keys[i] for i in left)
+
+            for i, isFound in zip(left, found):
+                if isFound: ans[i] = True
+            left = [i for i, isFound in zip(left, found) if not isFound]
+
+        return ans
+
+    # Returns the PROJECTED current false positive rate: a key is a false
+    # positive if any one slice falsely finds it
+    def falsePositiveRate(self):
+        missAll = 1
+        for bf in self.__slices:
+            missAll *= 1 - bf.falsePositiveRate()
+        return 1 - missAll
+
+    # Returns the number of bits ACTUALLY set, over all slices
+    def numBitsSet(self):
+        return sum(bf.numBitsSet() for bf in self.__slices)
+
+    # Returns how many slices the filter has grown to
+    def numSlices(self):
+        return len(self.__slices)
+
+# implement pytests to check the filter grows and keeps its rate
+
+# test that a slice is added exactly when the newest one is full, each
+# growth times bigger, whether the keys come one at a time or in batches
+def test_sliceGrowth():
+    one = ScalableBloomFilter(100, 4, .01, hashing = bloomHashing.DOUBLE)
+    many = ScalableBloomFilter(100, 4, .01, hashing = bloomHashing.DOUBLE)
+    keys = ["key" + str(i) for i in range(701)]
+    
+    # slices of 100, 200 and 400 keys hold the first 700
+    for i, key in enumerate(keys):
+        one.insert(key)
+        assert one.numSlices() == (1 if i < 100 else 2 if i < 300 else 3 if i < 700 else 4)
+    
+    many.insert_many(keys[:700])
+    assert many.numSlices() == 3
+    many.insert_many(keys[700:])
+    assert many.numSlices() == 4
+    assert many.numBitsSet() == one.numBitsSet()
+
+# test that however far the filter grows, and with any tightening ratio,
+# the rates of all the slices together stay under maxFalsePositive,
+# projected and measured
+def test_compoundedBound():
+    keys = ["key" + str(i) for i in range(30000)]
+    others = ["other" + str(i) for i in range(50000)]
+    for tightening in (.5, .8, .9):
+        sbf = ScalableBloomFilter(500, 4, .01, 2, tightening, bloomHashing.DOUBLE)
+        sbf.insert_many(keys)
+        assert sbf.numSlices() == 6
+        assert sbf.falsePositiveRate() <= .01
+        assert sum(sbf.find_many(others)) / len(others) <= .01 * 1.2
+        assert all(sbf.find_many(keys))
+    
+    with pytest.raises(ValueError):
+        ScalableBloomFilter(500, 4, .01, tightening = 1)
+    with pytest.raises(ValueError):
+        ScalableBloomFilter(500, 4, .01, growth = .5)
+
+# test that find_many answers like find, for keys spread over every slice
+def test_findManyMatchesFind():
+    sbf = ScalableBloomFilter(50, 3, .05, hashing = bloomHashing.DOUBLE)
+    sbf.insert_many("key" + str(i) for i in range(1000))
+    assert sbf.numSlices() == 5
+    keys = ["key" + str(i) for i in range(0, 2000, 3)] + ["other" + str(i) for i in range(3000)]
+    assert sbf.find_many(keys) == [sbf.find(k) for k in keys]
+    assert sbf.find_many([]) == []
+
+def __main():
+
+    # start out far too small on purpose, and check that the filter grows
+    # instead of letting the false positive rate run away
+    numKeys = 100000
+    maxFalse = .05
+    SBF = ScalableBloomFilter(1000, 4, maxFalse)
+
+    file = open("wordlist.txt")
+    for i in range(numKeys):
+        SBF.insert(file.readline())
+
+    print("slices:", SBF.numSlices())
+    print("projected false positive rate:", SBF.falsePositiveRate())
+
+    found = 0
+    for i in range(numKeys):
+        if SBF.find(file.readline()):
+            found += 1
+    file.close()
+
+    print("percentage of false positives:", str((found / numKeys) * 100))
+
+if __name__ == '__main__':
+    __main()
@@ -0,0 +1,184 @@
+from counterArray import CounterArray
+import bloomHashing
+import time
+import math
+import pytest
+
+# a windowed counting bloom filter only remembers the last window inserts
+# (or, with byTime, the inserts of the last window seconds), so that
+# find(key, n) answers "was key seen at least n times recently?" without
+# anybody having to delete the old occurances one key at a time.
+#
+# the counters are kept in a ring of generations, each one a whole set of
+# numCells counters covering window/generations of the inserts. Inserts
+# only go into the newest generation, and find adds up the counts of all
+# of them. When the newest generation is full, the oldest one is wiped in
+# a single pass and becomes the newest. So memory never grows, and an
+# insert is forgotten somewhere between window - window/generations and
+# window inserts (or seconds) after it happened.
+class WindowedCountingBloomFilter(object):
+
+    # Create a windowed Counting Bloom Filter of numCells cells per
+    # generation, using numHashes hash functions, that counts each key up to
+    # maxCount and remembers the last window inserts (seconds, if byTime).
+    # clock is only there so tests can control the time.
+    # All attributes must be private.
+    def __init__(self, numCells, numHashes, maxCount, window, generations = 4, byTime = False,
+                 hashing = bloomHashing.CHAINED, clock = time.monotonic):
+        if generations < 2:
+            raise ValueError("a window needs at least 2 generations")
+
+        self.__numCells = numCells
+        self.__numHashes = numHashes
+        self.__maxCount = maxCount
+        self.__hashing = bloomHashing.checkHashing(hashing)
+
+        # the ring of generations, and which one is the newest
+        self.__gens = [CounterArray(numCells, CounterArray.bitsFor(maxCount))
+                       for i in range(generations)]
+        self.__newest = 0
+
+        # each generation covers genSize inserts, or genSize seconds
+        self.__byTime = byTime
+        self.__genSize = window / generations if byTime else math.ceil(window / generations)
+
+        # inserts into the newest generation so far, or when it started
+        self.__clock = clock
+        self.__genCount = 0
+        self.__genStart = clock() if byTime else 0
+
+    # wipe the oldest generation and make it the newest
+    def __rotate(self):
+        self.__newest = (self.__newest + 1) % len(self.__gens)
+        self.__gens[self.__newest].clear()
+        self.__genCount = 0
+
+    # for a window in seconds, rotate once for every generation that has ended
+    def __catchUp(self):
+        elapsed = self.__clock() - self.__genStart
+        if elapsed < self.__genSize: return
+
+        ended = int(elapsed // self.__genSize)
+        for i in range(min(ended, len(self.__gens))):
+            self.__rotate()
+        self.__genStart += ended * self.__genSize
+
+    # insert the specified key into the newest generation.
+    # Doesn't return anything, since an insert always succeeds!
+    def insert(self, key):
+        if self.__byTime:
+            self.__catchUp()
+        elif self.__genCount >= self.__genSize:
+            self.__rotate()
+        self.__genCount += 1
+
+        newest = self.__gens[self.__newest]
+        for moddedHashval in bloomHashing.positions(key, self.__numHashes, self.__numCells, self.__hashing):
+            integerVal = newest.get(moddedHashval)
+            if integerVal < self.__maxCount:
+                newest.set(moddedHashval, integerVal+1)
+
+    # Returns True if key has been inserted n or more times within the window.
+    # Returns False otherwise
+    def find(self, key, n = 1):
+        if self.__byTime:
+            self.__catchUp()
+
+        # the count of a cell is its count over all the generations
+        minVal = self.__maxCount
+        for moddedHashval in bloomHashing.positions(key, self.__numHashes, self.__numCells, self.__hashing):
+            integerVal = sum(gen.get(moddedHashval) for gen in self.__gens)
+            if integerVal < minVal:
+                minVal = integerVal
+
+        return minVal >= n
+
+    # delete one occurance of the key, taking it from the newest generation
+    # each cell still has a count in, and never going below zero
+    def delete(self, key):
+        if self.__byTime:
+            self.__catchUp()
+
+        numGens = len(self.__gens)
+        for moddedHashval in bloomHashing.positions(key, self.__numHashes, self.__numCells, self.__hashing):
+            for age in range(numGens):
+                gen = self.__gens[(self.__newest - age) % numGens]
+                integerVal = gen.get(moddedHashval)
+                if integerVal > 0:
+                    gen.set(moddedHashval, integerVal-1)
+                    break
+
+    # returns how many bytes the counters of all the generations take up
+    def numBytes(self):
+        return sum(gen.nbytes() for gen in self.__gens)
+
+# implement pytests to check the methods work accurately
+
+# test that old inserts are forgotten once enough newer ones have come in
+def test_windowByCount():
+    BV = WindowedCountingBloomFilter(1000, 3, 15, window = 8, generations = 4)
+    for i in range(3):
+        BV.insert("shira")
+    assert BV.find("shira", 3) == True
+
+    # 3 more inserts: still within the last 8
+    for i in range(3):
+        BV.insert("key" + str(i))
+    assert BV.find("shira", 3) == True
+
+    # enough inserts that the generation holding shira got wiped
+    for i in range(6):
+        BV.insert("key" + str(i))
+    assert BV.find("shira") == False
+
+# test that counts add up across generations, and stop at maxCount
+def test_countAcrossGenerations():
+    BV = WindowedCountingBloomFilter(1000, 3, 15, window = 40, generations = 4)
+    for i in range(12):
+        BV.insert("shira")
+
+    assert BV.find("shira", 12) == True
+    assert BV.find("shira", 13) == False
+
+    for i in range(10):
+        BV.insert("shira")
+    assert BV.find("shira", 15) == True
+    assert BV.find("shira", 16) == False
+
+# test a window in seconds, with a fake clock
+def test_windowByTime():
+    now = [0.0]
+    BV = WindowedCountingBloomFilter(1000, 3, 15, window = 10, generations = 5,
+                                     byTime = True, clock = lambda: now[0])
+    BV.insert("shira")
+    BV.insert("shira")
+
+    now[0] = 7.5
+    BV.insert("jacob")
+    assert BV.find("shira", 2) == True
+
+    now[0] = 10.5
+    assert BV.find("shira") == False
+    assert BV.find("jacob") == True
+
+    # a long quiet spell forgets everything
+    now[0] = 100
+    assert BV.find("jacob") == False
+
+# test that delete takes from what is still in the window
+def test_delete():
+    BV = WindowedCountingBloomFilter(1000, 3, 15, window = 8, generations = 4)
+    for i in range(4):
+        BV.insert("shira")
+
+    BV.delete("shira")
+    assert BV.find("shira", 4) == False
+    assert BV.find("shira", 3) == True
+
+    for i in range(5):
+        BV.delete("shira")
+    assert BV.find("shira", 0) == True
+    assert BV.find("shira") == False
+
+if __name__ == '__main__':
+    pytest.main(["-v", "-s", "windowedCountingBloomFilter.py"])